@@ -10,14 +10,14 @@ def user_creations(request):
 	Get all creations by the requesting user.
 	Requested by the module editor to choose a creation.
 	"""
-	return render(request, "creation_lab/user_creations.xml")
+	return render(request, "creation_lab/user_creations.xml", using="mln_xml")
 
 def creation(request):
 	"""
 	Get data of a specific creation.
 	Requested by pellet inductor modules to display data.
 	"""
-	return render(request, "creation_lab/creation.xml", {"creation": CreationLabCreation.objects.get(id=int(request.GET["CreationID"]))})
+	return render(request, "creation_lab/creation.xml", {"creation": CreationLabCreation.objects.get(id=int(request.GET["CreationID"]))}, using="mln_xml")
 
 
 @login_required
@@ -8,7 +8,7 @@ from django.contrib import admin
 from django.contrib.admin.helpers import ActionForm
 from django.db.models import Q
 
-from ..models.dynamic import Attachment, Friendship, Message, Profile, InventoryStack, IntegrationMessage, OAuthToken, Webhook
+from ..models.dynamic import Attachment, Friendship, Message, Profile, InventoryStack, IntegrationMessage, OAuthToken, Webhook, WebhookDelivery
 from ..models.dynamic.module import Module, module_settings_classes, ModuleSaveConcertArcade, ModuleSaveSoundtrack
 from ..models.dynamic.module_settings_arcade import DeliveryArcadeTile
 from ..models.static import Answer, BlueprintInfo, BlueprintRequirement, ItemInfo, ItemType, MessageBody, MessageBodyTheme, MessageBodyType, MessageTemplate, MessageTemplateAttachment, ModuleEditorType, ModuleHarvestYield, ModuleInfo, ModuleSetupCost, NetworkerFriendshipCondition, NetworkerFriendshipConditionSource, NetworkerMessageTriggerLegacy, NetworkerMessageAttachmentLegacy, NetworkerReply, StartingStack, Question
@@ -223,11 +223,16 @@ webhooks_admin = make_inline(Webhook)
 webhooks_admin.search_fields = "client__client_name", "user__username"
 webhooks_admin.list_filter = "type",
 
+webhook_deliveries_admin = make_inline(WebhookDelivery)
+webhook_deliveries_admin.list_display = "webhook", "created_at", "attempts", "next_attempt_at", "last_error"
+webhook_deliveries_admin.list_filter = "webhook__type",
+webhook_deliveries_admin.search_fields = "webhook__url", "last_error"
+
 oauth_tokens = make_inline(OAuthToken)
 oauth_tokens.list_display = "client", "user"
 oauth_tokens.list_display_links = "user",
 oauth_tokens.list_filter = "client",
-oauth_tokens.search_fields = "client__client_name", "user__username", "access_token"
+oauth_tokens.search_fields = "client__client_name", "user__username", "access_token_hash"
 
 # Register admin interfaces
 
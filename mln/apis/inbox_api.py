@@ -1,4 +1,6 @@
-from mln.models.dynamic import Message, User
+from django.db.models import Prefetch
+
+from mln.models.dynamic import Attachment, User
 from mln.services import message as message_services
 
 from mln.apis.utils import *
@@ -38,19 +40,25 @@ class InboxApi(View):
     return super().dispatch(request, *args, **kwargs)
 
   def get(self, request, user):
-    count_str: str = request.GET.get("count")
-    if not count_str or not count_str.isnumeric():
-      count = 0
-    else:
-      count = int(count_str)
-    if count < 0:
-      return HttpResponse(f"Count must be greater than 0: {count_str}", status=400)
-    query = Message.objects.filter(recipient=user).all()
-    result = list(reversed([
-      message_response(message)
-      for message in query
-    ][-count:]))  # returns the last N results
-    return JsonResponse(result, safe=False)
+    """
+    Returns the user's messages, newest first.
+    - limit (or count, its older name): the maximum number of messages, 0 or missing for all of them
+    - before_id: only messages older than this one, the last message of the previous page
+    Without a limit, the response is streamed.
+    """
+    limit = int_param(request, "limit" if "limit" in request.GET else "count")
+    if type(limit) is HttpResponse: return limit
+    before_id = int_param(request, "before_id")
+    if type(before_id) is HttpResponse: return before_id
+
+    messages = message_services.get_inbox(user, before_id=before_id, count=limit or None).select_related("body").prefetch_related(
+      Prefetch("attachments", queryset=Attachment.objects.select_related("item")),
+      "body__easy_replies",
+    )
+    if limit:
+      return JsonResponse([message_response(message) for message in messages], safe=False)
+    # Prefetches in chunks while streaming
+    return streaming_json_list(message_response(message) for message in messages.iterator(chunk_size=100))
 
   @method_decorator(post_json)
   @method_decorator(check_json(SEND_MESSAGE_SCHEMA))
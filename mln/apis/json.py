@@ -97,5 +97,7 @@ def attachment_request(json) -> tuple[int, int]:
 def webhook_response(webhook: Webhook): return {
   "webhook_id": webhook.id,
   "type": webhook.type.name.lower(),
+  "batch": webhook.batch,
   "access_token": webhook.access_token.access_token,
+  "access_token_hash": webhook.access_token.access_token_hash,
 }
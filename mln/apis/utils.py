@@ -6,12 +6,20 @@ from json_checker import Checker, CheckerError, OptionalKey
 
 from functools import wraps
 from typing import Any
+import hashlib
+import hmac
 import json
 
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
 from django.http import JsonResponse  # re-exported
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 
-from mln.models.dynamic import get_or_none, OAuthToken
+from mln.models.dynamic import get_or_none, hash_access_token, OAuthToken
+from mln.stamp import Stamp
 
 type Json = dict[str, Any]
 
@@ -46,6 +54,24 @@ def check_json(schema):
     return wrapper
   return decorator
 
+def int_param(request, name) -> HttpResponse | int | None:
+  """Returns the non-negative integer query parameter, None if it's missing, or '400 Bad request' if it's not a non-negative integer."""
+  value = request.GET.get(name)
+  if value is None: return None
+  if not value.isdigit():
+    return HttpResponse(f"{name} must be a non-negative integer: {value}", status=400)
+  return int(value)
+
+def streaming_json_list(items) -> StreamingHttpResponse:
+  """Returns a JSON array response that serializes the items one by one while sending them, instead of building the whole response in memory."""
+  def generate():
+    yield "["
+    for i, item in enumerate(items):
+      if i: yield ","
+      yield json.dumps(item, cls=DjangoJSONEncoder)
+    yield "]"
+  return StreamingHttpResponse(generate(), content_type="application/json")
+
 def _parse_json_request(request) -> HttpResponse | Json:
   """
   Parses a POST request and returns JSON or an error response:
@@ -91,6 +117,70 @@ def oauth_only(func):
     return func(request, access_token, *args, **kwargs)
   return wrapper
 
+def _access_token_key(access_token_hash):
+  return "mln:access_token:" + access_token_hash
+
+"""
+Cached instead of a revoked or changed token, until the cache entry would have expired.
+Since tokens are cached with add, a request that read the token before it was revoked can't cache it again.
+"""
+_REVOKED = "revoked"
+"""Touched when access tokens are revoked, if the processes don't share the default cache."""
+_stamp = Stamp("MLN_OAUTH_TOKEN_STAMP")
+
+def _cache_timeout():
+  return getattr(settings, "MLN_OAUTH_TOKEN_CACHE_TIMEOUT", 300)
+
+def _cache_is_shared():
+  """Whether the default cache is shared by all server processes. Otherwise, like the default LocMemCache, each process has a cache of its own."""
+  return not isinstance(caches["default"], LocMemCache)
+
+def _revoke_cached(keys, notify):
+  cache.set_many({key: _REVOKED for key in keys}, _cache_timeout())
+  if notify and not _cache_is_shared():
+    _stamp.touch()
+
+def evict_access_tokens(access_token_hashes):
+  """
+  Remove access tokens from the authentication cache, call this when they're deleted or changed (see signals.py).
+  They're marked as revoked in the cache immediately, and again once the transaction is committed.
+  If each process has a cache of its own, the MLN_OAUTH_TOKEN_STAMP file is also touched after the commit. Each lookup checks it, and tokens cached before it was touched are no longer used.
+  This drops all tokens cached by other processes though, a shared cache (see CACHES) only drops the changed tokens.
+  """
+  keys = [_access_token_key(access_token_hash) for access_token_hash in access_token_hashes]
+  if keys:
+    _revoke_cached(keys, notify=False)
+    transaction.on_commit(lambda: _revoke_cached(keys, notify=True))
+
+def _digest(secret):
+  return hashlib.sha256(secret.encode()).digest()
+
+def _get_access_token(access_token_raw) -> tuple[OAuthToken, bytes] | None:
+  """
+  Returns the access token and the digest of its client's secret, or None if the token doesn't exist.
+  Validated tokens are cached for MLN_OAUTH_TOKEN_CACHE_TIMEOUT seconds, as (stamp, token id, user id, client id, secret digest), so that most requests authenticate without a query.
+  Revoked tokens are rejected immediately (see evict_access_tokens). If the default cache isn't shared, this reads the MLN_OAUTH_TOKEN_STAMP file on every lookup.
+  The token's user and client are loaded when they're used.
+  """
+  access_token_hash = hash_access_token(access_token_raw)
+  key = _access_token_key(access_token_hash)
+  # read before the token, so that a token revoked in the meantime is cached with the old stamp
+  stamp = None if _cache_is_shared() else _stamp.read()
+  cached = cache.get(key)
+  if cached is None or cached == _REVOKED or cached[0] != stamp:
+    access_token = OAuthToken.objects.filter(access_token_hash=access_token_hash).select_related("client").first()
+    if access_token is None:
+      return None
+    entry = stamp, access_token.id, access_token.user_id, access_token.client_id, _digest(access_token.client.client_secret)
+    if cached is None:
+      cache.add(key, entry, _cache_timeout())
+    elif cached != _REVOKED:
+      cache.set(key, entry, _cache_timeout())
+    cached = entry
+  else:
+    access_token = OAuthToken(id=cached[1], access_token_hash=access_token_hash, user_id=cached[2], client_id=cached[3])
+  return access_token, cached[4]
+
 def _authenticate_request(request: HttpRequest) -> HttpResponse | OAuthToken:
   """
   Returns the OAuth access token associated with a request, or an error response
@@ -119,15 +209,17 @@ def _authenticate_request(request: HttpRequest) -> HttpResponse | OAuthToken:
   if scheme != "Bearer":
     return HttpResponse("Invalid Authorization header. Expected 'Bearer ACCESS_TOKEN", status=400)
 
-  access_token = get_or_none(OAuthToken, access_token=access_token_raw)
-  if not access_token:
+  result = _get_access_token(access_token_raw)
+  if not result:
     return HttpResponse("Invalid access token", status=401)
 
-  client = access_token.client
+  access_token, secret_digest = result
   api_token = request.headers.get("Api-Token")
   if not api_token:
     return HttpResponse("Missing Api-Token header", status=400)
-  elif api_token != client.client_secret:
+  elif not hmac.compare_digest(_digest(api_token), secret_digest):
     return HttpResponse("Invalid API token", status=401)
 
+  # Only the hash is stored, the token itself is only known during the request (see webhook_response)
+  access_token.access_token = access_token_raw
   return access_token
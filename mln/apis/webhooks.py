@@ -8,6 +8,7 @@ WEBHOOK_SCHEMA = {
   "webhook_url": str,
   "mln_secret": str,
   "type": str,
+  OptionalKey("batch"): bool,
 }
 
 @csrf_exempt
@@ -30,6 +31,7 @@ def register_webhook(data, access_token):
       secret=secret,
       url=url,
       type=type,
+      batch=data.get("batch", False),
     )
     return JsonResponse(webhook_response(webhook), status=201)
   except ValidationError as error:
@@ -0,0 +1,46 @@
+"""
+Micro-benchmarks for performance sensitive code paths.
+Run them with "python manage.py benchmark [name ...]". Without names, all registered benchmarks are run.
+Benchmarks are functions taking a writer function (for output lines) and are registered in the benchmarks registry below.
+"""
+import timeit
+from contextlib import contextmanager
+
+from django.db import connection
+
+from ..models.static import invalidate_catalog
+
+def measure(func, repeat=5):
+	"""Return the best time of a single call of func in seconds, with the number of calls per run chosen automatically."""
+	timer = timeit.Timer(func)
+	number, _ = timer.autorange()
+	return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def format_time(seconds):
+	for unit, factor in (("s", 1), ("ms", 1e3), ("µs", 1e6)):
+		if seconds * factor >= 1:
+			return "%.2f %s" % (seconds * factor, unit)
+	return "%.0f ns" % (seconds * 1e9)
+
+@contextmanager
+def test_database():
+	"""Run the benchmark against a fresh test database (see settings.DATABASES), so that benchmarks can create data without touching the real database."""
+	old_name = connection.settings_dict["NAME"]
+	connection.creation.create_test_db(verbosity=0, autoclobber=True)
+	invalidate_catalog()
+	try:
+		yield
+	finally:
+		connection.creation.destroy_test_db(old_name, verbosity=0)
+		invalidate_catalog()
+
+from . import cipher, friends, webhooks, writers, yields
+
+"""Benchmark registry, name -> benchmark function."""
+benchmarks = {
+	"cipher": cipher.run,
+	"friends": friends.run,
+	"webhooks": webhooks.run,
+	"xml_writers": writers.run,
+	"yields": yields.run,
+}
@@ -0,0 +1,18 @@
+"""Compare the webservice XOR codecs across payload sizes."""
+import os
+
+from . import format_time, measure
+from ..views.api.xml.cipher import codecs
+from ..views.api.xml.webservice import ENCRYPTION_KEY, ROCKET_MODULE_ENCRYPTION_KEY
+
+SIZES = 64, 1024, 16 * 1024, 64 * 1024, 256 * 1024
+
+def run(write):
+	for key_name, key in (("ENCRYPTION_KEY", ENCRYPTION_KEY), ("ROCKET_MODULE_ENCRYPTION_KEY", ROCKET_MODULE_ENCRYPTION_KEY)):
+		write("%s:" % key_name)
+		for size in SIZES:
+			data = os.urandom(size)
+			times = {name: measure(lambda codec=codec: codec(data, key)) for name, codec in codecs.items()}
+			baseline = times["loop"]
+			results = ", ".join("%s %s (%.1fx)" % (name, format_time(time), baseline / time) for name, time in times.items())
+			write("  %7i bytes: %s" % (size, results))
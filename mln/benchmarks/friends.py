@@ -0,0 +1,69 @@
+"""
+Compare the friendship lookups of are_friends and get_friendship to the previous implementations, which ran one query per direction.
+The graph has 100k friendships, with a third of them pending. Both the indexed lookups and the lookups without the friendship indexes are measured.
+"""
+import random
+
+from django.contrib.auth.models import User
+from django.db import connection
+
+from . import format_time, measure, test_database
+from ..models.dynamic import Friendship, FriendshipStatus, get_or_none
+from ..services.friend import are_friends, get_friendship
+
+USERS = 2000
+FRIENDSHIPS = 100_000
+"""Number of user pairs looked up per measured call, half of them related."""
+LOOKUPS = 100
+
+def _are_friends_two_queries(user, other_user_id):
+	return user.outgoing_friendships.filter(to_user_id=other_user_id, status=FriendshipStatus.FRIEND).exists() or user.incoming_friendships.filter(from_user_id=other_user_id, status=FriendshipStatus.FRIEND).exists()
+
+def _get_friendship_two_queries(user1, user2):
+	return get_or_none(user1.outgoing_friendships, to_user=user2, is_relation=True) or get_or_none(user2.outgoing_friendships, to_user=user1, is_relation=True)
+
+def _create_graph(rng):
+	User.objects.bulk_create(User(username="user%i" % i) for i in range(USERS))
+	user_ids = list(User.objects.values_list("id", flat=True))
+	pairs = set()
+	while len(pairs) < FRIENDSHIPS:
+		from_user_id, to_user_id = rng.sample(user_ids, 2)
+		if (to_user_id, from_user_id) not in pairs:
+			pairs.add((from_user_id, to_user_id))
+	statuses = FriendshipStatus.FRIEND, FriendshipStatus.FRIEND, FriendshipStatus.PENDING
+	Friendship.objects.bulk_create((Friendship(from_user_id=from_user_id, to_user_id=to_user_id, status=rng.choice(statuses)) for from_user_id, to_user_id in pairs), batch_size=1000)
+	return user_ids, pairs
+
+def _lookup_pairs(rng, user_ids, pairs):
+	"""Return LOOKUPS pairs of users, half of them related (in random direction), half of them unrelated."""
+	users = User.objects.in_bulk(user_ids)
+	related = rng.sample(sorted(pairs), LOOKUPS // 2)
+	related = [(user_id, other_user_id) if rng.random() < 0.5 else (other_user_id, user_id) for user_id, other_user_id in related]
+	unrelated = []
+	while len(unrelated) < LOOKUPS - len(related):
+		user_id, other_user_id = rng.sample(user_ids, 2)
+		if (user_id, other_user_id) not in pairs and (other_user_id, user_id) not in pairs:
+			unrelated.append((user_id, other_user_id))
+	return [(users[user_id], users[other_user_id]) for user_id, other_user_id in related + unrelated]
+
+def _measure(write, lookups):
+	old_time = measure(lambda: [_are_friends_two_queries(user, other_user.id) for user, other_user in lookups], repeat=3)
+	new_time = measure(lambda: [are_friends(user, other_user.id) for user, other_user in lookups], repeat=3)
+	write("    are_friends: two queries %s, one query %s (%.1fx)" % (format_time(old_time / LOOKUPS), format_time(new_time / LOOKUPS), old_time / new_time))
+	old_time = measure(lambda: [_get_friendship_two_queries(user, other_user) for user, other_user in lookups], repeat=3)
+	new_time = measure(lambda: [get_friendship(user, other_user) for user, other_user in lookups], repeat=3)
+	write("    get_friendship: two queries %s, one query %s (%.1fx)" % (format_time(old_time / LOOKUPS), format_time(new_time / LOOKUPS), old_time / new_time))
+
+def run(write):
+	rng = random.Random(0)
+	with test_database():
+		user_ids, pairs = _create_graph(rng)
+		lookups = _lookup_pairs(rng, user_ids, pairs)
+		write("  %i users, %i friendships, per lookup:" % (USERS, FRIENDSHIPS))
+		write("  with the friendship indexes")
+		_measure(write, lookups)
+		with connection.schema_editor() as schema_editor:
+			for index in Friendship._meta.indexes:
+				schema_editor.remove_index(Friendship, index)
+		write("  without the friendship indexes")
+		_measure(write, lookups)
@@ -0,0 +1,66 @@
+"""
+Compare sending webhook requests with a new connection per request (bare requests.post, as before) to the pooled keep-alive sessions of DeliveryClient, with and without batching.
+The requests go to a local HTTP server that answers immediately, so the numbers show the overhead of sending, not the time an integration takes to respond.
+Over the network, and with TLS, the connection setup saved by keep-alive is considerably more expensive than here.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from . import measure
+from ..models.dynamic import Webhook, WebhookDelivery, WebhookType
+from ..services.webhooks import DeliveryClient
+
+"""Number of events sent per measured call."""
+EVENTS = 200
+BATCH_SIZE = 50
+BODY = {"sender_username": "sender", "recipient_username": "recipient", "subject": "Test Body", "text": "Test Body", "attachment": None}
+
+class _Handler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"  # keep-alive
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers["Content-Length"]))
+		self.send_response(200)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+
+	def log_message(self, *args):
+		pass
+
+def _send_unpooled(deliveries):
+	for delivery in deliveries:
+		requests.post(delivery.webhook.url, json=delivery.body, headers={"Api-Token": delivery.webhook.secret}, timeout=5)
+
+def _send_pooled(client, deliveries):
+	for delivery in deliveries:
+		client.send([delivery])
+
+def _send_batched(client, deliveries):
+	for i in range(0, len(deliveries), BATCH_SIZE):
+		client.send(deliveries[i:i+BATCH_SIZE])
+
+def run(write):
+	server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+	thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01})
+	thread.start()
+	client = DeliveryClient(pool_size=1)
+	try:
+		url = "http://127.0.0.1:%i/webhook" % server.server_address[1]
+		webhook = Webhook(url=url, secret="secret", type=WebhookType.BADGE)
+		batch_webhook = Webhook(url=url, secret="secret", type=WebhookType.BADGE, batch=True)
+		deliveries = [WebhookDelivery(webhook=webhook, body=BODY) for _ in range(EVENTS)]
+		batch_deliveries = [WebhookDelivery(webhook=batch_webhook, body=BODY) for _ in range(EVENTS)]
+		unpooled_time = measure(lambda: _send_unpooled(deliveries), repeat=3)
+		pooled_time = measure(lambda: _send_pooled(client, deliveries), repeat=3)
+		batched_time = measure(lambda: _send_batched(client, batch_deliveries), repeat=3)
+		write("  %i events, sent one after another to a local server, events/s:" % EVENTS)
+		write("    new connection per request: %.0f" % (EVENTS / unpooled_time))
+		write("    keep-alive session: %.0f (%.1fx)" % (EVENTS / pooled_time, unpooled_time / pooled_time))
+		write("    keep-alive session, %i events per request: %.0f (%.1fx)" % (BATCH_SIZE, EVENTS / batched_time, unpooled_time / batched_time))
+	finally:
+		client.close()
+		server.shutdown()
+		server.server_close()
+		thread.join()
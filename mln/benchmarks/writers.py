@@ -0,0 +1,70 @@
+"""
+Compare the response writers to the response templates.
+Serialization is measured on its own with responses that don't need the database, and end to end with PageGetNew for pages of different sizes.
+The PageGetNew numbers include the database queries made while writing the page, which currently make up most of the time.
+"""
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from . import format_time, measure, test_database
+from ..models.dynamic import FriendshipStatus
+from ..models.dynamic.module_settings import ModuleSaveSticker
+from ..models.static import ItemInfo, ItemType, ModuleEditorType, ModuleInfo
+from ..services.inventory import add_inv_item
+from ..templatetags.mln_utils import render_to_string_stripped
+from ..views.api.xml.webservice import _webservice_unencrypted, handlers
+from ..views.api.xml.writers import write_response
+
+"""Response sizes for the serialization benchmark, in number of elements."""
+SIZES = 10, 100, 1000
+
+"""Page sizes, name -> (stickers per module, friends, inventory stacks). Every page has all 12 module slots filled with sticker modules."""
+PAGES = {
+	"small": (1, 5, 10),
+	"medium": (10, 20, 50),
+	"large": (50, 100, 200),
+}
+
+def _serialization_contexts(size):
+	yield {"request_type": "getModuleBgs", "error_msg": None, "backgrounds": list(range(size))}
+	yield {"request_type": "InventoryModuleGet", "error_msg": None, "module_stacks": [(i, i) for i in range(size)]}
+
+def _create_page(name, stickers, friends, stacks):
+	module_item = ItemInfo.objects.create(name="Sticker Module %s" % name, type=ItemType.MODULE)
+	ModuleInfo.objects.create(item=module_item, is_executable=False, editor_type=ModuleEditorType.STICKER)
+	sticker_items = [ItemInfo.objects.create(name="Sticker %s %i" % (name, i), type=ItemType.STICKER) for i in range(stacks)]
+	owner = User.objects.create(username=name)
+	owner.profile.is_networker = True # networkers don't need to own the stickers
+	owner.profile.save()
+	for item in sticker_items:
+		add_inv_item(owner, item.id)
+	for x in range(3):
+		for y in range(4):
+			module = owner.modules.create(item=module_item, pos_x=x, pos_y=y)
+			ModuleSaveSticker.objects.bulk_create(ModuleSaveSticker(module=module, item=sticker_items[i % stacks], x=i, y=i, scale_x=100, scale_y=100, rotation=0, depth=i) for i in range(stickers))
+	for i in range(friends):
+		friend = User.objects.create(username="%s_friend_%i" % (name, i))
+		owner.outgoing_friendships.create(to_user=friend, status=FriendshipStatus.FRIEND)
+	return owner
+
+def _write_times(write, label, template_time, writer_time):
+	write("  %s: template %s, writer %s (%.1fx)" % (label, format_time(template_time), format_time(writer_time), template_time / writer_time))
+
+def run(write):
+	write("Serialization only:")
+	for size in SIZES:
+		for context in _serialization_contexts(size):
+			template = handlers[context["request_type"]][1]
+			template_time = measure(lambda: render_to_string_stripped(template, context))
+			writer_time = measure(lambda: write_response(context))
+			_write_times(write, "%s, %i elements" % (context["request_type"], size), template_time, writer_time)
+
+	write("PageGetNew, including database queries:")
+	with test_database():
+		for name, (stickers, friends, stacks) in PAGES.items():
+			owner = _create_page(name, stickers, friends, stacks)
+			request = '<request type="PageGetNew" />'
+			with override_settings(MLN_XML_WRITERS=()):
+				template_time = measure(lambda: _webservice_unencrypted(owner, request))
+			writer_time = measure(lambda: _webservice_unencrypted(owner, request))
+			_write_times(write, "%s page (%i stickers/module, %i friends, %i stacks)" % (name, stickers, friends, stacks), template_time, writer_time)
@@ -0,0 +1,35 @@
+"""
+Compare calculating the yields of a page's modules one by one (calc_yield_qty and get_yield_item_id per module) to calc_yields.
+The modules aren't saved, only the static data is, so this measures the calculation without any database queries.
+"""
+from datetime import timedelta
+
+from django.utils.timezone import now
+
+from . import format_time, measure, test_database
+from ..models.dynamic.module import calc_yields, Module
+from ..models.static import get_catalog, ItemInfo, ItemType, ModuleEditorType, ModuleHarvestYield, ModuleInfo
+
+"""Number of modules on the page. A page has at most 12 module slots."""
+SIZES = 1, 4, 12
+
+def _one_by_one(modules):
+	yields = {}
+	for module in modules:
+		qty = module.calc_yield_qty()
+		if qty > 0:
+			yields[module.id] = module.get_yield_item_id(), qty
+	return yields
+
+def run(write):
+	with test_database():
+		yield_item = ItemInfo.objects.create(name="Yield Item", type=ItemType.ITEM)
+		module_item = ItemInfo.objects.create(name="Harvestable Module", type=ItemType.MODULE)
+		ModuleInfo.objects.create(item=module_item, is_executable=False, editor_type=ModuleEditorType.GENERIC)
+		ModuleHarvestYield.objects.create(item=module_item, yield_item=yield_item, max_yield=10, yield_per_day=5, clicks_per_yield=20)
+		get_catalog()
+		for size in SIZES:
+			modules = [Module(id=i, item_id=module_item.id, last_harvest_time=now() - timedelta(hours=i), clicks_since_last_harvest=i, is_setup=None) for i in range(size)]
+			one_by_one_time = measure(lambda: _one_by_one(modules))
+			bulk_time = measure(lambda: calc_yields(modules))
+			write("  %i modules: one by one %s, calc_yields %s (%.1fx)" % (size, format_time(one_by_one_time), format_time(bulk_time), one_by_one_time / bulk_time))
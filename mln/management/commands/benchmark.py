@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from mln.benchmarks import benchmarks
+
+class Command(BaseCommand):
+	help = "Run micro-benchmarks of performance sensitive code paths."
+
+	def add_arguments(self, parser):
+		parser.add_argument("names", nargs="*", choices=sorted(benchmarks), help="Benchmarks to run, defaults to all of them.")
+
+	def handle(self, *args, **options):
+		for name in options["names"] or benchmarks:
+			self.stdout.write(self.style.MIGRATE_HEADING("Benchmark: %s" % name))
+			benchmarks[name](self.stdout.write)
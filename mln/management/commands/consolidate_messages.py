@@ -1,26 +1,81 @@
-from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Min
 
-from mln.models.dynamic import Message, Profile
-from mln.services.message import consolidate
+from mln.models.dynamic import Attachment, Message
+
+"""Maximum number of messages deleted per query, to stay below the database's limit of query parameters."""
+DELETE_BATCH_SIZE = 500
 
 class Command(BaseCommand):
   """
   Consolidates all messages for all users
 
-  Loops through all messages in each user's inbox. If there is already a message in the user's inbox
-  with the same message body and sender, then consolidate this message with that one. Consolidation
-  in this case means adding this message's attachments to the existing message.
+  If a user's inbox has several messages with the same message body and sender, they are consolidated
+  into the oldest one. Consolidation in this case means adding the other messages' attachments to the
+  oldest message, and deleting the other messages.
+
+  The work is done in chunks of recipients by user id, each in its own transaction, so that the inbox
+  table isn't locked for long. Duplicates are found with one grouped query per chunk, and the attachments
+  of each group are merged with a single upsert, instead of queries per message and attachment.
+  Consolidation is idempotent: if the command is interrupted, it can be resumed with --start-user-id,
+  or just run again.
   """
+  help = "Consolidate duplicate messages (same recipient, sender and body) into one message with all attachments."
+
+  def add_arguments(self, parser):
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Number of user ids processed per transaction.")
+    parser.add_argument("--start-user-id", type=int, default=0, help="Resume at this recipient user id.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be consolidated.")
+
   def handle(self, *args, **options):
-    for profile in Profile.objects.all():
-      user = profile.user
-      if profile.is_networker: continue
-      unique_messages = {}  # {(MessageBody.id, Sender.id): Message}
-      for message in Message.objects.filter(recipient_id=user):
-        ids = (message.body.id, message.sender.id)
-        already_sent = unique_messages.get(ids)
-        if not already_sent:
-          unique_messages[ids] = message
-        else:
-          consolidate(already_sent, message)
-          message.delete()
+    chunk_size = options["chunk_size"]
+    if chunk_size < 1:
+      raise CommandError("Chunk size must be at least 1")
+    max_user_id = User.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+    total_groups = total_deleted = 0
+    for start in range(options["start_user_id"], max_user_id + 1, chunk_size):
+      end = start + chunk_size
+      with transaction.atomic():
+        groups, deleted = self.consolidate_chunk(start, end, options["dry_run"])
+      total_groups += groups
+      total_deleted += deleted
+      self.stdout.write("Users %i-%i of %i: %i duplicate groups, %i messages %s (resume with --start-user-id %i)" % (start, min(end, max_user_id + 1) - 1, max_user_id, groups, deleted, "to delete" if options["dry_run"] else "deleted", end))
+    self.stdout.write("%s %i messages into %i messages." % ("Would consolidate" if options["dry_run"] else "Consolidated", total_groups + total_deleted, total_groups))
+
+  def consolidate_chunk(self, start, end, dry_run):
+    """Consolidate the messages of recipients with start <= id < end. Returns (number of duplicate groups, number of messages deleted)."""
+    messages = Message.objects.filter(recipient_id__gte=start, recipient_id__lt=end, recipient__profile__is_networker=False)
+    # Each group of duplicates is consolidated into its oldest message
+    groups = messages.values("recipient_id", "sender_id", "body_id").annotate(keeper_id=Min("id"), count=Count("id")).filter(count__gt=1).order_by()
+    keepers = {}
+    duplicate_count = 0
+    for group in groups:
+      keepers[group["recipient_id"], group["sender_id"], group["body_id"]] = group["keeper_id"]
+      duplicate_count += group["count"] - 1
+    if not keepers or dry_run:
+      return len(keepers), duplicate_count
+
+    keeper_ids = {}  # {message id: id of the message it's consolidated into}
+    for id, recipient_id, sender_id, body_id in messages.values_list("id", "recipient_id", "sender_id", "body_id"):
+      keeper_id = keepers.get((recipient_id, sender_id, body_id))
+      if keeper_id is not None:
+        keeper_ids[id] = keeper_id
+
+    # Sum up the attachments of each group, including the ones already attached to the kept message
+    totals = {}
+    changed = set()
+    for message_id, item_id, qty in Attachment.objects.filter(message__in=messages).values_list("message_id", "item_id", "qty"):
+      keeper_id = keeper_ids.get(message_id)
+      if keeper_id is None:
+        continue
+      totals[keeper_id, item_id] = totals.get((keeper_id, item_id), 0) + qty
+      if message_id != keeper_id:
+        changed.add((keeper_id, item_id))
+    Attachment.objects.bulk_create((Attachment(message_id=keeper_id, item_id=item_id, qty=totals[keeper_id, item_id]) for keeper_id, item_id in changed), update_conflicts=True, unique_fields=("message", "item"), update_fields=("qty",))
+
+    duplicate_ids = [id for id, keeper_id in keeper_ids.items() if id != keeper_id]
+    for i in range(0, len(duplicate_ids), DELETE_BATCH_SIZE):
+      Message.objects.filter(id__in=duplicate_ids[i:i+DELETE_BATCH_SIZE]).delete()
+    return len(keepers), len(duplicate_ids)
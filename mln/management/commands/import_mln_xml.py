@@ -1,9 +1,10 @@
 import xml.etree.ElementTree as et
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from mln.models.static import Answer, BlueprintInfo, BlueprintRequirement, Color, ItemInfo, ItemType, MessageBody, MessageBodyCategory, MessageTemplate, MessageTemplateAttachment, ModuleEditorType, ModuleHarvestYield, ModuleInfo, ModuleOutcome, ModuleSetupCost, ModuleSkin, StartingStack, Question
-from mln.models.static.module_handlers import ModuleExecutionCost, ModuleGuestYield, ModuleMessage, ModuleOwnerYield
+from mln.models.static import Answer, BlueprintInfo, BlueprintRequirement, Color, ItemInfo, ItemType, MessageBody, MessageBodyCategory, MessageTemplate, MessageTemplateAttachment, ModuleEditorType, ModuleHarvestYield, ModuleInfo, ModuleOutcome, ModuleSetupCost, ModuleSkin, reload_catalog, StartingStack, Question
+from mln.models.static.module_handlers import ModuleExecutionCost, ModuleGuestYield, ModuleMessage, ModuleOwnerYield, YieldSampler
 
 href_types = {
 	"Concert I Arcade Game": ModuleEditorType.CONCERT_I_ARCADE,
@@ -32,13 +33,51 @@ href_types = {
 	"Trio Performance Module": ModuleEditorType.TRIO_PERFORMANCE,
 }
 
+EasyReply = MessageBody.easy_replies.through
+"""Tables filled from the XML, in the order they're created in. Module messages are handled separately, since their templates have no id in the XML."""
+tables = MessageBodyCategory, MessageBody, EasyReply, ItemInfo, BlueprintInfo, BlueprintRequirement, ModuleInfo, ModuleExecutionCost, ModuleGuestYield, ModuleHarvestYield, ModuleOwnerYield, ModuleSetupCost, Question, Answer, Color, ModuleSkin, StartingStack
+
+"""
+How --diff matches rows: (key fields, fields set from the XML, deletion scope).
+Only the fields set from the XML are compared and updated, so fields edited in the admin interface (like message body notes) are kept.
+Rows missing from the XML are only deleted if their first key field is in the deletion scope: "all" for tables only filled from the XML, otherwise the name of a set of ids read from the XML (see Command.scopes). Rows of tables without scope are never deleted, since user data refers to them.
+"""
+diff_specs = {
+	MessageBodyCategory: (("id",), ("name", "hidden", "background_color", "button_color", "text_color"), None),
+	MessageBody: (("id",), ("category_id", "subject", "text"), None),
+	EasyReply: (("from_messagebody_id", "to_messagebody_id"), (), "bodies"),
+	ItemInfo: (("id",), ("name", "type"), None),
+	BlueprintInfo: (("item_id",), ("build_id",), "blueprints"),
+	BlueprintRequirement: (("blueprint_item_id", "item_id"), ("qty",), "blueprints"),
+	ModuleInfo: (("item_id",), ("is_executable", "editor_type", "click_outcome"), None),
+	ModuleExecutionCost: (("module_item_id", "item_id"), ("qty",), "modules"),
+	ModuleGuestYield: (("module_item_id", "item_id"), ("qty", "probability"), "modules"),
+	ModuleHarvestYield: (("item_id",), ("yield_item_id", "max_yield", "yield_per_day", "clicks_per_yield"), "modules"),
+	ModuleOwnerYield: (("module_item_id", "item_id"), ("qty", "probability"), "modules"),
+	ModuleSetupCost: (("module_item_id", "item_id"), ("qty",), "modules"),
+	Question: (("id",), ("text", "mandatory"), None),
+	Answer: (("id",), ("question_id", "text"), None),
+	Color: (("id",), ("color",), None),
+	ModuleSkin: (("id",), ("name",), None),
+	StartingStack: (("item_id",), ("qty",), "all"),
+}
+
 class Command(BaseCommand):
+	"""
+	Imports MLN's static data from the editorial XML file.
+
+	The file is read in a single streaming pass: each record (message category, item, question, ...) is handled as soon as it's parsed and then discarded, so the whole document is never held in memory.
+	By default, only rows that don't exist yet are created, so importing the same file again does nothing.
+	With --diff, the DB is updated to match the file instead: rows that were added, changed or removed in the file are created, updated or deleted, in batched transactions.
+	"""
 	help = "Initialize the DB from the data in the MLN XML file."
 
 	def add_arguments(self, parser):
 		parser.add_argument("path")
+		parser.add_argument("--diff", action="store_true", help="Update existing data to match the file, creating, updating and deleting only the rows that changed.")
+		parser.add_argument("--batch-size", type=int, default=500, help="Number of rows written per transaction with --diff.")
 
-	def get_module_click_outcome(self, item_info):
+	def get_module_click_outcome(self, id, item_info):
 		is_executable = item_info.get("isExecutable") == "True"
 		yield_elem = item_info.find("yield")
 
@@ -62,166 +101,285 @@ class Command(BaseCommand):
 		return click_outcome
 
 	def handle(self, *args, **options):
-		EasyReply = MessageBody.easy_replies.through
-		message_tables = MessageBodyCategory, MessageBody
-		tables = ItemInfo, BlueprintInfo, BlueprintRequirement, MessageTemplate, MessageTemplateAttachment, ModuleInfo, ModuleExecutionCost, ModuleGuestYield, ModuleHarvestYield, ModuleMessage, ModuleOwnerYield, ModuleSetupCost, EasyReply, Question, Answer, Color, ModuleSkin, StartingStack
-		t = {}
-		for table in tables:
-			t[table] = []
-		message_tables_items = {}
-		for table in message_tables:
-			message_tables_items[table] = []
-
-		xml = et.parse(options["path"])
-
-		for category in xml.findall("messages/category"):
-			category_id = int(category.get("id"))
-			name = category.get("name")
-			hidden = category.get("hidden") is not None
-			background_color = int(category.get("Category_Background_Color"), 16)
-			button_color = category.get("Category_Button_Color").strip()
-			button_color = int(button_color, 16) if button_color else 0
-			text_color = category.get("Category_Text_Color").strip()
-			text_color = int(text_color, 16) if text_color else 0
-			message_tables_items[MessageBodyCategory].append(MessageBodyCategory(id=category_id, name=name, hidden=hidden, background_color=background_color, button_color=button_color, text_color=text_color))
-
-			for body in category:
-				id = int(body.get("id"))
-				subject = body.get("subject")
-				if subject == "":
-					continue
-				text = body.get("text")
-				message_tables_items[MessageBody].append(MessageBody(id=id, category_id=category_id, subject=subject, text=text))
-
-		# Messages must be created first to reduce constraint violations later with friend yields.
-		message_tables_items[MessageBody].append(MessageBody(id=1, category_id=1, subject="Placeholder", text="This should not appear"))
-		for key, value in message_tables_items.items():
-			key.objects.bulk_create(value, ignore_conflicts=True)
-
-		for body_elem in xml.findall("messages/category/body"):
-			from_id = int(body_elem.get("id"))
-			for easy_reply in body_elem.findall("easyReplies/easyReply"):
+		if options["batch_size"] < 1:
+			raise CommandError("Batch size must be at least 1")
+		self.rows = {table: [] for table in tables}
+		self.friend_yields = {}  # {module item id: (item id, qty)}
+		self.scopes = {"bodies": set(), "blueprints": set(), "modules": set()}
+		self.parse(options["path"])
+		# Placeholder body for messages without a body in the XML
+		self.add(MessageBody, id=1, category_id=1, subject="Placeholder", text="This should not appear")
+		self.check_guest_yields()
+
+		if options["diff"]:
+			self.apply_diff(options["batch_size"])
+		else:
+			with transaction.atomic():
+				self.create_missing()
+
+		# static data was bulk created, which doesn't reload the catalog by itself
+		reload_catalog()
+		self.stdout.write("Import successful.")
+
+	def add(self, table, **fields):
+		"""Add a row read from the XML. Rows are kept as dicts, model instances are only created for rows that are written."""
+		self.rows[table].append(fields)
+
+	def parse(self, path):
+		"""Read the file in a single pass, handing each record to its reader once it's complete and discarding it afterwards."""
+		readers = {
+			"messages/category": self.read_category,
+			"items/item": self.read_item,
+			"questions/question": self.read_question,
+			"colors/color": self.read_color,
+			"skins/skin": self.read_skin,
+			"startingStacks/stack": self.read_starting_stack,
+		}
+		tags = []
+		elements = []
+		for event, elem in et.iterparse(path, events=("start", "end")):
+			if event == "start":
+				tags.append(elem.tag)
+				elements.append(elem)
+				continue
+			reader = readers.get("/".join(tags[1:]))  # path without the root element
+			tags.pop()
+			elements.pop()
+			if reader is not None:
+				reader(elem)
+				elements[-1].remove(elem)
+
+	def read_category(self, category):
+		category_id = int(category.get("id"))
+		name = category.get("name")
+		hidden = category.get("hidden") is not None
+		background_color = int(category.get("Category_Background_Color"), 16)
+		button_color = category.get("Category_Button_Color").strip()
+		button_color = int(button_color, 16) if button_color else 0
+		text_color = category.get("Category_Text_Color").strip()
+		text_color = int(text_color, 16) if text_color else 0
+		self.add(MessageBodyCategory, id=category_id, name=name, hidden=hidden, background_color=background_color, button_color=button_color, text_color=text_color)
+
+		for body in category:
+			id = int(body.get("id"))
+			self.scopes["bodies"].add(id)
+			for easy_reply in body.findall("easyReplies/easyReply"):
 				to_id = int(easy_reply.get("id"))
-				t[EasyReply].append(EasyReply(from_messagebody_id=from_id, to_messagebody_id=to_id))
-
-
-		for item_info in xml.findall("items/item"):
-			id = int(item_info.get("id"))
-			type = ItemType[item_info.get("type").upper()]
-			t[ItemInfo].append(ItemInfo(id=id, name=item_info.get("name"), type=type))
-
-		for item_info in xml.findall("items/item"):
-			id = int(item_info.get("id"))
-			type = item_info.get("type")
-
-			if type == "blueprint":
-				build_id = int(item_info.find("details/builds/item").get("id"))
-				t[BlueprintInfo].append(BlueprintInfo(item_id=id, build_id=build_id))
-				for requirement_elem in item_info.findall("details/requirements/item"):
-					requirement_id = int(requirement_elem.get("id"))
-					qty = int(requirement_elem.get("qty"))
-					t[BlueprintRequirement].append(BlueprintRequirement(blueprint_item_id=id, item_id=requirement_id, qty=qty))
-
-			elif type == "module":
-				href = item_info.get("hrefEditor")
-				if href is None:
-					editor_type = None
-				elif item_info.get("name") == "Networker Pic Module":
-					editor_type = ModuleEditorType.NETWORKER_PIC
-				else:
-					editor_type = href_types[href[href.rindex("/")+1:href.rindex(".")]]
-
-				is_executable = item_info.get("isExecutable") == "True"
-				yield_elem = item_info.find("yield")
-				click_outcome = self.get_module_click_outcome(item_info)
-				t[ModuleInfo].append(ModuleInfo(item_id=id, is_executable=is_executable, editor_type=editor_type, click_outcome=click_outcome))
-
-				if yield_elem is None: continue
-
-				# Harvest info --> ModuleHarvestYield
-				yield_item_id = int(yield_elem.get("itemId"))
-				if yield_item_id == 0:  # special case for trophy room modules
-					continue
-				max_yield = int(yield_elem.get("maxPerDay"))
-				yield_per_day = int(yield_elem.get("perDay"))
-				clicks_per_yield = int(yield_elem.get("voteAmount"))
-				if clicks_per_yield == 0 and click_outcome == ModuleOutcome.NUM_CLICKS:
-					# Special case for Transmuting Pools.
-					clicks_per_yield = 1
-				if id == 51622 or id == 51623 or id == 51624 or id == 51625:
-					# Special case for elemental modules.
-					clicks_per_yield = 1
-				t[ModuleHarvestYield].append(ModuleHarvestYield(item_id=id, yield_item_id=yield_item_id, max_yield=max_yield, yield_per_day=yield_per_day, clicks_per_yield=clicks_per_yield))
-
-				# Guest yield info --> ModuleGuestYield
-				for guest_yield in yield_elem.findall("guestYield/items"):
-					probability = 100  # owner yields do have probability, but they're not in the XML
-					item_id = int(guest_yield.get("itemID"))
-					qty = int(guest_yield.get("qty"))
-					t[ModuleGuestYield].append(ModuleGuestYield(module_item_id=id, item_id=item_id, qty=qty, probability=probability))
-
-				# Owner yield info --> ModuleOwnerYield
-				for owner_yield in yield_elem.findall("ownerYield/items"):
-					probability = int(owner_yield.get("success", "100"))
-					item_id = int(owner_yield.get("itemID"))
-					qty = int(owner_yield.get("qty"))
-					t[ModuleOwnerYield].append(ModuleOwnerYield(module_item_id=id, item_id=item_id, qty=qty, probability=probability))
-
-				# execution cost info --> ModuleExecutionCost
-				for execution_cost in yield_elem.findall("guestCost/items"):
-					cost_item_id = int(execution_cost.get("itemID"))
-					cost_qty = int(execution_cost.get("qty"))
-					t[ModuleExecutionCost].append(ModuleExecutionCost(module_item_id=id, item_id=cost_item_id, qty=cost_qty))
-
-				# setup cost info --> ModuleSetupCost
-				for setup_cost in yield_elem.findall("ownerLaunchCost/items"):
-					cost_item_id = int(setup_cost.get("itemID"))
-					cost_qty = int(setup_cost.get("qty"))
-					t[ModuleSetupCost].append(ModuleSetupCost(module_item_id=id, item_id=cost_item_id, qty=cost_qty))
-
-				# Messages (with items) sent to users on the module owner's friendlist
-				for friend_yield in yield_elem.findall("friendYield/items"):
-					item_id = int(friend_yield.get("itemID"))
-					qty = int(friend_yield.get("qty"))
-					probability = 100  # not in the XML data
-					# We need to explicitly check for duplicates here because we create a new MessageTemplate otherwise.
-					# There is no other way to detect if a MessageTemplate is being used for a ModuleMessage.
-					if ModuleMessage.objects.filter(module_item_id=id).exists(): continue
-					message_placeholder = MessageTemplate.objects.create(body_id=id)  # Message body placeholder
-					t[MessageTemplateAttachment].append(MessageTemplateAttachment(template_id=message_placeholder.id, item_id=item_id, qty=qty))
-					t[ModuleMessage].append(ModuleMessage(module_item_id=id, message_id=message_placeholder.id, probability=probability))
-
-		for question_elem in xml.findall("questions/question"):
-			q_id = int(question_elem.get("id"))
-			mandatory = question_elem.get("mandatory") == "True"
-			t[Question].append(Question(id=q_id, text=question_elem.get("text"), mandatory=mandatory))
-			for answer_elem in question_elem.findall("answer"):
-				a_id = int(answer_elem.get("id"))
-				t[Answer].append(Answer(id=a_id, question_id=q_id, text=answer_elem.get("text")))
-
-		for color in xml.findall("colors/color"):
-			id = int(color.get("id"))
-			color_id = int(color.find("details").get("color"), 16)
-			t[Color].append(Color(id=id, color=color_id))
-
-		for skin in xml.findall("skins/skin"):
-			id = int(skin.get("id"))
-			name = skin.get("name")
-			t[ModuleSkin].append(ModuleSkin(id=id, name=name))
-
-		for xml_stack in xml.findall("startingStacks/stack"):
-			item_id = int(xml_stack.get("itemID"))
-			qty = int(xml_stack.get("qty"))
-			t[StartingStack].append(StartingStack(item_id=item_id, qty=qty))
-
-		for key, value in t.items():
-			key.objects.bulk_create(value, ignore_conflicts=True)
+				self.add(EasyReply, from_messagebody_id=id, to_messagebody_id=to_id)
+			subject = body.get("subject")
+			if subject == "":
+				continue
+			text = body.get("text")
+			self.add(MessageBody, id=id, category_id=category_id, subject=subject, text=text)
+
+	def read_item(self, item_info):
+		id = int(item_info.get("id"))
+		type = item_info.get("type")
+		self.add(ItemInfo, id=id, name=item_info.get("name"), type=ItemType[type.upper()])
+
+		if type == "blueprint":
+			self.scopes["blueprints"].add(id)
+			build_id = int(item_info.find("details/builds/item").get("id"))
+			self.add(BlueprintInfo, item_id=id, build_id=build_id)
+			for requirement_elem in item_info.findall("details/requirements/item"):
+				requirement_id = int(requirement_elem.get("id"))
+				qty = int(requirement_elem.get("qty"))
+				self.add(BlueprintRequirement, blueprint_item_id=id, item_id=requirement_id, qty=qty)
+
+		elif type == "module":
+			self.scopes["modules"].add(id)
+			href = item_info.get("hrefEditor")
+			if href is None:
+				editor_type = None
+			elif item_info.get("name") == "Networker Pic Module":
+				editor_type = ModuleEditorType.NETWORKER_PIC
+			else:
+				editor_type = href_types[href[href.rindex("/")+1:href.rindex(".")]]
+
+			is_executable = item_info.get("isExecutable") == "True"
+			yield_elem = item_info.find("yield")
+			click_outcome = self.get_module_click_outcome(id, item_info)
+			self.add(ModuleInfo, item_id=id, is_executable=is_executable, editor_type=editor_type, click_outcome=click_outcome)
+
+			if yield_elem is None: return
+
+			# Harvest info --> ModuleHarvestYield
+			yield_item_id = int(yield_elem.get("itemId"))
+			if yield_item_id == 0:  # special case for trophy room modules
+				return
+			max_yield = int(yield_elem.get("maxPerDay"))
+			yield_per_day = int(yield_elem.get("perDay"))
+			clicks_per_yield = int(yield_elem.get("voteAmount"))
+			if clicks_per_yield == 0 and click_outcome == ModuleOutcome.NUM_CLICKS:
+				# Special case for Transmuting Pools.
+				clicks_per_yield = 1
+			if id == 51622 or id == 51623 or id == 51624 or id == 51625:
+				# Special case for elemental modules.
+				clicks_per_yield = 1
+			self.add(ModuleHarvestYield, item_id=id, yield_item_id=yield_item_id, max_yield=max_yield, yield_per_day=yield_per_day, clicks_per_yield=clicks_per_yield)
+
+			# Guest yield info --> ModuleGuestYield
+			for guest_yield in yield_elem.findall("guestYield/items"):
+				probability = 100  # owner yields do have probability, but they're not in the XML
+				item_id = int(guest_yield.get("itemID"))
+				qty = int(guest_yield.get("qty"))
+				self.add(ModuleGuestYield, module_item_id=id, item_id=item_id, qty=qty, probability=probability)
+
+			# Owner yield info --> ModuleOwnerYield
+			for owner_yield in yield_elem.findall("ownerYield/items"):
+				probability = int(owner_yield.get("success", "100"))
+				item_id = int(owner_yield.get("itemID"))
+				qty = int(owner_yield.get("qty"))
+				self.add(ModuleOwnerYield, module_item_id=id, item_id=item_id, qty=qty, probability=probability)
+
+			# execution cost info --> ModuleExecutionCost
+			for execution_cost in yield_elem.findall("guestCost/items"):
+				cost_item_id = int(execution_cost.get("itemID"))
+				cost_qty = int(execution_cost.get("qty"))
+				self.add(ModuleExecutionCost, module_item_id=id, item_id=cost_item_id, qty=cost_qty)
+
+			# setup cost info --> ModuleSetupCost
+			for setup_cost in yield_elem.findall("ownerLaunchCost/items"):
+				cost_item_id = int(setup_cost.get("itemID"))
+				cost_qty = int(setup_cost.get("qty"))
+				self.add(ModuleSetupCost, module_item_id=id, item_id=cost_item_id, qty=cost_qty)
+
+			# Messages (with items) sent to users on the module owner's friendlist
+			# A module can only have one message, so only the first friend yield is used.
+			friend_yield = yield_elem.find("friendYield/items")
+			if friend_yield is not None:
+				self.friend_yields[id] = int(friend_yield.get("itemID")), int(friend_yield.get("qty"))
+
+	def read_question(self, question_elem):
+		q_id = int(question_elem.get("id"))
+		mandatory = question_elem.get("mandatory") == "True"
+		self.add(Question, id=q_id, text=question_elem.get("text"), mandatory=mandatory)
+		for answer_elem in question_elem.findall("answer"):
+			a_id = int(answer_elem.get("id"))
+			self.add(Answer, id=a_id, question_id=q_id, text=answer_elem.get("text"))
+
+	def read_color(self, color):
+		id = int(color.get("id"))
+		color_id = int(color.find("details").get("color"), 16)
+		self.add(Color, id=id, color=color_id)
+
+	def read_skin(self, skin):
+		id = int(skin.get("id"))
+		name = skin.get("name")
+		self.add(ModuleSkin, id=id, name=name)
+
+	def read_starting_stack(self, xml_stack):
+		item_id = int(xml_stack.get("itemID"))
+		qty = int(xml_stack.get("qty"))
+		self.add(StartingStack, item_id=item_id, qty=qty)
+
+	def check_guest_yields(self):
+		"""Check the guest yield lotteries before writing anything, clicking the modules would fail otherwise."""
+		guest_yields = {}
+		for row in self.rows[ModuleGuestYield]:
+			guest_yields.setdefault(row["module_item_id"], []).append(ModuleGuestYield(**row))
+		for yields in guest_yields.values():
+			try:
+				YieldSampler(yields)
+			except ValueError as e:
+				raise CommandError(e)
+
+	def create_module_messages(self, friend_yields):
+		"""Create module messages from {module item id: (item id, qty)}, each with a new template."""
+		templates = [MessageTemplate(body_id=id) for id in friend_yields]  # Message body placeholder
+		MessageTemplate.objects.bulk_create(templates)
+		MessageTemplateAttachment.objects.bulk_create(MessageTemplateAttachment(template_id=template.id, item_id=item_id, qty=qty) for template, (item_id, qty) in zip(templates, friend_yields.values()))
+		ModuleMessage.objects.bulk_create(ModuleMessage(module_item_id=id, message_id=template.id, probability=100) for template, id in zip(templates, friend_yields))  # probability is not in the XML data
+
+	def create_missing(self):
+		"""Create the rows that don't exist yet, leaving existing ones alone."""
+		for table in tables:
+			creates, _, _ = self._diff_table(table)
+			# rows can still conflict with unique constraints other than the key
+			table.objects.bulk_create(creates, ignore_conflicts=True)
+
+		# Module messages are matched by their module, since a new template would be created for them otherwise
+		existing = set(ModuleMessage.objects.values_list("module_item_id", flat=True))
+		self.create_module_messages({id: stack for id, stack in self.friend_yields.items() if id not in existing})
 
 		# Pull request 23/25 added a click outcome column. It must be populated in existing modules for votes to work.
-		for module_outcome in ModuleInfo.objects.filter(click_outcome=None):
-			for item_info in xml.findall("items/item"):
-				if str(module_outcome.item_id) == item_info.get("id"):
-					module_outcome.click_outcome = self.get_module_click_outcome(item_info)
-					module_outcome.save()
+		click_outcomes = {row["item_id"]: row["click_outcome"] for row in self.rows[ModuleInfo]}
+		module_infos = list(ModuleInfo.objects.filter(click_outcome=None, item_id__in=click_outcomes))
+		for module_info in module_infos:
+			module_info.click_outcome = click_outcomes[module_info.item_id]
+		ModuleInfo.objects.bulk_update(module_infos, ("click_outcome",))
+
+	def _in_batches(self, rows, batch_size, write):
+		for i in range(0, len(rows), batch_size):
+			with transaction.atomic():
+				write(rows[i:i+batch_size])
+
+	def _diff_table(self, table):
+		"""Returns (instances to create, instances to update, pks of rows to delete) for a table."""
+		key, fields, scope = diff_specs[table]
+		existing = {}
+		for row in table.objects.values_list("pk", *key, *fields):
+			existing[row[1:len(key)+1]] = row[0], row[len(key)+1:]
+		creates = []
+		updates = []
+		seen = set()
+		for row in self.rows[table]:
+			row_key = tuple(row[field] for field in key)
+			if row_key in seen:  # duplicates in the XML, the first one is used like without --diff
+				continue
+			seen.add(row_key)
+			if row_key not in existing:
+				creates.append(table(**row))
+				continue
+			pk, values = existing[row_key]
+			if tuple(row[field] for field in fields) != values:
+				updates.append(table(pk=pk, **row))
+		deletes = []
+		if scope is not None:
+			for row_key, (pk, _) in existing.items():
+				if row_key not in seen and (scope == "all" or row_key[0] in self.scopes[scope]):
+					deletes.append(pk)
+		return creates, updates, deletes
+
+	def _diff_module_messages(self):
+		"""Returns ({module item id: (item id, qty)} of messages to create, ids of templates to delete) for module messages."""
+		templates = dict(ModuleMessage.objects.values_list("module_item_id", "message_id"))
+		attachments = {}
+		for template_id, item_id, qty in MessageTemplateAttachment.objects.filter(template_id__in=templates.values()).values_list("template_id", "item_id", "qty"):
+			attachments.setdefault(template_id, []).append((item_id, qty))
+		creates = {}
+		deletes = []
+		for id, template_id in templates.items():
+			if id not in self.scopes["modules"]:
+				continue
+			stack = self.friend_yields.get(id)
+			if stack is None or attachments.get(template_id) != [stack]:
+				deletes.append(template_id)
+		for id, stack in self.friend_yields.items():
+			if id not in templates or templates[id] in deletes:
+				creates[id] = stack
+		return creates, deletes
+
+	def apply_diff(self, batch_size):
+		"""Create, update and delete the rows that differ between the file and the DB."""
+		changes = {table: self._diff_table(table) for table in tables}
+		message_creates, message_deletes = self._diff_module_messages()
+
+		# deleting in reverse order removes rows before the rows they depend on
+		# a changed module message is replaced by a new one, deleting its template deletes the message as well
+		self._in_batches(message_deletes, batch_size, lambda pks: MessageTemplate.objects.filter(pk__in=pks).delete())
+		for table in reversed(tables):
+			self._in_batches(changes[table][2], batch_size, lambda pks: table.objects.filter(pk__in=pks).delete())
+		for table in tables:
+			creates, updates, _ = changes[table]
+			self._in_batches(creates, batch_size, table.objects.bulk_create)
+			if diff_specs[table][1]:
+				self._in_batches(updates, batch_size, lambda rows: table.objects.bulk_update(rows, diff_specs[table][1]))
+		self._in_batches(list(message_creates.items()), batch_size, lambda stacks: self.create_module_messages(dict(stacks)))
 
-		print("Import successful.")
+		for table in tables:
+			creates, updates, deletes = changes[table]
+			if creates or updates or deletes:
+				self.stdout.write("%s: %i created, %i updated, %i deleted" % (table._meta.object_name, len(creates), len(updates), len(deletes)))
+		if message_creates or message_deletes:
+			self.stdout.write("ModuleMessage: %i created, %i deleted" % (len(message_creates), len(message_deletes)))
@@ -0,0 +1,147 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as et
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from mln.models.static import invalidate_catalog
+from mln.views.api.xml import metrics
+from mln.views.api.xml.capture import read_capture
+from mln.views.api.xml.webservice import _webservice_unencrypted
+
+def _percentile(sorted_values, q):
+	"""Nearest-rank percentile of a sorted list."""
+	index = max(0, min(len(sorted_values) - 1, round(len(sorted_values) * q / 100) - 1))
+	return sorted_values[index]
+
+class Command(BaseCommand):
+	"""
+	Replays webservice traffic captured with MLN_WEBSERVICE_CAPTURE_FILE (see mln/views/api/xml/capture.py).
+
+	Requests are replayed in the order they were captured, against a copy of a SQLite database, so that the original database is never modified.
+	Each request is sent to the webservice as the user that originally sent it. Afterwards, throughput, latency percentiles and error rates are reported per request type.
+	Replayed calls aren't recorded in the webservice metrics (see mln/views/api/xml/metrics.py), so that they never mix with the metrics of real traffic.
+	"""
+	help = "Replay captured webservice traffic against a copy of a SQLite database and report throughput, latencies and error rates per request type."
+
+	def add_arguments(self, parser):
+		parser.add_argument("captures", nargs="+", help="Capture files to replay. Calls from multiple files (e.g. rotated ones) are merged by time.")
+		parser.add_argument("--database", help="SQLite database to replay against a copy of. Defaults to the configured database.")
+		parser.add_argument("--concurrency", type=int, default=1, help="Number of threads sending requests.")
+		parser.add_argument("--limit", type=int, help="Only replay the first LIMIT calls.")
+
+	def handle(self, *args, **options):
+		if options["concurrency"] < 1:
+			raise CommandError("Concurrency must be at least 1")
+		calls = []
+		for path in options["captures"]:
+			calls.extend(read_capture(path))
+		calls.sort(key=lambda call: call["time"])
+		if options["limit"] is not None:
+			calls = calls[:options["limit"]]
+		if not calls:
+			raise CommandError("No calls to replay")
+
+		db_settings = connections["default"].settings_dict
+		if db_settings["ENGINE"] != "django.db.backends.sqlite3":
+			raise CommandError("Replaying is only supported with SQLite databases")
+		source = options["database"] or db_settings["NAME"]
+		if not os.path.isfile(source):
+			raise CommandError("Database %s does not exist" % source)
+
+		directory = tempfile.mkdtemp()
+		try:
+			copy = os.path.join(directory, "replay.sqlite3")
+			self._copy_database(source, copy)
+			self.stdout.write("Replaying %i calls against a copy of %s with concurrency %i" % (len(calls), source, options["concurrency"]))
+			results, wall_time = self._replay(calls, copy, options["concurrency"])
+		finally:
+			shutil.rmtree(directory)
+		self._report(results, wall_time)
+
+	def _copy_database(self, source, destination):
+		"""Copy with SQLite's backup API, which is consistent even if the source is in use."""
+		source_connection = sqlite3.connect(source)
+		destination_connection = sqlite3.connect(destination)
+		try:
+			source_connection.backup(destination_connection)
+		finally:
+			source_connection.close()
+			destination_connection.close()
+
+	def _replay(self, calls, database, concurrency):
+		connections.close_all()
+		db_settings = connections["default"].settings_dict
+		original_name = db_settings["NAME"]
+		# connections of the worker threads are created from these settings as well
+		db_settings["NAME"] = database
+		invalidate_catalog()
+		results = []
+		next_call = iter(calls)
+		lock = threading.Lock()
+
+		def worker():
+			try:
+				while True:
+					with lock:
+						call = next(next_call, None)
+					if call is None:
+						return
+					result = self._replay_call(call)
+					with lock:
+						results.append(result)
+			finally:
+				connections.close_all()
+
+		try:
+			start = time.perf_counter()
+			threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			wall_time = time.perf_counter() - start
+		finally:
+			connections.close_all()
+			db_settings["NAME"] = original_name
+			invalidate_catalog()
+		return results, wall_time
+
+	def _replay_call(self, call):
+		"""Replay a single call, returning (request type, duration in seconds, whether the call failed)."""
+		try:
+			request_type = et.fromstring(call["request"]).get("type")
+		except et.ParseError:
+			return None, 0, True
+		if call["user_id"] is None:
+			user = AnonymousUser()
+		else:
+			# load the user for every call, like the authentication middleware does
+			user = User.objects.filter(id=call["user_id"]).first()
+			if user is None:
+				return request_type, 0, True
+		start = time.perf_counter()
+		try:
+			# a timer of our own, which is never recorded
+			response = _webservice_unencrypted(user, call["request"], metrics.RequestTimer())
+			is_error = 'status="error"' in response
+		except Exception:
+			is_error = True
+		return request_type, time.perf_counter() - start, is_error
+
+	def _report(self, results, wall_time):
+		self.stdout.write("%i calls in %.2f s, %.1f calls/s" % (len(results), wall_time, len(results) / wall_time))
+		by_type = {}
+		for request_type, duration, is_error in results:
+			by_type.setdefault(request_type or "(unparseable)", []).append((duration, is_error))
+		self.stdout.write("%-32s %7s %8s %9s %9s %9s %9s" % ("request type", "calls", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+		for request_type, type_results in sorted(by_type.items(), key=lambda item: -len(item[1])):
+			durations = sorted(duration * 1000 for duration, _ in type_results)
+			errors = sum(is_error for _, is_error in type_results)
+			self.stdout.write("%-32s %7i %7.1f%% %9.2f %9.2f %9.2f %9.2f" % (request_type, len(type_results), 100 * errors / len(type_results), _percentile(durations, 50), _percentile(durations, 90), _percentile(durations, 99), durations[-1]))
@@ -0,0 +1,86 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mln.services.webhooks import batch_deliveries, claim_deliveries, DeliveryClient, get_endpoint, record_deliveries, release_deliveries
+
+class Command(BaseCommand):
+	"""
+	Sends the webhook requests queued in the webhook outbox (see mln/services/webhooks.py).
+
+	A pool of threads sends the requests, while the main thread claims due deliveries and records the results, so that only the main thread uses the database.
+	At most --per-endpoint requests are sent to the same host at a time, so that a slow integration can't occupy all threads. Deliveries to a busy host are claimed once it has capacity again.
+	Requests are sent over keep-alive connections, with a pool of --per-endpoint connections per host.
+	Deliveries of webhooks that opted in to batching are sent together, up to MLN_WEBHOOK_BATCH_SIZE per request.
+	Several worker processes can run at the same time, deliveries are only claimed by one of them.
+	"""
+	help = "Send queued webhook requests, retrying failed ones with exponential backoff."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--workers", type=int, default=8, help="Number of requests sent at the same time.")
+		parser.add_argument("--per-endpoint", type=int, default=2, help="Number of requests sent to the same host at the same time.")
+		parser.add_argument("--poll-interval", type=float, default=1, help="Seconds to wait for new deliveries when the outbox is empty.")
+		parser.add_argument("--once", action="store_true", help="Exit once no deliveries are due, instead of waiting for new ones.")
+
+	def handle(self, *args, **options):
+		if options["workers"] < 1 or options["per_endpoint"] < 1:
+			raise CommandError("Workers and requests per endpoint must be at least 1")
+		self.verbosity = options["verbosity"]
+		self.workers = options["workers"]
+		self.per_endpoint = options["per_endpoint"]
+		self.in_flight = {}  # future -> deliveries
+		self.busy = {}  # endpoint -> number of requests in flight
+		self.endpoint_webhooks = {}  # endpoint -> ids of webhooks seen with this endpoint
+		self.sent = self.failed = 0
+		self.client = DeliveryClient(pool_size=self.per_endpoint)
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			try:
+				while True:
+					self._submit(pool)
+					if not self.in_flight:
+						if options["once"]:
+							break
+						time.sleep(options["poll_interval"])
+						continue
+					done, _ = wait(self.in_flight, timeout=options["poll_interval"], return_when=FIRST_COMPLETED)
+					for future in done:
+						self._record(future)
+			except KeyboardInterrupt:
+				pass
+			finally:
+				# record the requests that are still in flight, the others are attempted again after their lease
+				for future in list(self.in_flight):
+					self._record(future)
+		self.client.close()
+		self.stdout.write("%i webhook requests sent, %i failed" % (self.sent, self.failed))
+
+	def _submit(self, pool):
+		"""Claim as many deliveries as there are free threads and submit them."""
+		capacity = self.workers - len(self.in_flight)
+		if capacity <= 0:
+			return
+		saturated = [webhook_id for endpoint, count in self.busy.items() if count >= self.per_endpoint for webhook_id in self.endpoint_webhooks[endpoint]]
+		# Only claim deliveries to endpoints with capacity
+		for deliveries in batch_deliveries(claim_deliveries(capacity, exclude_webhook_ids=saturated)):
+			webhook = deliveries[0].webhook
+			endpoint = get_endpoint(webhook)
+			self.endpoint_webhooks.setdefault(endpoint, set()).add(webhook.id)
+			if self.busy.get(endpoint, 0) >= self.per_endpoint:
+				# a webhook that wasn't known to go to this endpoint yet, it's excluded from now on while the endpoint is busy
+				release_deliveries(deliveries)
+				continue
+			self.busy[endpoint] = self.busy.get(endpoint, 0) + 1
+			self.in_flight[pool.submit(self.client.send, deliveries)] = deliveries
+
+	def _record(self, future):
+		deliveries = self.in_flight.pop(future)
+		result = future.result()
+		record_deliveries(deliveries, result)
+		self.busy[get_endpoint(deliveries[0].webhook)] -= 1
+		if result is None:
+			self.sent += 1
+		else:
+			self.failed += 1
+			if self.verbosity >= 2:
+				self.stdout.write("Delivery of %i events to %s failed: %s" % (len(deliveries), deliveries[0].webhook.url, result[0]))
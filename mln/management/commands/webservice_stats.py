@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from mln.views.api.xml import metrics
+
+def _format_ms(ms):
+	if ms is None:
+		return "-"
+	if ms == float("inf"):
+		return ">%g" % metrics.BUCKETS[-1]
+	return "%.2f" % ms
+
+class Command(BaseCommand):
+	help = "Show the webservice metrics of all server processes, per request type: stage timings, SQL queries and DB time. See mln/views/api/xml/metrics.py."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--json", action="store_true", help="Output the raw merged metrics as JSON.")
+		parser.add_argument("--reset", action="store_true", help="Delete all metrics snapshots after showing them.")
+
+	def handle(self, *args, **options):
+		snapshot = metrics.read_snapshots()
+		if options["json"]:
+			self.stdout.write(json.dumps(snapshot, indent=2))
+		else:
+			self._write_table(snapshot)
+		if options["reset"]:
+			metrics.delete_snapshots()
+
+	def _write_table(self, snapshot):
+		request_types = snapshot["request_types"]
+		if not request_types:
+			self.stdout.write("No webservice requests recorded.")
+			return
+		# most expensive request types first
+		for request_type, stats in sorted(request_types.items(), key=lambda item: -sum(stage["total_ms"] for stage in item[1]["stages"].values())):
+			requests = stats["requests"]
+			self.stdout.write(self.style.MIGRATE_HEADING(request_type))
+			self.stdout.write("  requests: %i, errors: %i, queries/request: %.1f, DB time/request: %.2f ms" % (requests, stats["errors"], stats["queries"] / requests, stats["db_time_ms"] / requests))
+			self.stdout.write("  %-8s %8s %10s %10s %10s %10s" % ("stage", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms"))
+			for name in metrics.STAGES:
+				histogram = stats["stages"][name]
+				if histogram["count"] == 0:
+					continue
+				mean = histogram["total_ms"] / histogram["count"]
+				self.stdout.write("  %-8s %8i %10.2f %10s %10s %10s" % (name, histogram["count"], mean, *(_format_ms(metrics.percentile(histogram, q)) for q in (50, 95, 99))))
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mln', '0043_oauthtoken_auth_code'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['from_user', 'to_user', 'status'], name='friendship_from_to_status'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['to_user', 'from_user', 'status'], name='friendship_to_from_status'),
+        ),
+    ]
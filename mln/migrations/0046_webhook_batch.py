@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mln', '0045_webhookdelivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhook',
+            name='batch',
+            field=models.BooleanField(default=False),
+        ),
+    ]
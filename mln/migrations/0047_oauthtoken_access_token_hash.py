@@ -0,0 +1,33 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_access_tokens(apps, schema_editor):
+    OAuthToken = apps.get_model("mln", "OAuthToken")
+    for token in OAuthToken.objects.all():
+        token.access_token_hash = hashlib.sha256(token.access_token_hash.encode()).hexdigest()
+        token.save(update_fields=["access_token_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mln', '0046_webhook_batch'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='oauthtoken',
+            old_name='access_token',
+            new_name='access_token_hash',
+        ),
+        # The tokens can't be recovered from their hashes. Rolling back keeps the hashes in the access_token column,
+        # so all existing tokens stop working and users have to sign in again.
+        migrations.RunPython(hash_access_tokens, reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='oauthtoken',
+            name='access_token_hash',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
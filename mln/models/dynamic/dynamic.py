@@ -4,6 +4,7 @@ These include user profiles, inventory stacks and messages.
 Since modules have a lot of models associated with them, their models are in dedicated files.
 """
 import datetime
+import hashlib
 from enum import auto, Enum
 
 from django.contrib.auth.models import User
@@ -99,7 +100,7 @@ class Profile(models.Model):
 		if new_votes > 0:
 			self.available_votes = min(self.available_votes + new_votes, max_votes)
 			self.last_vote_update_time = now() - time_remainder
-			self.save()
+			self.save(update_fields=("available_votes", "last_vote_update_time"))
 
 class AboutMe(models.Model):
 	"""Questions and answers the user can choose to display on their page as a bio/profile of themselves."""
@@ -159,6 +160,13 @@ class Friendship(models.Model):
 	to_user = models.ForeignKey(User, related_name="incoming_friendships", on_delete=models.CASCADE) # invite recipient
 	status = EnumField(FriendshipStatus)
 
+	class Meta:
+		# relations are looked up in both directions, see services.friend
+		indexes = (
+			models.Index(fields=("from_user", "to_user", "status"), name="friendship_from_to_status"),
+			models.Index(fields=("to_user", "from_user", "status"), name="friendship_to_from_status"),
+		)
+
 	def __str__(self):
 		return "%s -> %s: %s" % (self.from_user, self.to_user, self.get_status_display())
 
@@ -187,9 +195,14 @@ class OAuthCode(models.Model):
 	class Meta:
 		verbose_name_plural = "OAuth Authorization Codes"
 
+def hash_access_token(access_token):
+	"""Return the SHA-256 hex digest of an access token, as stored in OAuthToken.access_token_hash."""
+	return hashlib.sha256(access_token.encode()).hexdigest()
+
 class OAuthToken(models.Model):
 	auth_code = models.ForeignKey(OAuthCode, related_name="+", on_delete=models.CASCADE, null=True)
-	access_token = models.CharField(max_length=64)
+	# Only the hash of the token is stored (see hash_access_token), so that the database doesn't contain usable tokens
+	access_token_hash = models.CharField(max_length=64, unique=True)
 	user = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
 	client = models.ForeignKey(OAuthClient, related_name="+", on_delete=models.CASCADE)
 
@@ -219,6 +232,8 @@ class Webhook(models.Model):
 	secret = models.CharField(max_length=64)
 	url = models.URLField()
 	type = EnumField(WebhookType)
+	# Whether the integration accepts several events in one request, as a JSON array
+	batch = models.BooleanField(default=False)
 
 	# User can be null for top-level webhooks
 	access_token = models.ForeignKey(OAuthToken, related_name="+", on_delete=models.CASCADE, null=True, blank=True)
@@ -230,6 +245,25 @@ class Webhook(models.Model):
 			result += f" on behalf of {self.user.username}"
 		return result
 
+class WebhookDelivery(models.Model):
+	"""
+	A webhook request that hasn't been sent yet, in the webhook outbox.
+	Deliveries are created with the transaction of the event that triggered them, and sent by "manage.py run_webhook_workers" (see services/webhooks.py).
+	Sent deliveries are deleted. Deliveries that failed too often are kept, without a next attempt, for inspection.
+	"""
+	webhook = models.ForeignKey(Webhook, related_name="+", on_delete=models.CASCADE)
+	body = models.JSONField()
+	created_at = models.DateTimeField(default=now)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	next_attempt_at = models.DateTimeField(null=True, blank=True, default=now, db_index=True)
+	last_error = models.CharField(max_length=256, blank=True)
+
+	class Meta:
+		verbose_name_plural = "Webhook deliveries"
+
+	def __str__(self):
+		return f"Delivery of {self.webhook}, {self.attempts} attempts"
+
 def assert_has_item(user, item_id, qty=1, field_name=None):
 	"""
 	Raise ValidationError if the user has less than qty items in their inventory.
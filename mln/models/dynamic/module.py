@@ -7,12 +7,11 @@ from django.db import models
 from django.utils.timezone import now
 from datetime import timedelta
 
-from .dynamic import DAY, get_or_none
-from ..static import ItemInfo, ItemType, ModuleEditorType, ModuleHarvestYield, ModuleOutcome, ModuleSetupCost
-from ..static.module_handlers import CLICK_HANDLERS
+from .dynamic import DAY
+from ..static import get_catalog, ItemInfo, ItemType, ModuleEditorType, ModuleOutcome
 
 from mln.models.dynamic.dynamic import assert_has_item
-from ...services.inventory import add_inv_item, remove_inv_item
+from ...services.inventory import add_inv_item, InventoryTransaction, remove_inv_item
 
 class Module(models.Model):
 	"""
@@ -42,14 +41,20 @@ class Module(models.Model):
 			self.is_setup = None
 		super().save(*args, **kwargs)
 
-	def _calc_yield_info(self):
-		"""Calculate the yield of this module (how many items you can harvest), as well as the time and clicks that remain."""
-		yield_info = get_or_none(ModuleHarvestYield, item_id=self.item_id)
+	def _calc_yield_info(self, yield_info=None, needs_setup=None, current_time=None):
+		"""
+		Calculate the yield of this module (how many items you can harvest), as well as the time and clicks that remain.
+		To calculate the yields of several modules, use calc_yields, which looks up the static data once per module item and uses the same current time for all modules.
+		"""
 		if yield_info is None:
-			return self.yield_since_last_harvest, timedelta(seconds=0), 0
-		if self._needs_setup() and not self.is_setup:
+			yield_info = get_catalog().harvest_yields.get(self.item_id)
+			if yield_info is None:
+				return self.yield_since_last_harvest, timedelta(seconds=0), 0
+		if not self.is_setup and (self._needs_setup() if needs_setup is None else needs_setup):
 			return min(self.yield_since_last_harvest, yield_info.max_yield), timedelta(seconds=0), 0
-		time_since_harvest = now() - self.last_harvest_time
+		if current_time is None:
+			current_time = now()
+		time_since_harvest = current_time - self.last_harvest_time
 		if yield_info.yield_per_day == 0:
 			time_yield = 0
 			time_remainder = time_since_harvest
@@ -63,25 +68,9 @@ class Module(models.Model):
 		final_yield = min(time_yield + click_yield + self.yield_since_last_harvest, yield_info.max_yield)
 		return final_yield, time_remainder, click_remainder
 
-	def _get_yield(self, yields):
-		"""Chooses an available yield based on its assigned probability."""
-		if len(yields) == 0: return None  # no yield for clicking
-		elif len(yields) == 1:  # standard, one-item yield
-			result = yields[0]
-			if random.random() < (result.probability / 100): return result
-			else: return None
-		else:  # lottery
-			random_number = random.randrange(100)
-			sum = 0
-			for prize in yields:
-				sum += prize.probability
-				if sum > random_number:
-					return prize
-			else:
-				raise RuntimeError(f"Couldn't choose a yield for {self}. Possible yields: {yields}")
-
 	def _needs_setup(self):
-		return self.item.module_info.editor_type == ModuleEditorType.TRADE or self.item.setup_costs.exists()
+		catalog = get_catalog()
+		return catalog.get_module_info(self.item_id).editor_type == ModuleEditorType.TRADE or self.item_id in catalog.setup_costs
 
 	def _validate_click(self, clicker):
 		if clicker == self.owner:  # user can't click on own module
@@ -95,18 +84,19 @@ class Module(models.Model):
 		"""Updates clicks for both the clicker and the module."""
 		self.clicks_since_last_harvest += 1
 		self.total_clicks += 1
-		self.save()
+		# only saving the counters, so that cached pages stay valid (see signals.py)
+		self.save(update_fields=("clicks_since_last_harvest", "total_clicks"))
 		if clicker.profile.is_networker: return
 		clicker.profile.available_votes -= 1
-		clicker.profile.save()
+		clicker.profile.save(update_fields=("available_votes",))
 
 	def get_settings_classes(self):
 		"""Get the save data classes for this module."""
-		return module_settings_classes[self.item.module_info.editor_type]
+		return module_settings_classes[get_catalog().get_module_info(self.item_id).editor_type]
 
 	def get_yield_item_id(self):
 		"""Get the id of the item this module yields."""
-		return ModuleHarvestYield.objects.get(item_id=self.item_id).yield_item_id
+		return get_catalog().get_harvest_yield(self.item_id).yield_item_id
 
 	def calc_yield_qty(self):
 		"""Calculate the yield of this module."""
@@ -114,39 +104,39 @@ class Module(models.Model):
 
 	def handle_trade(self, clicker):
 		trade = self.setup_trade
-		assert_has_item(clicker, trade.request_item.id, trade.request_qty)
-		remove_inv_item(clicker, trade.request_item.id, trade.request_qty)
-		add_inv_item(self.owner, trade.request_item.id, trade.request_qty)
-		add_inv_item(clicker, trade.give_item.id, trade.give_qty)
+		assert_has_item(clicker, trade.request_item_id, trade.request_qty)
+		inventory = InventoryTransaction()
+		inventory.remove(clicker, trade.request_item_id, trade.request_qty)
+		inventory.add(self.owner, trade.request_item_id, trade.request_qty)
+		inventory.add(clicker, trade.give_item_id, trade.give_qty)
+		inventory.commit()
 		self.is_setup = False
 		self.save()
 
-	def handle_guest_yield(self, clicker):
-		guest_yield = self._get_yield(self.item.moduleguestyields.all())
-		if guest_yield is not None:
-			guest_yield.on_click(self, clicker)
-			if guest_yield.should_yield(self):
-				return guest_yield
+	def handle_guest_yield(self, clicker, plan):
+		guest_yield = plan.choose_guest_yield()
+		if guest_yield is not None and plan.guest_yield_applies(self):
+			guest_yield.on_resolved_click(self, clicker)
+			return guest_yield
 
 	def click(self, clicker):
 		"""Updates clicks and distributes relevant rewards."""
 		self._validate_click(clicker)
+		plan = get_catalog().get_click_plan(self.item_id)
 
 		# Handle most click handlers
 		self.did_guest_win = random.choice([True, False])
-		for model in CLICK_HANDLERS:
-			for handler in model.objects.filter(module_item_id=self.item_id):
-				handler.on_click(self, clicker)
+		plan.run_handlers(self, clicker)
 
 		# Handle trades separately
 		if ModuleSetupTrade in self.get_settings_classes():  # handle trades
 			self.handle_trade(clicker)
 
 		# Handle guest yields separately
-		outcome = self.item.module_info.click_outcome
+		outcome = plan.outcome
 		result = None  # we return the guest yield to the UI
 		if (outcome != ModuleOutcome.ARCADE):
-			result = self.handle_guest_yield(clicker)
+			result = self.handle_guest_yield(clicker, plan)
 
 		# Update information about the module
 		self._update_clicks(clicker)
@@ -175,11 +165,10 @@ class Module(models.Model):
 
 	def add_to_harvest(self, qty):
 		self.yield_since_last_harvest += qty
-		self.save()
+		self.save(update_fields=("yield_since_last_harvest",))
 
 	def grant_arcade_prize(self, clicker):
-		all_prizes = self.item.moduleguestyields.all()
-		prize = self._get_yield(all_prizes)
+		prize = get_catalog().get_click_plan(self.item_id).choose_guest_yield()
 		add_inv_item(clicker, prize.item_id, prize.qty)
 		return prize
 
@@ -190,20 +179,24 @@ class Module(models.Model):
 		If the module was set up, the set up item will be lost at this point.
 		"""
 		harvest_qty, time_remainder, click_remainder = self._calc_yield_info()
-		add_inv_item(self.owner, self.get_yield_item_id(), qty=harvest_qty)
+		yield_item_id = self.get_yield_item_id()
+		settings_classes = self.get_settings_classes()
+		inventory = InventoryTransaction()
+		inventory.add(self.owner, yield_item_id, harvest_qty)
 		self.yield_since_last_harvest = 0
 		self.last_harvest_time = now() - time_remainder
 		self.clicks_since_last_harvest = click_remainder
 		if self.is_setup: self.is_setup = False  # will automatically be fixed if not _needs_setup
-		if ModuleSetupFriendShare in self.get_settings_classes():
-			add_inv_item(self.setup_friend_share.friend, self.get_yield_item_id(), qty=harvest_qty)
-		if ModuleSetupTrioPerformance in self.get_settings_classes():
-			add_inv_item(self.setup_group_performance.friend_0, self.get_yield_item_id(), qty=harvest_qty)
-			add_inv_item(self.setup_group_performance.friend_1, self.get_yield_item_id(), qty=harvest_qty)
-		if ModuleSetupGroupPerformance in self.get_settings_classes():
-			add_inv_item(self.setup_group_performance.friend_0, self.get_yield_item_id(), qty=harvest_qty)
-			add_inv_item(self.setup_group_performance.friend_1, self.get_yield_item_id(), qty=harvest_qty)
-			add_inv_item(self.setup_group_performance.friend_2, self.get_yield_item_id(), qty=harvest_qty)
+		if ModuleSetupFriendShare in settings_classes:
+			inventory.add(self.setup_friend_share.friend, yield_item_id, harvest_qty)
+		if ModuleSetupTrioPerformance in settings_classes:
+			inventory.add(self.setup_trio_performance.friend_0, yield_item_id, harvest_qty)
+			inventory.add(self.setup_trio_performance.friend_1, yield_item_id, harvest_qty)
+		if ModuleSetupGroupPerformance in settings_classes:
+			inventory.add(self.setup_group_performance.friend_0, yield_item_id, harvest_qty)
+			inventory.add(self.setup_group_performance.friend_1, yield_item_id, harvest_qty)
+			inventory.add(self.setup_group_performance.friend_2, yield_item_id, harvest_qty)
+		inventory.commit()
 		self.save()
 
 	def is_clickable(self):
@@ -226,8 +219,7 @@ class Module(models.Model):
 			trade = self.setup_trade
 			remove_inv_item(self.owner, trade.give_item_id, trade.give_qty)
 		else:
-			costs = ModuleSetupCost.objects.filter(module_item_id=self.item_id)
-			for cost in costs:
+			for cost in get_catalog().setup_costs.get(self.item_id, ()):
 				remove_inv_item(self.owner, cost.item_id, cost.qty)
 		self.is_setup = True
 		self.last_harvest_time = now()
@@ -241,11 +233,30 @@ class Module(models.Model):
 			trade = self.setup_trade
 			add_inv_item(self.owner, trade.give_item_id, trade.give_qty)
 		else:
-			for cost in ModuleSetupCost.objects.filter(module_item_id=self.item_id):
+			for cost in get_catalog().setup_costs.get(self.item_id, ()):
 				add_inv_item(self.owner, cost.item_id, cost.qty)
 		self.is_setup = False
 		self.save()
 
+def calc_yields(modules):
+	"""
+	Calculate the yields of several modules at once, like all modules on a page, for the same point in time.
+	Return a dict module id -> (yield item id, yield qty, time remainder, click remainder). The yield item id is None for modules without harvest yield.
+	"""
+	harvest_yields = get_catalog().harvest_yields
+	current_time = now()
+	needs_setup = {}  # module item id -> whether modules of this item need setup
+	yields = {}
+	for module in modules:
+		yield_info = harvest_yields.get(module.item_id)
+		if yield_info is None:
+			yields[module.id] = (None, module.yield_since_last_harvest, timedelta(seconds=0), 0)
+			continue
+		if module.item_id not in needs_setup:
+			needs_setup[module.item_id] = module._needs_setup()
+		yields[module.id] = (yield_info.yield_item_id, *module._calc_yield_info(yield_info, needs_setup[module.item_id], current_time))
+	return yields
+
 from .module_settings import ModuleSaveGeneric, ModuleSaveNetworkerPic, ModuleSaveNetworkerText, ModuleSaveRocketGame, ModuleSaveSoundtrack, ModuleSaveSticker, ModuleSaveUGC, ModuleSetupFriendShare, ModuleSetupGroupPerformance, ModuleSetupTrade, ModuleSetupTrioPerformance
 from .module_settings_arcade import ModuleSaveConcertArcade, ModuleSaveDeliveryArcade, ModuleSaveDestructoidArcade, ModuleSaveHopArcade
 
@@ -1 +1,2 @@
 from .static import *
+from .catalog import get_catalog, invalidate_catalog, reload_catalog
@@ -0,0 +1,149 @@
+"""
+Process-wide cache of the static data read on hot paths, like module clicks, harvests and page rendering.
+Static data only changes when MLN's data is imported (see import_mln_xml) or edited in the admin interface, so instead of querying it on every request, it's loaded once into a catalog indexed by item id.
+The catalog also contains the click plans of module items (see module_handlers.ClickPlan), so clicking a module doesn't query static data either.
+
+The catalog is immutable: when static data changes, a new catalog is loaded instead of modifying the current one. The model instances in it are shared by all threads, don't modify them.
+Saving or deleting an instance of one of the cached models (CATALOG_MODELS and module_handlers.CLICK_PLAN_MODELS) reloads the catalog automatically (see signals.py). After changing static data without saving instances (e.g. with bulk_create or update), call reload_catalog().
+If the MLN_STATIC_CATALOG_STAMP setting is set, reload_catalog() also touches that file, and other processes reload their catalog once they notice (checked at most once per second).
+"""
+import threading
+from types import MappingProxyType
+
+from django.db import transaction
+
+from ...stamp import Stamp
+from .static import BlueprintInfo, BlueprintRequirement, ItemInfo, ModuleHarvestYield, ModuleInfo, ModuleSetupCost
+
+"""Models cached in the catalog. Changes to these reload the catalog."""
+CATALOG_MODELS = BlueprintInfo, BlueprintRequirement, ItemInfo, ModuleHarvestYield, ModuleInfo, ModuleSetupCost
+"""Item ids of the trophies shown on public pages, in display order."""
+TROPHY_IDS = 103022, 103030, 103026, 103024, 103021, 103032, 103031
+
+_lock = threading.Lock()
+_catalog = None
+_stamp = Stamp("MLN_STATIC_CATALOG_STAMP")
+
+def _group(objects, key):
+	groups = {}
+	for obj in objects:
+		groups.setdefault(getattr(obj, key), []).append(obj)
+	return MappingProxyType({key: tuple(group) for key, group in groups.items()})
+
+def _get(mapping, item_id, model):
+	try:
+		return mapping[item_id]
+	except KeyError:
+		raise model.DoesNotExist("%s with item id %s does not exist" % (model.__name__, item_id))
+
+class Catalog:
+	"""
+	Static data indexed by item id. Use get_catalog() instead of creating this directly.
+	Related items of the cached instances are filled in from the catalog, so following them doesn't query the database.
+	"""
+	def __init__(self, stamp):
+		self.stamp = stamp
+		items = {item.id: item for item in ItemInfo.objects.all()}
+		self.items = MappingProxyType(items)
+
+		module_infos = {}
+		for module_info in ModuleInfo.objects.all():
+			module_info.item = items[module_info.item_id]
+			module_infos[module_info.item_id] = module_info
+		self.module_infos = MappingProxyType(module_infos)
+
+		self.trophies = tuple(items[item_id] for item_id in TROPHY_IDS if item_id in items)
+		self.trophy_ids = frozenset(trophy.id for trophy in self.trophies)
+
+		harvest_yields = {}
+		for harvest_yield in ModuleHarvestYield.objects.all():
+			harvest_yield.item = items[harvest_yield.item_id]
+			harvest_yield.yield_item = items[harvest_yield.yield_item_id]
+			harvest_yields[harvest_yield.item_id] = harvest_yield
+		self.harvest_yields = MappingProxyType(harvest_yields)
+
+		setup_costs = list(ModuleSetupCost.objects.all())
+		for cost in setup_costs:
+			cost.module_item = items[cost.module_item_id]
+			cost.item = items[cost.item_id]
+		self.setup_costs = _group(setup_costs, "module_item_id")
+
+		blueprints = {}
+		for blueprint in BlueprintInfo.objects.all():
+			blueprint.item = items[blueprint.item_id]
+			blueprint.build = items[blueprint.build_id]
+			blueprints[blueprint.item_id] = blueprint
+		self.blueprints = MappingProxyType(blueprints)
+
+		requirements = list(BlueprintRequirement.objects.all())
+		for requirement in requirements:
+			requirement.blueprint_item = items[requirement.blueprint_item_id]
+			requirement.item = items[requirement.item_id]
+		self.blueprint_requirements = _group(requirements, "blueprint_item_id")
+
+		# imported here because the handlers depend on the dynamic models, which depend on this module
+		from .module_handlers import CLICK_HANDLERS, ClickPlan, ModuleGuestYield
+		handlers = {}
+		for model in CLICK_HANDLERS + (ModuleGuestYield,):
+			queryset = model.objects.order_by("id")
+			if hasattr(model, "message"):
+				queryset = queryset.select_related("message")
+			for handler in queryset:
+				handler.module_item = items[handler.module_item_id]
+				if hasattr(handler, "item_id"):
+					handler.item = items[handler.item_id]
+				handlers.setdefault((model, handler.module_item_id), []).append(handler)
+		click_plans = {}
+		for item_id, module_info in module_infos.items():
+			click_handlers = [handler for model in CLICK_HANDLERS for handler in handlers.get((model, item_id), ())]
+			click_plans[item_id] = ClickPlan(module_info, click_handlers, handlers.get((ModuleGuestYield, item_id), ()))
+		self.click_plans = MappingProxyType(click_plans)
+
+	def get_item(self, item_id):
+		"""Get an item, raising ItemInfo.DoesNotExist if it doesn't exist."""
+		return _get(self.items, item_id, ItemInfo)
+
+	def get_module_info(self, item_id):
+		"""Get the module info of a module item, raising ModuleInfo.DoesNotExist if it doesn't have any."""
+		return _get(self.module_infos, item_id, ModuleInfo)
+
+	def get_harvest_yield(self, item_id):
+		"""Get the harvest yield of a module item, raising ModuleHarvestYield.DoesNotExist if it doesn't have any."""
+		return _get(self.harvest_yields, item_id, ModuleHarvestYield)
+
+	def get_blueprint(self, item_id):
+		"""Get the blueprint info of a blueprint item, raising BlueprintInfo.DoesNotExist if it doesn't have any."""
+		return _get(self.blueprints, item_id, BlueprintInfo)
+
+	def get_click_plan(self, item_id):
+		"""Get the click plan of a module item, raising ModuleInfo.DoesNotExist if it doesn't have module info."""
+		return _get(self.click_plans, item_id, ModuleInfo)
+
+def get_catalog():
+	"""Get the current catalog, loading it if necessary."""
+	global _catalog
+	catalog = _catalog
+	if catalog is not None and _stamp.current() == catalog.stamp:
+		return catalog
+	with _lock:
+		stamp = _stamp.read()
+		if _catalog is None or _catalog.stamp != stamp:
+			_catalog = Catalog(stamp)
+		return _catalog
+
+def invalidate_catalog():
+	"""Drop the catalog of this process, it will be loaded again when it's next used."""
+	global _catalog
+	_catalog = None
+
+def _touch_stamp():
+	invalidate_catalog()
+	_stamp.touch()
+
+def reload_catalog():
+	"""
+	Call this after changing static data.
+	The catalog of this process is dropped immediately, and again once the transaction is committed, in case it was loaded from uncommitted data in the meantime. Other processes are notified after the commit.
+	"""
+	invalidate_catalog()
+	transaction.on_commit(_touch_stamp)
@@ -1,4 +1,5 @@
 import random
+from enum import auto, Enum
 
 from django.db import models
 from django.db.models import Q
@@ -10,6 +11,19 @@ from ...services.friend import choose_friend
 from ...services.inventory import add_inv_item, remove_inv_item
 from ...services.message import send_template
 
+class ClickCondition(Enum):
+	"""When a click handler reacts to a click. Depends on the outcome of the module, see ModuleClickHandler.get_condition."""
+	ALWAYS = auto()
+	NEVER = auto()
+	GUEST_WON = auto()
+	GUEST_LOST = auto()
+
+	def applies(self, module):
+		if self == ClickCondition.ALWAYS: return True
+		elif self == ClickCondition.NEVER: return False
+		elif self == ClickCondition.GUEST_WON: return module.did_guest_win
+		elif self == ClickCondition.GUEST_LOST: return not module.did_guest_win
+
 class ModuleClickHandler(models.Model):
 	"""A handler that executes an action when a module is clicked."""
 	module_item = models.ForeignKey(ItemInfo, related_name="%(class)ss", on_delete=models.CASCADE, limit_choices_to=Q(type=ItemType.MODULE))
@@ -17,8 +31,17 @@ class ModuleClickHandler(models.Model):
 
 	class Meta: abstract = True
 
+	@classmethod
+	def get_condition(cls, outcome):
+		"""Returns when handlers of this type react to clicks on modules with the given outcome."""
+		return ClickCondition.ALWAYS
+
 	def on_click(self, module, clicker): pass
 
+	def on_resolved_click(self, module, clicker):
+		"""Called by click plans instead of on_click, once the condition of this handler is known to apply."""
+		self.on_click(module, clicker)
+
 class ModuleMessage(ModuleClickHandler):
 	"""
 	A message that may be sent to the module owner's friends when clicked.
@@ -48,13 +71,16 @@ class ModuleClickYield(ModuleClickHandler, Stack):
 		the outcome of the game is known before rewarding the user. Similarly, battle
 		modules need to know who won before giving out rewards.
 		"""
-		pass
+		return self.get_condition(self.module_item.module_info.click_outcome).applies(module)
 
 	def distribute_items(self, module, clicker): pass
 
 	def on_click(self, module, clicker):
 		if self.should_yield(module): self.distribute_items(module, clicker)
 
+	def on_resolved_click(self, module, clicker):
+		self.distribute_items(module, clicker)
+
 class ModuleExecutionCost(ModuleClickYield):
 	"""
 	Defines the cost guests will have to pay to click on the module.
@@ -63,8 +89,6 @@ class ModuleExecutionCost(ModuleClickYield):
 	class Meta:
 		constraints = (models.UniqueConstraint(fields=("module_item", "item"), name="module_execution_cost_unique_module_item_item"),)
 
-	def should_yield(self, module): return True
-
 	def distribute_items(self, module, clicker):
 		if clicker.profile.is_networker: return
 		assert_has_item(clicker, self.item_id, self.qty)
@@ -79,12 +103,12 @@ class ModuleGuestYield(ModuleClickYield):
 	class Meta:
 		constraints = (models.UniqueConstraint(fields=("module_item", "item"), name="module_guest_yield_unique_module_item_item"),)
 
-	def should_yield(self, module):
-		outcome = self.module_item.module_info.click_outcome  # cache the related_name query
-		if outcome == ModuleOutcome.PROBABILITY: return True
-		elif outcome == ModuleOutcome.NUM_CLICKS: return True
-		elif outcome == ModuleOutcome.BATTLE: return module.did_guest_win
-		elif outcome == ModuleOutcome.ARCADE: return False  # reward should be calculated using Module._get_yield
+	@classmethod
+	def get_condition(cls, outcome):
+		if outcome == ModuleOutcome.PROBABILITY: return ClickCondition.ALWAYS
+		elif outcome == ModuleOutcome.NUM_CLICKS: return ClickCondition.ALWAYS
+		elif outcome == ModuleOutcome.BATTLE: return ClickCondition.GUEST_WON
+		elif outcome == ModuleOutcome.ARCADE: return ClickCondition.NEVER  # the reward is granted by Module.grant_arcade_prize, using ClickPlan.choose_guest_yield
 		else: raise RuntimeError("Unknown module outcome: %s" % outcome)
 
 	def distribute_items(self, module, clicker):
@@ -99,12 +123,12 @@ class ModuleOwnerYield(ModuleClickYield):
 	class Meta:
 		constraints = (models.UniqueConstraint(fields=("module_item", "item"), name="module_owner_yield_unique_module_item_item"),)
 
-	def should_yield(self, module):
-		outcome = self.module_item.module_info.click_outcome  # cache the related_name query
-		if outcome == ModuleOutcome.PROBABILITY: return True
-		elif outcome == ModuleOutcome.NUM_CLICKS: return False # Handled by clicks calculating
-		elif outcome == ModuleOutcome.BATTLE: return not module.did_guest_win
-		elif outcome == ModuleOutcome.ARCADE: return True
+	@classmethod
+	def get_condition(cls, outcome):
+		if outcome == ModuleOutcome.PROBABILITY: return ClickCondition.ALWAYS
+		elif outcome == ModuleOutcome.NUM_CLICKS: return ClickCondition.NEVER # Handled by clicks calculating
+		elif outcome == ModuleOutcome.BATTLE: return ClickCondition.GUEST_LOST
+		elif outcome == ModuleOutcome.ARCADE: return ClickCondition.ALWAYS
 		else: raise RuntimeError("Unknown module outcome: %s" % outcome)
 
 	def distribute_items(self, module, clicker):
@@ -112,3 +136,80 @@ class ModuleOwnerYield(ModuleClickYield):
 
 # Excluding [ModuleGuestYield], those are handled separately.
 CLICK_HANDLERS = (ModuleMessage, ModuleExecutionCost, ModuleOwnerYield)
+"""Models compiled into click plans. Changes to these reload the static catalog."""
+CLICK_PLAN_MODELS = CLICK_HANDLERS + (ModuleGuestYield, MessageTemplate)
+
+"""Marks the slots of a lottery past the total of its probabilities."""
+_NO_YIELD_CHOSEN = object()
+
+class YieldSampler:
+	"""
+	Chooses one of the guest yields of a module item based on their probabilities, in constant time.
+
+	A single yield is chosen with its probability, otherwise the yields are a lottery where one of them is chosen.
+	Probabilities are whole percentages, so the sampler is a table with one slot per percent, filled with the yields in order.
+	Yields past 100% are never chosen. If the probabilities of a lottery add up to less than 100, draws that fall past their total raise a RuntimeError.
+	"""
+	def __init__(self, yields):
+		self.yields = tuple(yields)
+		slots = []
+		for guest_yield in self.yields:
+			slots.extend([guest_yield] * guest_yield.probability)
+		# nothing for a single yield, no yield chosen for a lottery
+		fill = None if len(self.yields) == 1 else _NO_YIELD_CHOSEN
+		slots.extend([fill] * (100 - len(slots)))
+		self.slots = tuple(slots[:100])
+
+	def choose(self):
+		"""Returns the chosen yield, or None if no yield should be given."""
+		if not self.yields: return None  # no yield for clicking
+		result = self.slots[random.randrange(100)]
+		if result is _NO_YIELD_CHOSEN:
+			raise RuntimeError(f"Couldn't choose a yield for module item {self.yields[0].module_item_id}. Possible yields: {list(self.yields)}")
+		return result
+
+class ClickPlan:
+	"""
+	What happens when a module of a specific module item is clicked, compiled once by the static catalog (see Catalog.get_click_plan).
+	The handlers are in the order of CLICK_HANDLERS, and handlers that never react to the module's outcome are left out.
+	"""
+	def __init__(self, module_info, handlers, guest_yields):
+		self.outcome = module_info.click_outcome
+		self.handlers = []
+		for handler in handlers:
+			condition = self._get_condition(type(handler))
+			if condition != ClickCondition.NEVER:
+				self.handlers.append((handler, condition))
+		self.handlers = tuple(self.handlers)
+		self.guest_yields = tuple(guest_yields)
+		self.guest_yield_condition = self._get_condition(ModuleGuestYield) if self.guest_yields else ClickCondition.NEVER
+		self.guest_yield_sampler = YieldSampler(self.guest_yields)
+
+	def _get_condition(self, handler_type):
+		"""
+		Errors for outcomes a handler type can't handle are raised when the module is clicked, not when the plan is compiled.
+		"""
+		try:
+			return handler_type.get_condition(self.outcome)
+		except RuntimeError as e:
+			return e
+
+	def run_handlers(self, module, clicker):
+		"""Run the handlers whose condition applies to this click."""
+		for handler, condition in self.handlers:
+			if self._applies(condition, module):
+				handler.on_resolved_click(module, clicker)
+
+	def choose_guest_yield(self):
+		"""Choose a guest yield based on the yields' probabilities. Returns None if no yield should be given."""
+		return self.guest_yield_sampler.choose()
+
+	def guest_yield_applies(self, module):
+		"""Returns whether the chosen guest yield should be given to the guest for this click."""
+		return self._applies(self.guest_yield_condition, module)
+
+	@staticmethod
+	def _applies(condition, module):
+		if isinstance(condition, Exception):
+			raise condition
+		return condition.applies(module)
@@ -1,6 +1,7 @@
 import random
 
 from django.contrib.auth.models import User
+from django.db.models import Q
 
 from ..models.dynamic import Friendship, FriendshipStatus, Profile, get_or_none
 from mln.models.dynamic.utils import has_item
@@ -19,10 +20,14 @@ def _get_friendship(user, relation_id):
 def get_friend_request(from_user, to_user) -> Friendship | None:
 	return get_or_none(from_user.outgoing_friendships, to_user=to_user, is_relation=True)
 
-def get_friendship(user1, user2) -> Friendship | None: return (
-	get_or_none(user1.outgoing_friendships, to_user=user2, is_relation=True) or
-	get_or_none(user2.outgoing_friendships, to_user=user1, is_relation=True)
-)
+def _between(user_id, other_user_id):
+	"""Filter for the relations of two users in either direction. Each direction is covered by one of the friendship indexes."""
+	return Q(from_user_id=user_id, to_user_id=other_user_id) | Q(from_user_id=other_user_id, to_user_id=user_id)
+
+def get_friendship(user1, user2) -> Friendship | None:
+	"""Return the relation of the two users in either direction, preferring the one from user1 to user2."""
+	friendships = Friendship.objects.filter(_between(user1.id, user2.id))
+	return min(friendships, key=lambda friendship: friendship.from_user_id != user1.id, default=None)
 
 def send_friend_invite(user, recipient_name) -> Friendship:
 	"""
@@ -142,14 +147,23 @@ def unblock_friend(user, relation_id):
 
 def are_friends(user, other_user_id):
 	"""Return whether the users are friends."""
-	return user.outgoing_friendships.filter(to_user_id=other_user_id, status=FriendshipStatus.FRIEND).exists() or user.incoming_friendships.filter(from_user_id=other_user_id, status=FriendshipStatus.FRIEND).exists()
+	return Friendship.objects.filter(_between(user.id, other_user_id), status=FriendshipStatus.FRIEND).exists()
 
 def choose_friend(user, allow_networkers=False):
-	"""Returns a random friend from the user's friend list."""
-	# Wouldn't help to use Q objects because we wouldn't know which user is the friend
-	incoming = user.incoming_friendships.filter(from_user__profile__is_networker=allow_networkers, status=FriendshipStatus.FRIEND)
-	outgoing = user.outgoing_friendships.filter(to_user__profile__is_networker=allow_networkers, status=FriendshipStatus.FRIEND)
-	incoming_friends = [friendship.from_user for friendship in incoming]
-	outgoing_friends = [friendship.to_user for friendship in outgoing]
-	friends = incoming_friends + outgoing_friends
-	if friends: return random.choice(friends)
+	"""
+	Returns a random friend from the user's friend list, or None if the user doesn't have any.
+	Networkers can have tens of thousands of friends, so instead of loading the friend list, the friends are counted and only the chosen one is fetched.
+	"""
+	# The friends are either senders of incoming or recipients of outgoing friendships, count each side separately
+	incoming = User.objects.filter(outgoing_friendships__to_user=user, outgoing_friendships__status=FriendshipStatus.FRIEND, profile__is_networker=allow_networkers)
+	outgoing = User.objects.filter(incoming_friendships__from_user=user, incoming_friendships__status=FriendshipStatus.FRIEND, profile__is_networker=allow_networkers)
+	incoming_count = incoming.count()
+	count = incoming_count + outgoing.count()
+	if count == 0: return None
+	index = random.randrange(count)
+	if index >= incoming_count:
+		friends, index = outgoing, index - incoming_count
+	else:
+		friends = incoming
+	# None if a friendship was removed since counting
+	return friends.order_by("id")[index:index+1].first()
@@ -1,49 +1,154 @@
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
+from contextlib import nullcontext
 
-from ..models.static import ItemInfo, ItemType
-from ..models.dynamic import get_or_none
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from ..models.dynamic import InventoryStack
+from ..models.static import get_catalog, ItemType
 from .webhooks import run_badge_webhooks
 
+"""
+Largest number of items in a stack, the upper bound of the PositiveSmallIntegerField qty on most databases.
+Stacks are changed with update queries, which skip full_clean, so this is checked explicitly.
+"""
+MAX_STACK_QTY = 32767
+
+def _too_many_items(stack, qty):
+	return ValidationError("Adding %i items to %s would exceed the maximum of %i items per stack" % (qty, stack, MAX_STACK_QTY))
+
+def _add_to_stack(user, item_id, qty):
+	"""
+	Atomically add to the user's stack of the item, if it exists. Return whether it exists.
+	- Raise ValidationError if the stack would have more than MAX_STACK_QTY items.
+	"""
+	while not user.inventory.filter(item_id=item_id, qty__lte=MAX_STACK_QTY - qty).update(qty=F("qty") + qty):
+		stack = user.inventory.filter(item_id=item_id).first()
+		if stack is None:
+			return False
+		if stack.qty + qty > MAX_STACK_QTY:
+			raise _too_many_items(stack, qty)
+		# Another request created the stack or removed items in the meantime, try again
+	return True
+
+def _create_stack(user, item_id, qty):
+	"""
+	Create the user's stack of the item, or add to it if another request created it in the meantime.
+	Return whether the stack was created, which means the user obtained the item for the first time.
+	"""
+	if qty > MAX_STACK_QTY:
+		raise ValidationError("Can't create a stack of %i items, the maximum is %i" % (qty, MAX_STACK_QTY))
+	# Inside a transaction, a savepoint keeps a conflicting insert from breaking it.
+	# Outside of one, the insert is left without a transaction, since on SQLite reading (for full_clean) and then writing in one can fail with a locked database.
+	try:
+		with transaction.atomic() if transaction.get_connection().in_atomic_block else nullcontext():
+			user.inventory.create(item_id=item_id, qty=qty)
+	except (IntegrityError, ValidationError):
+		# Another request created the stack in the meantime, and it obtained the item first.
+		# Otherwise, the item doesn't exist.
+		if _add_to_stack(user, item_id, qty):
+			return False
+		raise
+	return True
+
+def _first_obtained(user, item_id):
+	"""Run the badge webhooks and send the first_obtained_item message, if applicable."""
+	result = get_catalog().items.get(item_id)
+	if result.type == ItemType.BADGE:
+		run_badge_webhooks(user, result.name)
+	from .message import first_obtained_item
+	first_obtained_item(user, item_id)
+
 def add_inv_item(user, item_id, qty=1):
 	"""
 	Add one or more items to the user's inventory.
 	Always use this function instead of creating InventoryStacks directly.
 	This function creates a stack only if it does not already exist, and otherwise adds to the existing stack.
+	The stack is updated in the database without reading it first, so concurrent requests don't lose each other's changes.
 	- If this is the first time the user has obtained this item, it will also trigger the first_obtained_item message (if applicable).
+	- Raise ValidationError if the stack would have more than MAX_STACK_QTY items.
 	"""
-	try:
-		stack = user.inventory.get(item_id=item_id)
-		stack.qty += qty
-		stack.save()
-		return stack
-	except ObjectDoesNotExist:
-		stack = user.inventory.create(item_id=item_id, qty=qty)
-		result = get_or_none(ItemInfo, id=item_id)
-		if result.type == ItemType.BADGE:
-			run_badge_webhooks(user, result.name)
-		from .message import first_obtained_item
-		first_obtained_item(user, item_id)
-		return stack
+	if not _add_to_stack(user, item_id, qty) and _create_stack(user, item_id, qty):
+		_first_obtained(user, item_id)
 
 def remove_inv_item(user, item_id, qty=1):
 	"""
 	Remove one or more items from the user's inventory.
 	Always use this function instead of modifying InventoryStacks directly.
 	This function subtracts the number of items from the stack, and deletes the stack if no more items are left.
+	Like add_inv_item, the stack is updated in the database without reading it first.
 	- Raise RuntimeError if the stack to remove items from does not exist, or if it has fewer items than should be removed.
 	"""
-	try:
-		stack = user.inventory.get(item_id=item_id)
-	except ObjectDoesNotExist:
-		raise RuntimeError("No stack of item ID %i of user %s exists to delete from" % (item_id, user))
-	if stack.qty > qty:
-		stack.qty -= qty
-		stack.save()
-	elif stack.qty == qty:
-		stack.delete()
-	else:
-		raise RuntimeError("%s has fewer items than the %i requested to delete" % (stack, qty))
+	if user.inventory.filter(item_id=item_id, qty__gt=qty).update(qty=F("qty") - qty):
+		return
+	with transaction.atomic():
+		# Updating first locks the stack until it's deleted, so that items added in the meantime aren't deleted with it
+		if not user.inventory.filter(item_id=item_id, qty__gte=qty).update(qty=F("qty") - qty):
+			stack = user.inventory.filter(item_id=item_id).first()
+			if stack is None:
+				raise RuntimeError("No stack of item ID %i of user %s exists to delete from" % (item_id, user))
+			raise RuntimeError("%s has fewer items than the %i requested to delete" % (stack, qty))
+		user.inventory.filter(item_id=item_id, qty=0).delete()
+
+class InventoryTransaction:
+	"""
+	A batch of inventory changes of one or more users, applied together.
+	Use this instead of several calls of add_inv_item and remove_inv_item, for example when items change hands.
+	Changes are collected with add and remove, and applied with commit, which
+	- checks with one query that all stacks have enough items to remove, raising RuntimeError (like remove_inv_item) before changing anything otherwise,
+	  and that no stack would exceed MAX_STACK_QTY items, raising ValidationError (like add_inv_item),
+	- changes all existing stacks with one update, deletes emptied stacks and creates new stacks, all in one transaction,
+	- triggers the first obtained messages and webhooks of the new stacks (like add_inv_item) once the transaction is committed.
+	"""
+	def __init__(self):
+		self.users = {}
+		self.changes = {}  # {(user id, item id): qty}, negative for removals
+
+	def add(self, user, item_id, qty=1):
+		self._change(user, item_id, qty)
+
+	def remove(self, user, item_id, qty=1):
+		self._change(user, item_id, -qty)
+
+	def _change(self, user, item_id, qty):
+		self.users[user.id] = user
+		key = user.id, item_id
+		self.changes[key] = self.changes.get(key, 0) + qty
+
+	def commit(self):
+		changes = {key: qty for key, qty in self.changes.items() if qty != 0}
+		self.changes = {}
+		if not changes:
+			return
+		with transaction.atomic():
+			# Also locks the stacks until the changes are committed
+			stacks = InventoryStack.objects.select_for_update().filter(owner_id__in={user_id for user_id, _ in changes}, item_id__in={item_id for _, item_id in changes})
+			stacks = {(stack.owner_id, stack.item_id): stack for stack in stacks}
+			updated = {}
+			emptied = []
+			created = []
+			for (user_id, item_id), qty in changes.items():
+				stack = stacks.get((user_id, item_id))
+				if stack is None:
+					if qty < 0:
+						raise RuntimeError("No stack of item ID %i of user %s exists to delete from" % (item_id, self.users[user_id]))
+					created.append((user_id, item_id, qty))
+				elif stack.qty + qty > MAX_STACK_QTY:
+					raise _too_many_items(stack, qty)
+				elif stack.qty + qty > 0:
+					updated[stack.id] = qty
+				elif stack.qty + qty == 0:
+					emptied.append(stack.id)
+				else:
+					raise RuntimeError("%s has fewer items than the %i requested to delete" % (stack, -qty))
+			if updated:
+				InventoryStack.objects.filter(id__in=updated).update(qty=F("qty") + Case(*(When(id=id, then=Value(qty)) for id, qty in updated.items()), output_field=IntegerField()))
+			if emptied:
+				InventoryStack.objects.filter(id__in=emptied).delete()
+			for user_id, item_id, qty in created:
+				user = self.users[user_id]
+				if _create_stack(user, item_id, qty):
+					transaction.on_commit(lambda user=user, item_id=item_id: _first_obtained(user, item_id))
 
 def refund_invalid_modules(user):
 	corrupt_modules = user.modules.filter(Q(pos_x__isnull=True) | Q(pos_y__isnull=True))
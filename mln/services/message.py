@@ -1,9 +1,10 @@
 
 from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef
 from ..models.dynamic import Attachment, Message, get_or_none
 from ..models.static import MessageBody, MLNMessage, NetworkerReply, MessageTemplate
 from .friend import are_friends
-from .inventory import add_inv_item, remove_inv_item
+from .inventory import InventoryTransaction, remove_inv_item
 from .webhooks import run_message_webhooks
 
 def _check_recipient(user, recipient_id):
@@ -22,6 +23,22 @@ def create_attachment(message, item_id, qty):
 	remove_inv_item(message.sender, item_id, qty)
 	return Attachment(message=message, item_id=item_id, qty=qty)
 
+def get_inbox(user, before_id=None, count=None):
+	"""
+	Return the messages in the user's inbox, newest first.
+	To page through the inbox, pass the id of the oldest message already seen as before_id, and the page size as count.
+	The sender is selected along with the messages, and each message is annotated with has_attachments and has_easy_replies, so that listing the messages doesn't need further queries.
+	"""
+	messages = user.messages.select_related("sender").annotate(
+		has_attachments=Exists(Attachment.objects.filter(message=OuterRef("pk"))),
+		has_easy_replies=Exists(MessageBody.easy_replies.through.objects.filter(from_messagebody=OuterRef("body_id"))),
+	).order_by("-id")
+	if before_id is not None:
+		messages = messages.filter(id__lt=before_id)
+	if count is not None:
+		messages = messages[:count]
+	return messages
+
 def delete_message(user, message_id):
 	"""Delete a message from the user's inbox, detaching any attachments."""
 	message = detach_attachments(user, message_id)
@@ -30,8 +47,10 @@ def delete_message(user, message_id):
 def detach_attachments(user, message_id):
 	"""Remove attachments from a message and place them in the user's inventory."""
 	message = _get_message(user, message_id)
+	inventory = InventoryTransaction()
 	for attachment in message.attachments.all():
-		add_inv_item(user, attachment.item_id, attachment.qty)
+		inventory.add(user, attachment.item_id, attachment.qty)
+	inventory.commit()
 	message.attachments.all().delete()
 	return message
 
@@ -1,8 +1,8 @@
 from django.core.exceptions import ValidationError
 
-from ..models.static import BlueprintInfo, BlueprintRequirement, ItemInfo, ItemType
+from ..models.static import get_catalog, ItemInfo, ItemType
 from mln.models.dynamic import assert_has_item
-from .inventory import add_inv_item, remove_inv_item
+from .inventory import InventoryTransaction
 
 from .webhooks import run_rank_webhooks
 
@@ -28,24 +28,24 @@ def use_blueprint(user, blueprint_id):
 	Raise RuntimeError if a required item is not in the user's inventory.
 	"""
 	assert_has_item(user, blueprint_id)
-	blueprint_info = BlueprintInfo.objects.get(item_id=blueprint_id)
-	requirements = BlueprintRequirement.objects.filter(blueprint_item_id=blueprint_id)
+	catalog = get_catalog()
+	blueprint_info = catalog.get_blueprint(blueprint_id)
+	requirements = catalog.blueprint_requirements.get(blueprint_id, ())
+	inventory = InventoryTransaction()
 	# remove required items
 	for requirement in requirements:
-		remove_inv_item(user, requirement.item_id, requirement.qty)
+		inventory.remove(user, requirement.item_id, requirement.qty)
 	result = blueprint_info.build
-	if result.type == ItemType.MASTERPIECE:
-		if user.inventory.filter(item_id=result.id).exists():
-			return
-		else:
-			user.profile.rank += 1
-			user.profile.save()
-			run_rank_webhooks(user)
-	elif result.type == ItemType.BADGE:
-		# Running badge webhooks here means they won't run if a badge is just sent
-		# Instead we run them in add_inv_item
-		if user.inventory.filter(item_id=result.id).exists():
-			return
-
+	if result.type in (ItemType.MASTERPIECE, ItemType.BADGE) and user.inventory.filter(item_id=result.id).exists():
+		# Only one of each masterpiece and badge, the requirements are used up anyway
+		inventory.commit()
+		return
 	# add newly built item
-	add_inv_item(user, blueprint_info.build_id)
+	inventory.add(user, blueprint_info.build_id)
+	inventory.commit()
+	if result.type == ItemType.MASTERPIECE:
+		user.profile.rank += 1
+		user.profile.save()
+		run_rank_webhooks(user)
+	# Running badge webhooks here would mean they won't run if a badge is just sent
+	# Instead they run when the badge is added to the inventory
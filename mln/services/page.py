@@ -1,52 +1,135 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.db.transaction import atomic
 
-from ..models.static import ItemInfo, ItemType
-from .inventory import add_inv_item, remove_inv_item
+from ..models.dynamic.module import Module
+from ..models.dynamic.module_settings import ModuleSetupTrade
+from ..models.static import get_catalog, ItemType
+from .inventory import InventoryTransaction
+
+"""
+Cache of public pages.
+Public views of a page by someone other than the owner only differ in the part about the viewer, so the rest of the page response is cached, keyed by the owner and the owner's page version.
+Everything that changes how a page looks bumps the page version (see bump_page_versions and signals.py), which makes the cached page unreachable.
+The page version is stored in the cache as well. If it's evicted, it starts again at the current time in nanoseconds, which is higher than any version before, so an old cached page is never served.
+Cached pages expire after MLN_PUBLIC_PAGE_CACHE_TIMEOUT seconds, which limits how long changes that don't bump the version (like changes to static data) take to show up.
+The cache is disabled by default (a timeout of 0), since page versions are only shared between server processes that share the default cache.
+"""
+def _version_key(user_id):
+	return "mln:page_version:%i" % user_id
+
+def get_page_version(user_id):
+	key = _version_key(user_id)
+	version = cache.get(key)
+	if version is None:
+		cache.add(key, time.time_ns(), timeout=None)
+		version = cache.get(key)
+	return version
+
+def _bump_page_versions(user_ids):
+	for user_id in user_ids:
+		try:
+			cache.incr(_version_key(user_id))
+		except ValueError:
+			pass  # no version yet, so nothing is cached either
+
+def bump_page_versions(*user_ids):
+	"""
+	Call this after changing what the pages of the users look like.
+	The versions are bumped immediately, and again once the transaction is committed, in case a page was cached from uncommitted data in the meantime.
+	"""
+	_bump_page_versions(user_ids)
+	transaction.on_commit(lambda: _bump_page_versions(user_ids))
+
+def _public_page_key(user_id, version):
+	return "mln:public_page:%i:%i" % (user_id, version)
+
+def get_public_page(user_id, render):
+	"""Get the cached public page of the user, or render it with render() and cache it."""
+	timeout = getattr(settings, "MLN_PUBLIC_PAGE_CACHE_TIMEOUT", 0)
+	if not timeout:
+		return render()
+	key = _public_page_key(user_id, get_page_version(user_id))
+	page = cache.get(key)
+	if page is None:
+		page = render()
+		cache.set(key, page, timeout)
+	return page
+
+def _validate_layout(user, modules, present):
+	"""Check the positions and items of the layout, without querying the database like full_clean would."""
+	catalog = get_catalog()
+	taken = set()
+	for instance_id, item_id, pos_x, pos_y in modules:
+		Module._meta.get_field("pos_x").clean(pos_x, None)
+		Module._meta.get_field("pos_y").clean(pos_y, None)
+		if (pos_x, pos_y) in taken:
+			raise ValidationError("There is already a module at position (%i, %i)" % (pos_x, pos_y))
+		taken.add((pos_x, pos_y))
+		if instance_id is None:
+			if catalog.get_item(item_id).type != ItemType.MODULE:
+				raise ValidationError("Item %i is not a module" % item_id)
+		elif instance_id not in present:
+			raise Module.DoesNotExist("Module %i of %s does not exist" % (instance_id, user))
 
 @atomic
 def page_save_layout(user, modules):
 	"""
 	Save the layout of the user's page.
-	Delete all modules of the user that aren't in the list of modules to be saved.
-	Create new modules or update their position on the page.
-	Raise ValueError if a supplied position is out of range.
-	Raise RuntimeError if there is already a module at the supplied position.
+	Delete all modules of the user that aren't in the list of modules to be saved, refunding them and their setup items.
+	Create new modules from the user's inventory or update their position on the page.
+	Raise ValidationError if a supplied position is out of range or taken by another module in the list.
+	Raise RuntimeError if the user doesn't have the items for the new modules.
+
+	The user's modules are loaded once and only the differences are written, in bulk, so the number of queries doesn't depend on the number of modules.
 	"""
-	present_ids = []
-	for instance_id, item_id, pos_x, pos_y in modules:
-		if instance_id is not None:
-			present_ids.append(instance_id)
-	# if a module is not in the supplied list of modules it was removed and should be deleted
-	removed_modules = user.modules.exclude(id__in=present_ids)
-	if not user.profile.is_networker:
-		for module in removed_modules.all():
-			if module.is_setup:
-				module.teardown()
-			add_inv_item(user, module.item_id)
-	removed_modules.delete()
+	bump_page_versions(user.id)
+	present = {module.id: module for module in user.modules.select_related("setup_trade")}
+	_validate_layout(user, modules, present)
+	kept_ids = {instance_id for instance_id, item_id, pos_x, pos_y in modules if instance_id is not None}
+	removed = [module for id, module in present.items() if id not in kept_ids]
+	is_networker = user.profile.is_networker
 
-	# Handle swaps: first set every module's position to None, then re-set in the right places
-	for instance_id, item_id, pos_x, pos_y in modules:
-		if instance_id is None: continue  # a module that is being created won't cause issues
-		module = user.modules.get(id=instance_id)
-		module.pos_x = None
-		module.pos_y = None
-		module.save()
+	catalog = get_catalog()
+	inventory = InventoryTransaction()
+	if not is_networker:
+		for module in removed:
+			if module.is_setup:
+				# same refunds as Module.teardown
+				if ModuleSetupTrade in module.get_settings_classes():
+					refunds = (module.setup_trade.give_item_id, module.setup_trade.give_qty),
+				else:
+					refunds = ((cost.item_id, cost.qty) for cost in catalog.setup_costs.get(module.item_id, ()))
+				for item_id, qty in refunds:
+					inventory.add(user, item_id, qty)
+			inventory.add(user, module.item_id)
+	if removed:
+		Module.objects.filter(id__in=[module.id for module in removed]).delete()
 
-	# todo: database info on how wide modules are, improved overlapping checks based on that info
+	moved = []
+	created = []
 	for instance_id, item_id, pos_x, pos_y in modules:
 		if instance_id is not None:
-			module = user.modules.get(id=instance_id)
-			modified = False
-			if pos_x != module.pos_x:
+			module = present[instance_id]
+			if (module.pos_x, module.pos_y) != (pos_x, pos_y):
 				module.pos_x = pos_x
-				modified = True
-			if pos_y != module.pos_y:
 				module.pos_y = pos_y
-				modified = True
-			if modified:
-				module.save()
+				moved.append(module)
 		else:
-			if not user.profile.is_networker:
-				remove_inv_item(user, item_id)
-			user.modules.create(item_id=item_id, pos_x=pos_x, pos_y=pos_y)
+			if not is_networker:
+				inventory.remove(user, item_id)
+			module = Module(owner=user, item_id=item_id, pos_x=pos_x, pos_y=pos_y)
+			# same as Module.save: modules that don't need setup don't have a setup state
+			module.is_setup = False if module._needs_setup() else None
+			created.append(module)
+	inventory.commit()
+
+	# Handle swaps: first clear the positions of all moved modules, so that setting the new positions doesn't conflict with module_unique_owner_pos
+	if moved:
+		Module.objects.filter(id__in=[module.id for module in moved]).update(pos_x=None, pos_y=None)
+		Module.objects.bulk_update(moved, ("pos_x", "pos_y"))
+	Module.objects.bulk_create(created)
@@ -1,48 +1,235 @@
+"""
+Webhooks notify integrations about events, like a user receiving a message.
+Webhook requests aren't sent while handling the event. Instead, they're queued in the webhook outbox (WebhookDelivery), in the same transaction as the event,
+so that only committed events are sent, and a slow or unreachable integration doesn't slow down the request that caused the event.
+The outbox is sent by "manage.py run_webhook_workers", which retries failed requests with exponential backoff.
+Integrations can opt in to receiving several events in one request (Webhook.batch).
+"""
+import random
+import threading
+from datetime import timedelta
+from types import MappingProxyType
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
 
-from mln.models.dynamic import Webhook, WebhookType, User
+from mln.models.dynamic import Webhook, WebhookDelivery, WebhookType, User
+from mln.stamp import Stamp
 from mln.apis.json import message_response, full_friendship_response
 
+"""Error responses with these status codes are retried, like server errors. Other client errors aren't, since the request wouldn't be any different."""
+RETRY_STATUS_CODES = 408, 429
+
+class SubscriptionIndex:
+  """
+  Process-wide index of the webhooks' ids by (type, user id), with user id None for global webhooks.
+  Webhooks are registered and deleted rarely, while events happen all the time, and usually nobody is subscribed to them.
+  With the index, running the webhooks of an event doesn't use the database unless someone is subscribed.
+  The index is immutable and loaded on first use, like the static catalog (see models/static/catalog.py). Saving or deleting a webhook reloads it (see signals.py),
+  and if the MLN_WEBHOOK_INDEX_STAMP setting is set, other processes reload their index once they notice that file was touched (checked at most once per second).
+  """
+  def __init__(self, stamp):
+    self.stamp = stamp
+    by_user = {}
+    by_type = {}
+    for webhook_id, type, user_id in Webhook.objects.values_list("id", "type", "user_id"):
+      by_user.setdefault((type, user_id), []).append(webhook_id)
+      by_type.setdefault(type, []).append(webhook_id)
+    self.by_user = MappingProxyType({key: tuple(ids) for key, ids in by_user.items()})
+    self.by_type = MappingProxyType({type: tuple(ids) for type, ids in by_type.items()})
+
+  def subscribed(self, type, user_id):
+    """Ids of the webhooks of the type registered on behalf of the user."""
+    return self.by_user.get((type, user_id), ())
+
+  def all(self, type):
+    """Ids of all webhooks of the type."""
+    return self.by_type.get(type, ())
+
+_index_lock = threading.Lock()
+_index = None
+_stamp = Stamp("MLN_WEBHOOK_INDEX_STAMP")
+
+def get_subscription_index():
+  """Get the current subscription index, loading it if necessary."""
+  global _index
+  index = _index
+  if index is not None and _stamp.current() == index.stamp:
+    return index
+  with _index_lock:
+    stamp = _stamp.read()
+    if _index is None or _index.stamp != stamp:
+      _index = SubscriptionIndex(stamp)
+    return _index
+
+def invalidate_subscription_index():
+  """Drop the subscription index of this process, it will be loaded again when it's next used."""
+  global _index
+  _index = None
+
+def _touch_stamp():
+  invalidate_subscription_index()
+  _stamp.touch()
+
+def reload_subscription_index():
+  """
+  Call this after changing webhooks without saving or deleting instances (e.g. with bulk_create or update).
+  The index of this process is dropped immediately, and again once the transaction is committed, in case it was loaded from uncommitted data in the meantime. Other processes are notified after the commit.
+  """
+  invalidate_subscription_index()
+  transaction.on_commit(_touch_stamp)
+
 def run_message_webhooks(message):
-  recipient = message.recipient
-  run_webhooks(
-    webhooks = Webhook.objects.filter(user=recipient, type=WebhookType.MESSAGES),
-    body = message_response(message),
-  )
+  webhook_ids = get_subscription_index().subscribed(WebhookType.MESSAGES, message.recipient_id)
+  if webhook_ids:
+    run_webhooks(webhook_ids, message_response(message))
 
 def run_friendship_webhooks(friendship, actor):
-  if friendship.to_user == actor:
-    recipient = friendship.from_user
+  if friendship.to_user_id == actor.id:
+    recipient_id = friendship.from_user_id
   else:
-    recipient = friendship.to_user
-  run_webhooks(
-    webhooks = Webhook.objects.filter(user=recipient, type=WebhookType.FRIENDSHIPS),
-    body = full_friendship_response(friendship),
-  )
-
-def run_rank_webhooks(user: User): run_webhooks(
-  webhooks = Webhook.objects.filter(type=WebhookType.RANK_UP),
-  body = {
-    "rank": user.profile.rank,
-    "username": user.username,
-  },
-)
-
-def run_badge_webhooks(user: User, badge: str): run_webhooks(
-  webhooks = Webhook.objects.filter(type=WebhookType.BADGE),
-  body = {
-    "badge": badge,
-    "username": user.username,
-  },
-)
-
-def run_webhooks(webhooks, body):
-  for webhook in webhooks.all():
+    recipient_id = friendship.to_user_id
+  webhook_ids = get_subscription_index().subscribed(WebhookType.FRIENDSHIPS, recipient_id)
+  if webhook_ids:
+    run_webhooks(webhook_ids, full_friendship_response(friendship))
+
+def run_rank_webhooks(user: User):
+  webhook_ids = get_subscription_index().all(WebhookType.RANK_UP)
+  if webhook_ids:
+    run_webhooks(webhook_ids, {
+      "rank": user.profile.rank,
+      "username": user.username,
+    })
+
+def run_badge_webhooks(user: User, badge: str):
+  webhook_ids = get_subscription_index().all(WebhookType.BADGE)
+  if webhook_ids:
+    run_webhooks(webhook_ids, {
+      "badge": badge,
+      "username": user.username,
+    })
+
+def run_webhooks(webhook_ids, body):
+  """Queue a request with the body to each of the webhooks in the outbox."""
+  # only the webhooks that still exist, the index of this process may not have noticed a webhook was deleted yet
+  webhooks = Webhook.objects.filter(id__in=webhook_ids).values_list("id", flat=True)
+  WebhookDelivery.objects.bulk_create(WebhookDelivery(webhook_id=webhook_id, body=body) for webhook_id in webhooks)
+
+def get_endpoint(webhook):
+  """The host the webhook's requests go to, for limiting concurrent requests per integration."""
+  return urlsplit(webhook.url).netloc
+
+def claim_deliveries(limit, exclude_webhook_ids=(), webhook_id=None):
+  """
+  Claim up to limit due deliveries, oldest first, by postponing their next attempt for the duration of a lease, so that other workers don't send them as well.
+  Deliveries whose result isn't recorded (because the worker was stopped) are attempted again once the lease is over.
+  """
+  current_time = now()
+  lease_until = current_time + timedelta(seconds=getattr(settings, "MLN_WEBHOOK_TIMEOUT", 5) + 60)
+  due = WebhookDelivery.objects.filter(next_attempt_at__lte=current_time).exclude(webhook_id__in=exclude_webhook_ids)
+  if webhook_id is not None:
+    due = due.filter(webhook_id=webhook_id)
+  claimed = []
+  for delivery in due.select_related("webhook__access_token").order_by("next_attempt_at")[:limit]:
+    # only one worker can change the next attempt from what it read
+    if WebhookDelivery.objects.filter(id=delivery.id, next_attempt_at=delivery.next_attempt_at).update(next_attempt_at=lease_until):
+      delivery.next_attempt_at = lease_until
+      claimed.append(delivery)
+  return claimed
+
+def batch_deliveries(deliveries):
+  """
+  Group claimed deliveries into the lists of deliveries sent in one request.
+  Deliveries of webhooks that opted in to batching are sent together, topped up with more of the webhook's due deliveries, up to MLN_WEBHOOK_BATCH_SIZE per request.
+  Other deliveries are sent on their own.
+  """
+  batch_size = getattr(settings, "MLN_WEBHOOK_BATCH_SIZE", 50)
+  batches = []
+  webhook_batches = {}
+  for delivery in deliveries:
+    if delivery.webhook.batch:
+      webhook_batches.setdefault(delivery.webhook_id, []).append(delivery)
+    else:
+      batches.append([delivery])
+  for webhook_id, webhook_deliveries in webhook_batches.items():
+    if len(webhook_deliveries) < batch_size:
+      webhook_deliveries += claim_deliveries(batch_size - len(webhook_deliveries), webhook_id=webhook_id)
+    batches += (webhook_deliveries[i:i+batch_size] for i in range(0, len(webhook_deliveries), batch_size))
+  return batches
+
+def release_deliveries(deliveries):
+  """Give up the claim of deliveries without attempting them, so that they're due again."""
+  for delivery in deliveries:
+    WebhookDelivery.objects.filter(id=delivery.id, next_attempt_at=delivery.next_attempt_at).update(next_attempt_at=now())
+
+class DeliveryClient:
+  """
+  Sends webhook requests over keep-alive connections, with a requests session per host, so that a connection (and TLS handshake) isn't needed for every request.
+  Each session keeps up to pool_size connections to its host open, use at least as many as the number of requests sent to the same host at the same time.
+  Can be used from several threads, and doesn't use the database.
+  """
+  def __init__(self, pool_size=None):
+    self.pool_size = pool_size or getattr(settings, "MLN_WEBHOOK_POOL_SIZE", 2)
+    self.sessions = {}
+    self.lock = threading.Lock()
+
+  def session(self, endpoint):
+    with self.lock:
+      session = self.sessions.get(endpoint)
+      if session is None:
+        session = self.sessions[endpoint] = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+      return session
+
+  def send(self, deliveries):
+    """
+    Send the webhook request of claimed deliveries of the same webhook, see batch_deliveries.
+    Batching webhooks receive a JSON array of the deliveries' bodies, others the body of their only delivery.
+    Return None if it was received, otherwise (error, whether to retry).
+    """
+    webhook = deliveries[0].webhook
+    body = [delivery.body for delivery in deliveries] if webhook.batch else deliveries[0].body
     headers = {"Api-Token": webhook.secret}
     if webhook.access_token:  # Not all webhooks have an access token
-      headers["Authorization"] = f"Bearer {webhook.access_token.access_token}"
+      # only the hash of the token is stored, integrations can compare it to the hash of theirs
+      headers["Access-Token-Hash"] = webhook.access_token.access_token_hash
+    try:
+      response = self.session(get_endpoint(webhook)).post(webhook.url, json=body, headers=headers, timeout=getattr(settings, "MLN_WEBHOOK_TIMEOUT", 5))
+    except requests.RequestException as error:
+      return str(error), True
+    if response.ok:
+      return None
+    return f"HTTP {response.status_code}", response.status_code >= 500 or response.status_code in RETRY_STATUS_CODES
+
+  def close(self):
+    with self.lock:
+      for session in self.sessions.values():
+        session.close()
+      self.sessions.clear()
 
-    # We don't care if these requests go through
-    try: requests.post(webhook.url, json=body, headers=headers, timeout=1)
-    except requests.ConnectionError: pass
-    except requests.exceptions.Timeout: pass
+def record_deliveries(deliveries, result):
+  """
+  Record the result of DeliveryClient.send.
+  Sent deliveries are deleted. Failed ones are retried after MLN_WEBHOOK_RETRY_DELAY seconds, doubling with each attempt,
+  until MLN_WEBHOOK_MAX_ATTEMPTS attempts have failed or the error isn't worth retrying.
+  """
+  if result is None:
+    WebhookDelivery.objects.filter(id__in=[delivery.id for delivery in deliveries]).delete()
+    return
+  error, retry = result
+  for delivery in deliveries:
+    delivery.attempts += 1
+    delivery.last_error = error[:WebhookDelivery._meta.get_field("last_error").max_length]
+    if retry and delivery.attempts < getattr(settings, "MLN_WEBHOOK_MAX_ATTEMPTS", 5):
+      delay = getattr(settings, "MLN_WEBHOOK_RETRY_DELAY", 10) * 2 ** (delivery.attempts - 1)
+      # jitter, so that the retries of deliveries that failed together are spread out
+      delivery.next_attempt_at = now() + timedelta(seconds=delay * random.uniform(1, 1.5))
+    else:
+      delivery.next_attempt_at = None
+    WebhookDelivery.objects.filter(id=delivery.id).update(attempts=delivery.attempts, last_error=delivery.last_error, next_attempt_at=delivery.next_attempt_at)
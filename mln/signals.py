@@ -1,20 +1,29 @@
 """Module for signal handlers."""
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 
-from .models.dynamic import Profile, get_or_none
-from .models.static import StartingStack
+from .apis.utils import evict_access_tokens
+from .models.dynamic import AboutMe, Friendship, InventoryStack, OAuthClient, OAuthToken, Profile, Webhook, get_or_none
+from .models.dynamic.module import Module, module_settings_classes
+from .models.static import get_catalog, ItemType, reload_catalog, StartingStack
+from .models.static.catalog import CATALOG_MODELS
+from .models.static.module_handlers import CLICK_PLAN_MODELS
 from .services.friend import add_networker_friend
-from .services.inventory import add_inv_item
+from .services.inventory import InventoryTransaction
+from .services.page import bump_page_versions
+from .services.webhooks import reload_subscription_index
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
 	"""Add a profile for user data, as well as MLN's starting items, when a user is created."""
 	if created:
 		profile = Profile.objects.create(user=instance)
+		inventory = InventoryTransaction()
 		for stack in StartingStack.objects.all():
-			add_inv_item(instance, stack.item_id, stack.qty)
+			inventory.add(instance, stack.item_id, stack.qty)
+		inventory.commit()
 		# Find and add Echo as a friend
 		echo = get_or_none(User, username="Echo")
 		if echo is not None and echo != instance:  # skip when creating Echo himself!
@@ -26,3 +35,114 @@ def pre_save_full_clean_handler(sender, instance, *args, **kwargs):
 	"""Force mln models to call full_clean before save."""
 	if sender.__module__.startswith("mln"):
 		instance.full_clean()
+
+def static_data_changed_handler(sender, **kwargs):
+	"""Reload the static catalog when cached static data is changed, for example in the admin interface."""
+	reload_catalog()
+
+# Connected to the cached models only: a delete receiver for all models would prevent fast deletes of any model.
+for model in CATALOG_MODELS + CLICK_PLAN_MODELS:
+	post_save.connect(static_data_changed_handler, sender=model)
+	post_delete.connect(static_data_changed_handler, sender=model)
+
+@receiver(post_save, sender=Webhook)
+@receiver(post_delete, sender=Webhook)
+def webhook_changed_handler(sender, **kwargs):
+	"""Reload the webhook subscription index when a webhook is registered, changed or deleted, including in the admin interface."""
+	reload_subscription_index()
+
+@receiver(post_save, sender=OAuthToken)
+@receiver(post_delete, sender=OAuthToken)
+def access_token_changed_handler(sender, instance, created=False, **kwargs):
+	"""Evict an access token from the authentication cache when it's changed or revoked, by oauth_logout, in the admin interface or by deleting its user or client. New tokens can't be cached yet."""
+	if not created:
+		evict_access_tokens([instance.access_token_hash])
+
+@receiver(post_save, sender=OAuthClient)
+def oauth_client_changed_handler(sender, instance, created, **kwargs):
+	"""The cached access tokens of a client include a digest of its secret, evict them when the client is changed."""
+	if not created:
+		evict_access_tokens(OAuthToken.objects.filter(client=instance).values_list("access_token_hash", flat=True))
+
+"""Saves that only update these fields don't change how pages look, so they don't bump page versions."""
+PAGE_UNCHANGED_FIELDS = {
+	Module: frozenset(("clicks_since_last_harvest", "total_clicks", "yield_since_last_harvest", "last_harvest_time")),
+	Profile: frozenset(("available_votes", "last_vote_update_time")),
+	User: frozenset(("last_login", "password")),
+}
+
+def _changes_page(sender, update_fields):
+	return update_fields is None or not update_fields <= PAGE_UNCHANGED_FIELDS.get(sender, frozenset())
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed_handler(sender, instance, update_fields=None, **kwargs):
+	if _changes_page(sender, update_fields):
+		bump_page_versions(instance.owner_id)
+
+def module_settings_changed_handler(sender, instance, **kwargs):
+	bump_page_versions(instance.module.owner_id)
+
+# Settings are only removed along with their module, or replaced by ModuleSaveSettings, which both bump the page version already.
+for model in {cls for classes in module_settings_classes.values() for cls in classes}:
+	post_save.connect(module_settings_changed_handler, sender=model)
+
+@receiver(post_save, sender=AboutMe)
+@receiver(post_delete, sender=AboutMe)
+def about_me_changed_handler(sender, instance, **kwargs):
+	bump_page_versions(instance.user_id)
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def friendship_changed_handler(sender, instance, **kwargs):
+	bump_page_versions(instance.from_user_id, instance.to_user_id)
+
+@receiver(post_save, sender=InventoryStack)
+@receiver(post_delete, sender=InventoryStack)
+def inventory_changed_handler(sender, instance, created=True, **kwargs):
+	"""Public pages show the badges and trophies the owner has, but not how many."""
+	if not created:
+		return
+	catalog = get_catalog()
+	item = catalog.items.get(instance.item_id)
+	if instance.item_id in catalog.trophy_ids or (item is not None and item.type == ItemType.BADGE):
+		bump_page_versions(instance.owner_id)
+
+"""Fields shown in the friend lists on the pages of the user's friends. Only changes to these bump the page versions of the friends."""
+FRIEND_LIST_FIELDS = {
+	Profile: ("avatar", "rank", "is_networker", "is_secret"),
+	User: ("username",),
+}
+"""Value of fields that weren't loaded (deferred), so it's not known whether they changed."""
+_NOT_LOADED = object()
+
+def _friend_list_values(sender, instance):
+	# from __dict__, so that deferred fields aren't loaded
+	return tuple(instance.__dict__.get(name, _NOT_LOADED) for name in FRIEND_LIST_FIELDS[sender])
+
+@receiver(post_init, sender=Profile)
+@receiver(post_init, sender=User)
+def remember_friend_list_values(sender, instance, **kwargs):
+	"""Remember the values of the fields shown in friend lists, so that saves can tell whether they changed."""
+	instance._friend_list_values = _friend_list_values(sender, instance)
+
+def _friend_list_changed(sender, instance, update_fields):
+	if update_fields is not None:
+		return not update_fields.isdisjoint(FRIEND_LIST_FIELDS[sender])
+	old_values = instance._friend_list_values
+	return _NOT_LOADED in old_values or old_values != _friend_list_values(sender, instance)
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=User)
+def user_changed_handler(sender, instance, created=False, update_fields=None, **kwargs):
+	"""The user's profile is shown on their page. Their name, avatar and rank are also shown in their friends' friend lists."""
+	friend_list_changed = _friend_list_changed(sender, instance, update_fields)
+	instance._friend_list_values = _friend_list_values(sender, instance)
+	if created or not _changes_page(sender, update_fields):
+		return
+	user_id = instance.id if sender is User else instance.user_id
+	if not friend_list_changed:
+		bump_page_versions(user_id)
+		return
+	friendships = Friendship.objects.filter(Q(from_user_id=user_id) | Q(to_user_id=user_id)).values_list("from_user_id", "to_user_id")
+	bump_page_versions(user_id, *{friend_id for friendship in friendships for friend_id in friendship if friend_id != user_id})
@@ -0,0 +1,49 @@
+"""
+Stamp files notify all server processes of a change, so that they drop their process-wide caches (like the static catalog, see models/static/catalog.py).
+The process making the change touches the file once it's committed, and the other processes compare the file's modification time to the one their cache was loaded with.
+"""
+import os
+import time
+
+from django.conf import settings
+
+class Stamp:
+	"""
+	A stamp file, with its path in the setting_name setting. If the setting is None, no file is used, and other processes aren't notified.
+	check_interval is the minimum time between two checks of the file by current(), in seconds.
+	"""
+	def __init__(self, setting_name, check_interval=1):
+		self.setting_name = setting_name
+		self.check_interval = check_interval
+		self._value = None
+		self._next_check = 0
+
+	@property
+	def path(self):
+		return getattr(settings, self.setting_name, None)
+
+	def read(self):
+		"""Return the modification time of the file, or None if there's no file."""
+		path = self.path
+		value = None
+		if path is not None:
+			try:
+				value = os.stat(path).st_mtime_ns
+			except FileNotFoundError:
+				pass
+		self._value = value
+		self._next_check = time.monotonic() + self.check_interval
+		return value
+
+	def current(self):
+		"""Like read(), but the file is read at most once per check_interval, in between the last value is returned."""
+		if time.monotonic() < self._next_check:
+			return self._value
+		return self.read()
+
+	def touch(self):
+		"""Touch the file, so that other processes notice the change."""
+		path = self.path
+		if path is not None:
+			with open(path, "a"):
+				os.utime(path)
@@ -0,0 +1,41 @@
+"""
+Template loaders for the "mln_xml" template engine, which renders the XML responses sent to the flash client.
+The flash client doesn't need any of the indentation in the XML templates, and the responses are a lot smaller without it.
+Instead of stripping whitespace from every rendered response, it's removed from the template source when the template is loaded.
+Wrapped in django's cached loader (see settings.TEMPLATES), this only happens once per template and process, no matter if DEBUG is on.
+"""
+import re
+
+from django.template.base import tag_re
+from django.template.loaders import app_directories
+
+def strip_text(text):
+	"""
+	Remove whitespace surrounding XML tags (same as standard django tag "spaceless") and also remove whitespace surrounding django template language constructs.
+	The result should be XML as much whitespace removed as possible.
+	"""
+	text = re.sub(r"(^\s+)|(\s+$)", " ", text) # if the string starts or ends with whitespace replace it with a single space (needed for some edge cases)
+	# remove whitespace near tag boundaries
+	text = re.sub(r"\s*(/?>)\s*", r"\1", text)
+	text = re.sub(r"\s+<", "<", text)
+	return text
+
+def strip_whitespace(source):
+	"""
+	Strip whitespace from the text between template language constructs, leaving the constructs themselves untouched.
+	Text consisting only of whitespace is removed completely.
+	"""
+	result = []
+	in_tag = False
+	for bit in tag_re.split(source):
+		if in_tag:
+			result.append(bit)
+		elif bit.strip():
+			result.append(strip_text(bit))
+		in_tag = not in_tag
+	return "".join(result)
+
+class Loader(app_directories.Loader):
+	"""Load templates from the apps' template directories, with whitespace stripped."""
+	def get_contents(self, origin):
+		return strip_whitespace(super().get_contents(origin))
@@ -1,14 +1,11 @@
 """Various utility functions for accessing or formatting data for templates that would be too complex to do in the templates themselves."""
-import re
 from django import template
-from django.core.exceptions import ObjectDoesNotExist
 from django.template import loader
-from django.template.base import DebugLexer, Lexer, tag_re, TextNode
 
 from mln.models.dynamic.module_settings import ModuleSaveGeneric, ModuleSaveNetworkerPic, ModuleSaveNetworkerText, ModuleSaveRocketGame, ModuleSaveSoundtrack, ModuleSaveSticker, ModuleSaveUGC, ModuleSetupFriendShare, ModuleSetupGroupPerformance, ModuleSetupTrade, ModuleSetupTrioPerformance
 from mln.models.dynamic.module_settings_arcade import HopArcadeElement, ModuleSaveConcertArcade, ModuleSaveDeliveryArcade, ModuleSaveDestructoidArcade, ModuleSaveHopArcade
 from mln.models.dynamic import get_or_none as get_model
-from mln.models.static import ItemType, MessageReplyType, ItemInfo
+from mln.models.static import get_catalog, ItemType, MessageReplyType, ItemInfo
 
 SAVE_TEMPLATES = {
 	ModuleSaveConcertArcade: "concert_arcade",
@@ -93,16 +90,19 @@ def get_destructoid_arcade_grid(module):
 def get_hop_arcade_grid(module):
 	save = module.save_hop_arcade
 	rows = "top", "middle", "bottom"
+	# work on copies of the packed fields, so that the save can be rendered more than once
+	values = {name: getattr(save, name) for name in ("%s_%i" % (row, k) for row in rows for k in range(3))}
 	for i in range(30):
 		column = []
 		for j in range(3):
-			value = getattr(save, "%s_%i" % (rows[j], i // 10))
+			name = "%s_%i" % (rows[j], i // 10)
+			value = values[name]
 			elem_value = value & 0x07
 			if elem_value == 0:
 				column.append("0")
 			else:
 				column.append("m_"+HopArcadeElement(elem_value).name.lower())
-			setattr(save, "%s_%i" % (rows[j], i // 10), value >> 3)
+			values[name] = value >> 3
 		yield column
 
 @register.filter
@@ -115,6 +115,11 @@ def get_generic_settings(module):
 def get_or_none(obj, name):
 	return getattr(obj, name, None)
 
+@register.filter
+def get_page_yield(module, yields):
+	"""Get the yield item id and qty of a module from the yields of its page (see calc_yields)."""
+	return yields[module.id][:2]
+
 @register.filter
 def get_save_soundtrack(module):
 	save = get_or_none(module, "save_soundtrack")
@@ -153,7 +158,11 @@ def is_background(sticker):
 
 @register.filter
 def replyable(message):
-	if message.body.easy_replies.exists():
+	"""Messages from get_inbox are annotated with whether their body has easy replies."""
+	has_easy_replies = getattr(message, "has_easy_replies", None)
+	if has_easy_replies is None:
+		has_easy_replies = message.body.easy_replies.exists()
+	if has_easy_replies:
 		return MessageReplyType.NORMAL_AND_EASY_REPLY.value
 	else:
 		return MessageReplyType.NORMAL_REPLY_ONLY.value
@@ -164,75 +173,11 @@ def get_valid_modules(owner):
 
 @register.filter
 def get_trophies(owner):
-	result = []
-	for trophyID in ["103022", "103030", "103026", "103024", "103021", "103032", "103031"]:
-		try:
-			trophy = owner.inventory.get(item__id=trophyID)
-			result.append(trophy.item)
-		except ObjectDoesNotExist:
-			continue
-	return result
-
-# Fix for Django template compilation, to remove whitespace from templates.
-# The two tokenize functions are changed to avoid generating a TextNode when the text content is only whitespace.
-# The TextNode constructor is changed to remove as much whitespace as possible from the content.
-
-def tokenize_fix(self):
-	in_tag = False
-	lineno = 1
-	result = []
-	for bit in tag_re.split(self.template_string):
-		if bit.strip():
-			result.append(self.create_token(bit, None, lineno, in_tag))
-		in_tag = not in_tag
-		lineno += bit.count('\n')
-	return result
-
-Lexer.tokenize = tokenize_fix
-
-def debug_tokenize_fix(self):
-	lineno = 1
-	result = []
-	upto = 0
-	for match in tag_re.finditer(self.template_string):
-		start, end = match.span()
-		if start > upto:
-			token_string = self.template_string[upto:start]
-			if token_string.strip():
-				result.append(self.create_token(token_string, (upto, start), lineno, in_tag=False))
-			lineno += token_string.count('\n')
-			upto = start
-		token_string = self.template_string[start:end]
-		if token_string.strip():
-			result.append(self.create_token(token_string, (start, end), lineno, in_tag=True))
-		lineno += token_string.count('\n')
-		upto = end
-	last_bit = self.template_string[upto:]
-	if last_bit.strip():
-		result.append(self.create_token(last_bit, (upto, upto + len(last_bit)), lineno, in_tag=False))
-	return result
-
-def whitespace_fix(self, s):
-	"""
-	Remove whitespace surrounding XML tags (same as standard django tag "spaceless") and also remove whitespace surrounding django template language constructs.
-	The result should be XML as much whitespace removed as possible.
-	Also, since this is done at template compilation time and not at template rendering time (which is where "spaceless" executes for some reason), it's also faster than "spaceless".
-	"""
-	s = re.sub(r"(^\s+)|(\s+$)", " ", s) # if the string starts or ends with whitespace replace it with a single space (needed for some edge cases)
-	# remove whitespace near tag boundaries
-	s = re.sub(r"\s*(/?>)\s*", r"\1", s)
-	s = re.sub(r"\s+<", "<", s)
-	self.s = s
+	"""Get the trophy items the owner has, in display order. Compute this once per page, it queries the owner's inventory."""
+	catalog = get_catalog()
+	owned = set(owner.inventory.filter(item_id__in=catalog.trophy_ids).values_list("item_id", flat=True))
+	return [trophy for trophy in catalog.trophies if trophy.id in owned]
 
 def render_to_string_stripped(template, context):
-	olt = Lexer.tokenize
-	odlt = DebugLexer.tokenize
-	Lexer.tokenize = tokenize_fix
-	DebugLexer.tokenize = debug_tokenize_fix
-	res = loader.render_to_string(template, context)
-	Lexer.tokenize = olt
-	DebugLexer.tokenize = odlt
-	return res
-
-
-TextNode.__init__ = whitespace_fix
+	"""Render an XML template with the "mln_xml" engine, which strips whitespace from templates when loading them."""
+	return loader.render_to_string(template, context, using="mln_xml")
@@ -0,0 +1,105 @@
+import json
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.utils.timezone import now
+
+from mln.apis import utils
+from mln.apis.utils import _access_token_key, _authenticate_request
+from mln.models.dynamic import hash_access_token, OAuthClient, OAuthCode, OAuthToken
+from mln.tests.models.test_profile import one_user
+from mln.tests.setup_testcase import requires, setup, TestCase
+
+@setup
+@requires(one_user)
+def access_token(self):
+	self.oauth_client = OAuthClient.objects.create(client_id="client", client_name="Client", client_secret="secret", image_url="https://example.com/image.png", redirect_url="https://example.com/")
+	code = OAuthCode.objects.create(user=self.user, auth_code="code", client=self.oauth_client, generated_at=now())
+	self.access_token = OAuthToken.objects.create(auth_code=code, access_token_hash=hash_access_token("token"), user=self.user, client=self.oauth_client)
+
+class Authentication(TestCase):
+	SETUP = access_token,
+
+	def _authenticate(self, token="token", api_token="secret"):
+		return _authenticate_request(RequestFactory().get("/api/messages", HTTP_AUTHORIZATION="Bearer " + token, HTTP_API_TOKEN=api_token))
+
+	def test_authenticate(self):
+		access_token = self._authenticate()
+		self.assertEqual(access_token, self.access_token)
+		self.assertEqual(access_token.user, self.user)
+		self.assertEqual(access_token.client, self.oauth_client)
+
+	def test_cached(self):
+		with self.assertNumQueries(1):
+			self._authenticate()
+		with self.assertNumQueries(0):
+			access_token = self._authenticate()
+		self.assertEqual(access_token, self.access_token)
+		self.assertEqual(access_token.user_id, self.user.id)
+
+	def test_invalid(self):
+		for token, api_token in (("token", "wrong"), ("wrong", "secret")):
+			# also when the token is cached
+			self._authenticate()
+			self.assertEqual(self._authenticate(token, api_token).status_code, 401)
+
+	def test_revoked(self):
+		self._authenticate()
+		self.access_token.delete()
+		self.assertEqual(self._authenticate().status_code, 401)
+
+	def test_revoked_in_other_process(self):
+		# the stamp file is in a temporary directory during tests (see mln/tests/runner.py)
+		self._authenticate()
+		key = _access_token_key(self.access_token.access_token_hash)
+		cached = cache.get(key)
+		# another process revoking the token, with its own cache
+		with self.captureOnCommitCallbacks(execute=True):
+			self.access_token.delete()
+		cache.set(key, cached)
+		# rejected right away, the stamp is checked on every lookup
+		self.assertEqual(self._authenticate().status_code, 401)
+
+	@patch("mln.apis.utils._cache_is_shared", return_value=True)
+	def test_revoked_shared_cache(self, _):
+		self._authenticate()
+		key = _access_token_key(self.access_token.access_token_hash)
+		cached = cache.get(key)
+		stamp = utils._stamp.read()
+		with self.captureOnCommitCallbacks(execute=True):
+			self.access_token.delete()
+		# a request that read the token before it was revoked can't cache it again
+		self.assertFalse(cache.add(key, cached))
+		self.assertEqual(self._authenticate().status_code, 401)
+		# tokens cached by other processes stay cached
+		self.assertEqual(utils._stamp.read(), stamp)
+
+	def test_logout(self):
+		self._authenticate()
+		response = self.client.post("/api/logout", HTTP_AUTHORIZATION="Bearer token", HTTP_API_TOKEN="secret")
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(OAuthToken.objects.exists())
+		self.assertEqual(self._authenticate().status_code, 401)
+
+	def test_client_secret_changed(self):
+		self._authenticate()
+		self.oauth_client.client_secret = "new secret"
+		self.oauth_client.save()
+		self.assertEqual(self._authenticate().status_code, 401)
+		self.assertEqual(self._authenticate(api_token="new secret"), self.access_token)
+
+	def test_get_token(self):
+		code = OAuthCode.objects.create(user=self.user, auth_code="new code", client=self.oauth_client, generated_at=now())
+		response = self.client.post("/oauth/token", json.dumps({"api_token": "secret", "auth_code": "new code"}), content_type="application/json")
+		token = response.json()["access_token"]
+		# only the hash is stored
+		self.assertFalse(OAuthToken.objects.filter(access_token_hash=token).exists())
+		self.assertEqual(OAuthToken.objects.get(auth_code=code).access_token_hash, hash_access_token(token))
+		self.assertEqual(self._authenticate(token), OAuthToken.objects.get(auth_code=code))
+
+	def test_webhook_registration(self):
+		response = self.client.post("/api/webhooks", json.dumps({"webhook_url": "https://example.com/webhook", "mln_secret": "webhook secret", "type": "messages"}), content_type="application/json", HTTP_AUTHORIZATION="Bearer token", HTTP_API_TOKEN="secret")
+		self.assertEqual(response.status_code, 201)
+		self.assertEqual(response.json()["access_token"], "token")
+		self.assertEqual(response.json()["access_token_hash"], hash_access_token("token"))
@@ -0,0 +1,47 @@
+import json
+
+from mln.tests.apis.test_auth import access_token
+from mln.tests.models.test_dynamic import attachment
+from mln.tests.services.test_message import easy_reply_body
+from mln.tests.setup_testcase import TestCase
+
+class Inbox(TestCase):
+	SETUP = access_token, attachment, easy_reply_body
+
+	def setUp(self):
+		super().setUp()
+		self.ids = [self.message.id] + [self.user.messages.create(sender=self.other_user, body_id=self.REPLY_BODY.id).id for _ in range(3)]
+
+	def _get(self, query=""):
+		response = self.client.get("/api/messages" + query, HTTP_AUTHORIZATION="Bearer token", HTTP_API_TOKEN="secret")
+		content = b"".join(response.streaming_content) if response.streaming else response.content
+		return response.status_code, json.loads(content) if response.status_code == 200 else content
+
+	def test_all(self):
+		status, messages = self._get()
+		self.assertEqual(status, 200)
+		self.assertEqual([message["id"] for message in messages], self.ids[::-1])
+		self.assertEqual(messages[-1]["attachments"], [{"item_id": self.ITEM_ID, "name": "Test Item", "qty": 1}])
+		self.assertEqual(messages[-1]["replies"], [{"id": self.REPLY_BODY.id, "subject": self.REPLY_BODY.subject, "text": self.REPLY_BODY.text}])
+
+	def test_pages(self):
+		status, messages = self._get("?limit=3")
+		self.assertEqual([message["id"] for message in messages], self.ids[:0:-1])
+		status, messages = self._get("?limit=3&before_id=%i" % messages[-1]["id"])
+		self.assertEqual([message["id"] for message in messages], self.ids[:1])
+
+	def test_count(self):
+		status, messages = self._get("?count=2")
+		self.assertEqual([message["id"] for message in messages], self.ids[:1:-1])
+
+	def test_invalid(self):
+		status, content = self._get("?before_id=abc")
+		self.assertEqual(status, 400)
+
+	def test_queries(self):
+		# token with client, user, messages with senders and bodies, attachments, easy replies
+		with self.assertNumQueries(5):
+			self._get()
+		# the token is cached now
+		with self.assertNumQueries(4):
+			self._get("?limit=10")
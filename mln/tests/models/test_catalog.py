@@ -0,0 +1,72 @@
+import os.path
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+
+from mln.models.static import get_catalog, ItemInfo, ItemType, ModuleHarvestYield, ModuleInfo, reload_catalog
+from mln.models.static import catalog
+from mln.tests.setup_testcase import TestCase
+from mln.tests.models.test_module import has_harvestable_module, setupable_module
+from mln.tests.models.test_static import blueprint_req
+
+class Catalog(TestCase):
+	SETUP = has_harvestable_module, setupable_module, blueprint_req
+
+	def test_lookups(self):
+		static = get_catalog()
+		with self.assertNumQueries(0):
+			self.assertEqual(static.get_item(self.ITEM_ID).name, "Test Item")
+			self.assertEqual(static.get_module_info(self.HARVESTABLE_MODULE_ID).item.id, self.HARVESTABLE_MODULE_ID)
+			self.assertEqual(static.get_harvest_yield(self.HARVESTABLE_MODULE_ID).yield_item.name, "Test Item")
+			self.assertEqual([cost.item.id for cost in static.setup_costs[self.SETUPABLE_MODULE_ID]], [self.ITEM_ID])
+			self.assertEqual(static.get_blueprint(self.BLUEPRINT_ID).build.id, self.ITEM_ID)
+			self.assertEqual([requirement.item_id for requirement in static.blueprint_requirements[self.BLUEPRINT_ID]], [self.REQUIREMENT_ID])
+
+	def test_does_not_exist(self):
+		static = get_catalog()
+		with self.assertRaises(ItemInfo.DoesNotExist):
+			static.get_item(-1)
+		with self.assertRaises(ModuleInfo.DoesNotExist):
+			static.get_module_info(self.ITEM_ID)
+		with self.assertRaises(ModuleHarvestYield.DoesNotExist):
+			static.get_harvest_yield(self.SETUPABLE_MODULE_ID)
+
+	def test_immutable(self):
+		with self.assertRaises(TypeError):
+			get_catalog().items[-1] = None
+
+	def test_loaded_once(self):
+		get_catalog()
+		with self.assertNumQueries(0):
+			get_catalog()
+			self.h_module.calc_yield_qty()
+			self.h_module.get_yield_item_id()
+			self.h_module.get_settings_classes()
+
+	def test_reload_on_save(self):
+		old = get_catalog()
+		item = ItemInfo.objects.create(name="New Item", type=ItemType.ITEM)
+		self.assertIsNot(get_catalog(), old)
+		self.assertEqual(get_catalog().get_item(item.id).name, "New Item")
+		item.delete()
+		self.assertNotIn(item.id, get_catalog().items)
+
+	def test_stamp(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(MLN_STATIC_CATALOG_STAMP=os.path.join(directory, "stamp")):
+			old = get_catalog()
+			# another process reloading its catalog
+			catalog._touch_stamp()
+			catalog._catalog = old
+			catalog._stamp._next_check = 0
+			self.assertIsNot(get_catalog(), old)
+
+	def test_reload_on_commit(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(MLN_STATIC_CATALOG_STAMP=os.path.join(directory, "stamp")):
+			with self.captureOnCommitCallbacks(execute=True):
+				reload_catalog()
+			self.assertTrue(os.path.exists(os.path.join(directory, "stamp")))
+
+	def test_stamp_outside_checkout(self):
+		# the test runner moves the stamp, so that tests don't make a running server reload its catalog
+		self.assertFalse(settings.MLN_STATIC_CATALOG_STAMP.startswith(str(settings.BASE_DIR)))
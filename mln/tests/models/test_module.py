@@ -1,9 +1,15 @@
+import random
+from collections import Counter
 from datetime import timedelta
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
 
+from mln.models.dynamic.module import calc_yields
 from mln.models.dynamic.module_settings import ModuleSetupTrade
 from mln.models.static import *
+from mln.models.static.catalog import CATALOG_MODELS
 from mln.models.static.module_handlers import *
 from mln.services.inventory import add_inv_item
 from mln.tests.setup_testcase import cls_setup, requires, setup, TestCase
@@ -139,6 +145,17 @@ class Harvest(TestCase):
 	def test_get_yield_item_id(self):
 		self.assertEqual(self.h_module.get_yield_item_id(), self.MODULE_YIELD_INFO.yield_item_id)
 
+	def test_calc_yields(self):
+		self.h_module.last_harvest_time -= timedelta(hours=30)
+		other = self.user.modules.create(item_id=self.HARVESTABLE_MODULE_ID, pos_x=1, pos_y=0, clicks_since_last_harvest=50)
+		now = other.last_harvest_time + timedelta(hours=1)
+		with patch("mln.models.dynamic.module.now", return_value=now) as now_mock, self.assertNumQueries(0):
+			yields = calc_yields([self.h_module, other])
+			self.assertEqual(now_mock.call_count, 1)
+			self.assertEqual(yields, {module.id: (self.ITEM_ID, *module._calc_yield_info()) for module in (self.h_module, other)})
+		self.assertEqual(yields[self.h_module.id][1], 6)
+		self.assertEqual(yields[other.id][1], 2)
+
 	def test_harvest(self):
 		clicks = 42
 		now = self.h_module.last_harvest_time
@@ -182,6 +199,91 @@ class Execute_Ok(TestCase):
 		self.assertEqual(self.s_module.total_clicks, 1)
 		self.assertEqual(self.other_user.profile.available_votes, av_votes - 1)
 
+class Click_Plan(TestCase):
+	SETUP = two_users, setup_setupable_module, has_execution_cost
+
+	def test_no_static_queries(self):
+		get_catalog()
+		# saving validates foreign keys to items (see signals.py), which isn't part of dispatching the click
+		static_tables = [model._meta.db_table for model in CATALOG_MODELS + CLICK_PLAN_MODELS if model is not ItemInfo]
+		with CaptureQueriesContext(connection) as context:
+			self.s_module.click(self.other_user)
+		for query in context.captured_queries:
+			for table in static_tables:
+				self.assertNotIn('"%s"' % table, query["sql"])
+
+	def test_plan(self):
+		plan = get_catalog().get_click_plan(self.SETUPABLE_MODULE_ID)
+		self.assertEqual(plan.handlers, ((self.EXECUTION_COST, ClickCondition.ALWAYS),))
+		self.assertEqual(plan.guest_yields, ())
+
+	def test_battle(self):
+		ModuleInfo.objects.filter(item_id=self.SETUPABLE_MODULE_ID).update(click_outcome=ModuleOutcome.BATTLE)
+		owner_yield = ModuleOwnerYield.objects.create(module_item_id=self.SETUPABLE_MODULE_ID, item_id=self.ITEM_ID, qty=1)
+		guest_yield = ModuleGuestYield.objects.create(module_item_id=self.SETUPABLE_MODULE_ID, item_id=self.ITEM_ID, qty=1)
+		plan = get_catalog().get_click_plan(self.SETUPABLE_MODULE_ID)
+		self.assertEqual(plan.handlers, ((self.EXECUTION_COST, ClickCondition.ALWAYS), (owner_yield, ClickCondition.GUEST_LOST)))
+		self.assertEqual(plan.guest_yields, (guest_yield,))
+		self.assertEqual(plan.guest_yield_condition, ClickCondition.GUEST_WON)
+
+	def test_num_clicks(self):
+		ModuleInfo.objects.filter(item_id=self.SETUPABLE_MODULE_ID).update(click_outcome=ModuleOutcome.NUM_CLICKS)
+		ModuleOwnerYield.objects.create(module_item_id=self.SETUPABLE_MODULE_ID, item_id=self.ITEM_ID, qty=1)
+		plan = get_catalog().get_click_plan(self.SETUPABLE_MODULE_ID)
+		self.assertEqual(plan.handlers, ((self.EXECUTION_COST, ClickCondition.ALWAYS),))
+
+	def test_unknown_outcome(self):
+		ModuleOwnerYield.objects.create(module_item_id=self.SETUPABLE_MODULE_ID, item_id=self.ITEM_ID, qty=1)
+		add_inv_item(self.other_user, self.EXECUTION_COST.item_id, self.EXECUTION_COST.qty)
+		with self.assertRaises(RuntimeError):
+			self.s_module.click(self.other_user)
+
+class Guest_Yield_Sampler(TestCase):
+	SETUP = setupable_module_item,
+	DRAWS = 20000
+
+	def _create_yields(self, *probabilities):
+		for i, probability in enumerate(probabilities):
+			item_id = ItemInfo.objects.create(name="Prize %i" % i, type=ItemType.ITEM).id
+			ModuleGuestYield.objects.create(module_item_id=self.SETUPABLE_MODULE_ID, item_id=item_id, qty=1, probability=probability)
+		return get_catalog().get_click_plan(self.SETUPABLE_MODULE_ID)
+
+	def _assert_distribution(self, plan, expected):
+		random.seed(0)
+		with self.assertNumQueries(0):
+			counts = Counter(plan.choose_guest_yield() for _ in range(self.DRAWS))
+		for guest_yield, probability in expected.items():
+			self.assertAlmostEqual(counts[guest_yield] / self.DRAWS, probability / 100, delta=0.01)
+
+	def test_no_yields(self):
+		plan = get_catalog().get_click_plan(self.SETUPABLE_MODULE_ID)
+		self.assertIsNone(plan.choose_guest_yield())
+
+	def test_single(self):
+		plan = self._create_yields(30)
+		self._assert_distribution(plan, {plan.guest_yields[0]: 30, None: 70})
+
+	def test_lottery(self):
+		plan = self._create_yields(50, 30, 15, 5)
+		self._assert_distribution(plan, dict(zip(plan.guest_yields, (50, 30, 15, 5))))
+
+	def test_lottery_over_100(self):
+		plan = self._create_yields(60, 60, 100)
+		self._assert_distribution(plan, dict(zip(plan.guest_yields, (60, 40, 0))))
+
+	def test_lottery_under_100(self):
+		plan = self._create_yields(50, 30)
+		random.seed(0)
+		counts = Counter()
+		for _ in range(self.DRAWS):
+			try:
+				counts[plan.choose_guest_yield()] += 1
+			except RuntimeError:
+				counts["error"] += 1
+		# draws past the total fail, like before click plans, the others still choose a yield
+		for key, probability in zip((*plan.guest_yields, "error"), (50, 30, 20)):
+			self.assertAlmostEqual(counts[key] / self.DRAWS, probability / 100, delta=0.01)
+
 class Setupable(TestCase):
 	SETUP = has_setupable_module,
 
@@ -0,0 +1,25 @@
+import os.path
+import tempfile
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+class TestRunner(DiscoverRunner):
+	"""
+	Runs the tests with the stamp files of the process-wide caches in a temporary directory (see MLN_STATIC_CATALOG_STAMP, MLN_WEBHOOK_INDEX_STAMP and MLN_OAUTH_TOKEN_STAMP).
+	Otherwise tests that change static data, webhooks or access tokens would touch the real stamp files, and a running server would reload its caches.
+	"""
+	def setup_test_environment(self, **kwargs):
+		super().setup_test_environment(**kwargs)
+		self.stamp_directory = tempfile.TemporaryDirectory()
+		self.stamp_settings = override_settings(
+			MLN_STATIC_CATALOG_STAMP=os.path.join(self.stamp_directory.name, "static_catalog.stamp"),
+			MLN_WEBHOOK_INDEX_STAMP=os.path.join(self.stamp_directory.name, "webhook_index.stamp"),
+			MLN_OAUTH_TOKEN_STAMP=os.path.join(self.stamp_directory.name, "oauth_token.stamp"),
+		)
+		self.stamp_settings.enable()
+
+	def teardown_test_environment(self, **kwargs):
+		self.stamp_settings.disable()
+		self.stamp_directory.cleanup()
+		super().teardown_test_environment(**kwargs)
@@ -1,8 +1,10 @@
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
 
 from mln.models.dynamic import FriendshipStatus
 from mln.models.static import MLNError
-from mln.services.friend import block_friend, handle_friend_invite_response, remove_friend, send_friend_invite, unblock_friend
+from mln.services.friend import are_friends, block_friend, choose_friend, get_friendship, handle_friend_invite_response, remove_friend, send_friend_invite, unblock_friend
 from mln.tests.setup_testcase import requires, setup, TestCase
 from mln.tests.models.test_profile import four_users, one_user, three_users, two_users
 
@@ -129,9 +131,25 @@ class Friend(TestCase):
 		with self.assertRaises(RuntimeError):
 			unblock_friend(self.other_user, self.friendship_id)
 
+	def test_are_friends(self):
+		with self.assertNumQueries(1):
+			self.assertTrue(are_friends(self.user, self.other_user.id))
+		with self.assertNumQueries(1):
+			self.assertTrue(are_friends(self.other_user, self.user.id))
+
+	def test_get_friendship(self):
+		with self.assertNumQueries(1):
+			self.assertEqual(get_friendship(self.user, self.other_user).id, self.friendship_id)
+		with self.assertNumQueries(1):
+			self.assertEqual(get_friendship(self.other_user, self.user).id, self.friendship_id)
+
 class BlockedFriend(TestCase):
 	SETUP = blocked_friends,
 
+	def test_are_friends(self):
+		self.assertFalse(are_friends(self.user, self.other_user.id))
+		self.assertFalse(are_friends(self.other_user, self.user.id))
+
 	def test_send_friend_invite_blocked(self):
 		with self.assertRaises(RuntimeError):
 			send_friend_invite(self.user, "other")
@@ -164,6 +182,26 @@ class BlockedFriend(TestCase):
 class ThirdFriend(TestCase):
 	SETUP = friend_of_friend,
 
+	def test_are_friends_unrelated(self):
+		self.assertFalse(are_friends(self.user, self.third_user.id))
+		self.assertIsNone(get_friendship(self.user, self.third_user))
+
+	def test_choose_friend(self):
+		chosen = set()
+		for index in range(2):
+			with patch("mln.services.friend.random.randrange", return_value=index), self.assertNumQueries(3):
+				chosen.add(choose_friend(self.other_user))
+		self.assertEqual(chosen, {self.user, self.third_user})
+
+	def test_choose_friend_networkers(self):
+		self.third_user.profile.is_networker = True
+		self.third_user.profile.save()
+		self.assertEqual(choose_friend(self.other_user, allow_networkers=True), self.third_user)
+		self.assertEqual(choose_friend(self.third_user), self.other_user)
+
+	def test_choose_friend_no_friends(self):
+		self.assertIsNone(choose_friend(self.third_user, allow_networkers=True))
+
 	def test_handle_friend_invite_response_unrelated(self):
 		with self.assertRaises(RuntimeError):
 			handle_friend_invite_response(self.user, self.other_friendship_id, True)
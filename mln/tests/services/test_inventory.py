@@ -1,6 +1,15 @@
-from mln.services.inventory import add_inv_item, remove_inv_item
+import threading
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TransactionTestCase
+
+from mln.models.static import invalidate_catalog, ItemInfo, ItemType
+from mln.services.inventory import add_inv_item, InventoryTransaction, MAX_STACK_QTY, remove_inv_item
 from mln.tests.setup_testcase import TestCase
-from mln.tests.models.test_profile import one_user
+from mln.tests.models.test_profile import one_user, two_users
 from mln.tests.models.test_static import item
 
 class Inventory(TestCase):
@@ -42,3 +51,139 @@ class Inventory(TestCase):
 		add_inv_item(self.user, self.ITEM_ID, add_qty)
 		with self.assertRaises(RuntimeError):
 			remove_inv_item(self.user, self.ITEM_ID, remove_qty)
+
+	def test_add_inv_item_max_qty(self):
+		with self.assertRaises(ValidationError):
+			add_inv_item(self.user, self.ITEM_ID, MAX_STACK_QTY + 1)
+		add_inv_item(self.user, self.ITEM_ID, MAX_STACK_QTY - 1)
+		add_inv_item(self.user, self.ITEM_ID)
+		with self.assertRaises(ValidationError):
+			add_inv_item(self.user, self.ITEM_ID)
+		self.assertEqual(self.user.inventory.get(item_id=self.ITEM_ID).qty, MAX_STACK_QTY)
+
+	def test_add_inv_item_queries(self):
+		add_inv_item(self.user, self.ITEM_ID)
+		with self.assertNumQueries(1):
+			add_inv_item(self.user, self.ITEM_ID)
+
+	def test_remove_inv_item_queries(self):
+		add_inv_item(self.user, self.ITEM_ID, 2)
+		with self.assertNumQueries(1):
+			remove_inv_item(self.user, self.ITEM_ID)
+
+class Transaction(TestCase):
+	SETUP = item, two_users
+
+	def setUp(self):
+		super().setUp()
+		self.other_item_id = ItemInfo.objects.create(name="Other Item", type=ItemType.ITEM).id
+		add_inv_item(self.user, self.ITEM_ID, 10)
+		add_inv_item(self.other_user, self.ITEM_ID, 5)
+
+	def _qty(self, user, item_id):
+		stack = user.inventory.filter(item_id=item_id).first()
+		return stack.qty if stack is not None else 0
+
+	def test_commit(self):
+		inventory = InventoryTransaction()
+		inventory.remove(self.user, self.ITEM_ID, 3)
+		inventory.add(self.other_user, self.ITEM_ID, 3)
+		inventory.remove(self.user, self.ITEM_ID, 7)
+		inventory.add(self.user, self.other_item_id, 2)
+		with patch("mln.services.message.first_obtained_item") as first_obtained_item:
+			with self.captureOnCommitCallbacks(execute=True):
+				inventory.commit()
+				# first obtained hooks only run once the transaction is committed
+				first_obtained_item.assert_not_called()
+			first_obtained_item.assert_called_once_with(self.user, self.other_item_id)
+		self.assertEqual(self._qty(self.user, self.ITEM_ID), 0)
+		self.assertEqual(self._qty(self.other_user, self.ITEM_ID), 8)
+		self.assertEqual(self._qty(self.user, self.other_item_id), 2)
+
+	def test_not_enough_items(self):
+		inventory = InventoryTransaction()
+		inventory.add(self.user, self.ITEM_ID, 5)
+		inventory.remove(self.other_user, self.ITEM_ID, 6)
+		with self.assertRaises(RuntimeError):
+			inventory.commit()
+		self.assertEqual(self._qty(self.user, self.ITEM_ID), 10)
+		self.assertEqual(self._qty(self.other_user, self.ITEM_ID), 5)
+
+	def test_max_qty(self):
+		inventory = InventoryTransaction()
+		inventory.remove(self.other_user, self.ITEM_ID, 5)
+		inventory.add(self.user, self.ITEM_ID, MAX_STACK_QTY)
+		with self.assertRaises(ValidationError):
+			inventory.commit()
+		self.assertEqual(self._qty(self.user, self.ITEM_ID), 10)
+		self.assertEqual(self._qty(self.other_user, self.ITEM_ID), 5)
+
+	def test_no_stack(self):
+		inventory = InventoryTransaction()
+		inventory.remove(self.user, self.other_item_id)
+		with self.assertRaises(RuntimeError):
+			inventory.commit()
+
+	def test_queries(self):
+		add_inv_item(self.user, self.other_item_id, 5)
+		add_inv_item(self.other_user, self.other_item_id, 5)
+		inventory = InventoryTransaction()
+		for user in (self.user, self.other_user):
+			for item_id in (self.ITEM_ID, self.other_item_id):
+				inventory.remove(user, item_id, 2)
+		# savepoint, locking select, update, release
+		with self.assertNumQueries(4):
+			inventory.commit()
+		self.assertEqual(self._qty(self.other_user, self.other_item_id), 3)
+
+class InventoryConcurrency(TransactionTestCase):
+	"""Several threads, each with their own database connection, changing the same stack."""
+	THREADS = 4
+	CHANGES = 25
+
+	def setUp(self):
+		invalidate_catalog()
+		self.item_id = ItemInfo.objects.create(name="Test Item", type=ItemType.ITEM).id
+		self.user = User.objects.create(username="user")
+
+	def tearDown(self):
+		invalidate_catalog()
+
+	def _run_threads(self, target):
+		errors = []
+		def run():
+			try:
+				target()
+			except Exception as e:
+				errors.append(e)
+			finally:
+				connection.close()
+		threads = [threading.Thread(target=run) for _ in range(self.THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+
+	def test_add_and_remove(self):
+		add_inv_item(self.user, self.item_id, 10)
+		def change():
+			for _ in range(self.CHANGES):
+				add_inv_item(self.user, self.item_id, 2)
+				remove_inv_item(self.user, self.item_id)
+		self._run_threads(change)
+		self.assertEqual(self.user.inventory.get(item_id=self.item_id).qty, 10 + self.THREADS * self.CHANGES)
+
+	def test_remove_all(self):
+		add_inv_item(self.user, self.item_id, self.THREADS * self.CHANGES)
+		def remove():
+			for _ in range(self.CHANGES):
+				remove_inv_item(self.user, self.item_id)
+		self._run_threads(remove)
+		self.assertFalse(self.user.inventory.filter(item_id=self.item_id).exists())
+
+	def test_first_obtained_once(self):
+		with patch("mln.services.message.first_obtained_item") as first_obtained_item:
+			self._run_threads(lambda: add_inv_item(self.user, self.item_id))
+		self.assertEqual(self.user.inventory.get(item_id=self.item_id).qty, self.THREADS)
+		first_obtained_item.assert_called_once_with(self.user, self.item_id)
@@ -1,4 +1,9 @@
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mln.models.dynamic.module import Module
+from mln.services.inventory import add_inv_item
 
 from mln.services.page import page_save_layout
 from mln.tests.setup_testcase import TestCase
@@ -78,3 +83,50 @@ class PageSaveLayout_Transaction(TestCase):
 			page_save_layout(self.user, modules)
 		self.assertTrue(self.user.modules.filter(id=self.h_module.id, pos_x=0, pos_y=0).exists())
 		self.assertTrue(self.user.modules.filter(id=self.s_module.id, pos_x=0, pos_y=1).exists())
+
+class PageSaveLayout_Swap(TestCase):
+	SETUP = has_harvestable_module, has_setupable_module
+
+	def test(self):
+		modules = (self.h_module.id, self.HARVESTABLE_MODULE_ID, 0, 1), (self.s_module.id, self.SETUPABLE_MODULE_ID, 0, 0)
+		page_save_layout(self.user, modules)
+		self.assertEqual(self.user.modules.get(pos_x=0, pos_y=1).id, self.h_module.id)
+		self.assertEqual(self.user.modules.get(pos_x=0, pos_y=0).id, self.s_module.id)
+
+class PageSaveLayout_Replace(TestCase):
+	SETUP = has_harvestable_module,
+
+	def test(self):
+		# removing a module and placing another one of the same item only needs the refunded module
+		modules = (None, self.HARVESTABLE_MODULE_ID, 1, 1),
+		page_save_layout(self.user, modules)
+		self.assertEqual(list(self.user.modules.values_list("item_id", "pos_x", "pos_y")), [(self.HARVESTABLE_MODULE_ID, 1, 1)])
+		self.assertFalse(self.user.inventory.filter(item_id=self.HARVESTABLE_MODULE_ID).exists())
+
+	def test_not_a_module(self):
+		add_inv_item(self.user, self.ITEM_ID)
+		with self.assertRaises(ValidationError):
+			page_save_layout(self.user, ((None, self.ITEM_ID, 1, 1),))
+
+	def test_other_users_module(self):
+		with self.assertRaises(Module.DoesNotExist):
+			page_save_layout(self.user, ((self.h_module.id + 1, self.HARVESTABLE_MODULE_ID, 1, 1),))
+
+class PageSaveLayout_Queries(TestCase):
+	SETUP = harvestable_module, one_user
+
+	def _count_queries(self, size):
+		"""Lay out size modules, then save a layout moving all of them but one down a row, removing the other one and creating one."""
+		self.user.modules.all().delete()
+		add_inv_item(self.user, self.HARVESTABLE_MODULE_ID)
+		existing = [self.user.modules.create(item_id=self.HARVESTABLE_MODULE_ID, pos_x=i // 4, pos_y=i % 4) for i in range(size)]
+		modules = [(module.id, module.item_id, module.pos_x, (module.pos_y + 1) % 4) for module in existing[1:]]
+		# where the removed module would have moved to
+		modules.append((None, self.HARVESTABLE_MODULE_ID, 0, 1))
+		with CaptureQueriesContext(connection) as queries:
+			page_save_layout(self.user, modules)
+		self.assertEqual(self.user.modules.count(), size)
+		return len(queries)
+
+	def test(self):
+		self.assertEqual(self._count_queries(2), self._count_queries(11))
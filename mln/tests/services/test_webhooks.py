@@ -0,0 +1,255 @@
+import json
+import os.path
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+from django.utils.timezone import now
+
+from mln.models.dynamic import hash_access_token, Message, OAuthClient, OAuthCode, OAuthToken, Webhook, WebhookDelivery, WebhookType
+from mln.services import webhooks
+from mln.services.message import create_message, send_message
+from mln.services.webhooks import get_subscription_index, run_badge_webhooks, run_message_webhooks
+from mln.tests.models.test_static import body
+from mln.tests.services.test_friend import friends
+from mln.tests.setup_testcase import requires, setup, TestCase
+
+class Integration(ThreadingHTTPServer):
+	"""A stand-in for an integration's webhook endpoint, recording the requests it receives."""
+	def __init__(self, status=200, delay=0):
+		super().__init__(("127.0.0.1", 0), IntegrationHandler)
+		self.status = status
+		self.delay = delay
+		self.requests = []
+		self.headers = []
+		self.connections = set()
+		self.concurrent = self.max_concurrent = 0
+		self.lock = threading.Lock()
+		self.thread = threading.Thread(target=self.serve_forever, kwargs={"poll_interval": 0.01})
+		self.thread.start()
+
+	@property
+	def url(self):
+		return "http://127.0.0.1:%i/webhook" % self.server_address[1]
+
+	def close(self):
+		self.shutdown()
+		self.server_close()
+		self.thread.join()
+
+class IntegrationHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"  # keep-alive
+
+	def do_POST(self):
+		server = self.server
+		with server.lock:
+			server.connections.add(self.client_address)
+			server.concurrent += 1
+			server.max_concurrent = max(server.max_concurrent, server.concurrent)
+		time.sleep(server.delay)
+		body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+		with server.lock:
+			server.requests.append((self.headers["Api-Token"], body))
+			server.headers.append(self.headers)
+			server.concurrent -= 1
+		self.send_response(server.status)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+
+	def log_message(self, *args):
+		pass
+
+@setup
+@requires(body, friends)
+def message_webhook(self):
+	self.integration = Integration()
+	self.addCleanup(self.integration.close)
+	self.oauth_client = OAuthClient.objects.create(client_id="client", client_name="Client", client_secret="secret", image_url="https://example.com/image.png", redirect_url="https://example.com/")
+	self.webhook = Webhook.objects.create(client=self.oauth_client, secret="webhook secret", url=self.integration.url, type=WebhookType.MESSAGES, user=self.other_user)
+
+class Webhooks(TestCase):
+	SETUP = message_webhook,
+
+	def _send_message(self):
+		send_message(create_message(self.user, self.other_user.id, self.BODY.id))
+
+	def _run_workers(self, *args):
+		out = StringIO()
+		call_command("run_webhook_workers", "--once", *args, stdout=out)
+		return out.getvalue()
+
+	def test_queued(self):
+		self._send_message()
+		delivery = WebhookDelivery.objects.get()
+		self.assertEqual(delivery.webhook, self.webhook)
+		self.assertEqual(delivery.body["sender_username"], self.user.username)
+		# nothing is sent while handling the event
+		self.assertEqual(self.integration.requests, [])
+
+	def test_rolled_back(self):
+		with self.assertRaises(RuntimeError), transaction.atomic():
+			self._send_message()
+			raise RuntimeError
+		self.assertFalse(WebhookDelivery.objects.exists())
+
+	def test_deliver(self):
+		self._send_message()
+		out = self._run_workers()
+		self.assertIn("1 webhook requests sent, 0 failed", out)
+		self.assertEqual(len(self.integration.requests), 1)
+		api_token, body = self.integration.requests[0]
+		self.assertEqual(api_token, "webhook secret")
+		self.assertEqual(body["sender_username"], self.user.username)
+		self.assertFalse(WebhookDelivery.objects.exists())
+
+	def test_access_token(self):
+		access_token = OAuthToken.objects.create(access_token_hash=hash_access_token("token"), auth_code=OAuthCode.objects.create(user=self.other_user, auth_code="code", client=self.oauth_client, generated_at=now()), user=self.other_user, client=self.oauth_client)
+		self.webhook.access_token = access_token
+		self.webhook.save()
+		self._send_message()
+		self._run_workers()
+		self.assertEqual(self.integration.headers[0]["Access-Token-Hash"], hash_access_token("token"))
+		self.assertNotIn("Authorization", self.integration.headers[0])
+
+	@override_settings(MLN_WEBHOOK_MAX_ATTEMPTS=2)
+	def test_retry(self):
+		self.integration.status = 503
+		self._send_message()
+		self._run_workers()
+		delivery = WebhookDelivery.objects.get()
+		self.assertEqual(delivery.attempts, 1)
+		self.assertEqual(delivery.last_error, "HTTP 503")
+		self.assertGreater(delivery.next_attempt_at, now())
+		# not due yet
+		self.assertIn("0 webhook requests sent", self._run_workers())
+		WebhookDelivery.objects.update(next_attempt_at=now())
+		self._run_workers()
+		delivery = WebhookDelivery.objects.get()
+		self.assertEqual(delivery.attempts, 2)
+		self.assertIsNone(delivery.next_attempt_at)
+		self.assertEqual(len(self.integration.requests), 2)
+
+	def test_backoff(self):
+		self.integration.status = 503
+		self._send_message()
+		delays = []
+		for _ in range(3):
+			start = now()
+			self._run_workers()
+			delays.append(WebhookDelivery.objects.get().next_attempt_at - start)
+			WebhookDelivery.objects.update(next_attempt_at=now())
+		for delay, retry_delay in zip(delays, (10, 20, 40)):
+			self.assertGreaterEqual(delay, timedelta(seconds=retry_delay))
+			self.assertLessEqual(delay, timedelta(seconds=retry_delay * 1.5 + 1))
+
+	def test_client_error(self):
+		self.integration.status = 404
+		self._send_message()
+		self._run_workers()
+		self.assertIsNone(WebhookDelivery.objects.get().next_attempt_at)
+
+	def test_unreachable(self):
+		self.integration.close()
+		self._send_message()
+		out = self._run_workers()
+		self.assertIn("0 webhook requests sent, 1 failed", out)
+		self.assertIsNotNone(WebhookDelivery.objects.get().next_attempt_at)
+
+	def test_per_endpoint_limit(self):
+		self.integration.delay = 0.1
+		for _ in range(6):
+			self._send_message()
+		out = self._run_workers("--workers", "4", "--per-endpoint", "2")
+		self.assertIn("6 webhook requests sent, 0 failed", out)
+		self.assertEqual(self.integration.max_concurrent, 2)
+
+	def test_keep_alive(self):
+		for _ in range(3):
+			self._send_message()
+		self._run_workers("--per-endpoint", "1")
+		self.assertEqual(len(self.integration.requests), 3)
+		self.assertEqual(len(self.integration.connections), 1)
+
+	def test_batch(self):
+		self.webhook.batch = True
+		self.webhook.save()
+		for _ in range(3):
+			self._send_message()
+		out = self._run_workers()
+		self.assertIn("1 webhook requests sent, 0 failed", out)
+		api_token, body = self.integration.requests[0]
+		self.assertEqual(len(body), 3)
+		self.assertEqual(body[0]["sender_username"], self.user.username)
+		self.assertFalse(WebhookDelivery.objects.exists())
+
+	@override_settings(MLN_WEBHOOK_BATCH_SIZE=2)
+	def test_batch_size(self):
+		self.webhook.batch = True
+		self.webhook.save()
+		for _ in range(3):
+			self._send_message()
+		out = self._run_workers()
+		self.assertIn("2 webhook requests sent, 0 failed", out)
+		self.assertEqual(sorted(len(body) for _, body in self.integration.requests), [1, 2])
+
+	def test_batch_retry(self):
+		self.integration.status = 503
+		self.webhook.batch = True
+		self.webhook.save()
+		for _ in range(3):
+			self._send_message()
+		self._run_workers()
+		self.assertEqual(list(WebhookDelivery.objects.values_list("attempts", "last_error")), [(1, "HTTP 503")] * 3)
+
+class Subscriptions(TestCase):
+	SETUP = message_webhook,
+
+	def _message_to(self, recipient):
+		return Message.objects.create(sender=self.user if recipient == self.other_user else self.other_user, recipient=recipient, body_id=self.BODY.id)
+
+	def test_not_subscribed(self):
+		message = self._message_to(self.user)
+		get_subscription_index()
+		with self.assertNumQueries(0):
+			run_message_webhooks(message)
+			run_badge_webhooks(self.user, "Test Badge")
+
+	def test_subscribed(self):
+		run_message_webhooks(self._message_to(self.other_user))
+		self.assertEqual(WebhookDelivery.objects.get().webhook, self.webhook)
+
+	def test_global(self):
+		badge_webhook = Webhook.objects.create(client=self.oauth_client, secret="secret", url=self.integration.url, type=WebhookType.BADGE)
+		run_badge_webhooks(self.user, "Test Badge")
+		self.assertEqual(WebhookDelivery.objects.get().webhook, badge_webhook)
+
+	def test_reload_on_save(self):
+		old = get_subscription_index()
+		webhook = Webhook.objects.create(client=self.oauth_client, secret="secret", url=self.integration.url, type=WebhookType.MESSAGES, user=self.user)
+		self.assertIsNot(get_subscription_index(), old)
+		self.assertEqual(get_subscription_index().subscribed(WebhookType.MESSAGES, self.user.id), (webhook.id,))
+		webhook.delete()
+		self.assertEqual(get_subscription_index().subscribed(WebhookType.MESSAGES, self.user.id), ())
+
+	def test_stale(self):
+		# the index of another process that hasn't noticed the deletion yet
+		old = get_subscription_index()
+		self.webhook.delete()
+		webhooks._index = old
+		run_message_webhooks(self._message_to(self.other_user))
+		self.assertFalse(WebhookDelivery.objects.exists())
+
+	def test_stamp(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(MLN_WEBHOOK_INDEX_STAMP=os.path.join(directory, "stamp")):
+			old = get_subscription_index()
+			# another process reloading its index
+			webhooks._touch_stamp()
+			webhooks._index = old
+			webhooks._stamp._next_check = 0
+			self.assertIsNot(get_subscription_index(), old)
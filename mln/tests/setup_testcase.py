@@ -1,6 +1,10 @@
 """This module makes it possible to register setup requirements for test cases, and have the setups require other setups as well."""
+from django.core.cache import cache
 from django.test import TestCase
 
+from mln.models.static import invalidate_catalog
+from mln.services.webhooks import invalidate_subscription_index
+
 _TYPE_CLS_SETUP = 0
 _TYPE_SETUP = 1
 _type = {}
@@ -38,6 +42,11 @@ class TestCase(TestCase):
 				setups.append(dep)
 
 	def setUp(self):
+		# static data of previous tests has been rolled back
+		invalidate_catalog()
+		invalidate_subscription_index()
+		# and so have the pages cached from it
+		cache.clear()
 		for dep in self._setups:
 			dep(self)
 
@@ -0,0 +1,71 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from mln.models.dynamic import Attachment, Message
+from mln.models.static import ItemInfo, ItemType, MessageBody
+from mln.tests.models.test_profile import three_users
+from mln.tests.models.test_static import body, item
+from mln.tests.setup_testcase import setup, requires, TestCase
+
+@setup
+@requires(body, item, three_users)
+def duplicate_messages(self):
+	self.other_body_id = MessageBody.objects.create(category_id=self.BODY_CAT_ID, subject="Other Body", text="Test Body").id
+	self.other_item_id = ItemInfo.objects.create(name="Other Item", type=ItemType.ITEM).id
+	self.kept = Message.objects.create(sender=self.other_user, recipient=self.user, body_id=self.BODY.id)
+	self.kept.attachments.create(item_id=self.ITEM_ID, qty=1)
+	duplicate = Message.objects.create(sender=self.other_user, recipient=self.user, body_id=self.BODY.id)
+	duplicate.attachments.create(item_id=self.ITEM_ID, qty=2)
+	duplicate.attachments.create(item_id=self.other_item_id, qty=5)
+	Message.objects.create(sender=self.other_user, recipient=self.user, body_id=self.BODY.id)
+	# not duplicates: different body, different sender
+	Message.objects.create(sender=self.other_user, recipient=self.user, body_id=self.other_body_id)
+	Message.objects.create(sender=self.third_user, recipient=self.user, body_id=self.BODY.id)
+	# duplicates in another user's inbox
+	Message.objects.create(sender=self.user, recipient=self.third_user, body_id=self.BODY.id)
+	Message.objects.create(sender=self.user, recipient=self.third_user, body_id=self.BODY.id)
+
+class ConsolidateMessages(TestCase):
+	SETUP = duplicate_messages,
+
+	def _consolidate(self, *args):
+		out = StringIO()
+		call_command("consolidate_messages", *args, stdout=out)
+		return out.getvalue()
+
+	def test_consolidate(self):
+		out = self._consolidate("--chunk-size", "1")
+		self.assertIn("Consolidated 5 messages into 2 messages.", out)
+		self.assertEqual(Message.objects.filter(recipient=self.user).count(), 3)
+		self.assertEqual(Message.objects.filter(recipient=self.third_user).count(), 1)
+		self.assertTrue(Message.objects.filter(id=self.kept.id).exists())
+		self.assertEqual(dict(self.kept.attachments.values_list("item_id", "qty")), {self.ITEM_ID: 3, self.other_item_id: 5})
+		self.assertEqual(Attachment.objects.count(), 2)
+
+	def test_idempotent(self):
+		self._consolidate()
+		out = self._consolidate()
+		self.assertIn("Consolidated 0 messages into 0 messages.", out)
+
+	def test_dry_run(self):
+		out = self._consolidate("--dry-run")
+		self.assertIn("Would consolidate 5 messages into 2 messages.", out)
+		self.assertEqual(Message.objects.count(), 7)
+
+	def test_resume(self):
+		self._consolidate("--start-user-id", str(self.user.id + 1))
+		self.assertEqual(Message.objects.filter(recipient=self.user).count(), 5)
+		self.assertEqual(Message.objects.filter(recipient=self.third_user).count(), 1)
+
+	def test_networker(self):
+		self.user.profile.is_networker = True
+		self.user.profile.save()
+		self._consolidate()
+		self.assertEqual(Message.objects.filter(recipient=self.user).count(), 5)
+
+	def test_chunk_queries(self):
+		max_user_id = User.objects.order_by("-id").values_list("id", flat=True).first()
+		with self.assertNumQueries(10):
+			self._consolidate("--start-user-id", str(self.user.id), "--chunk-size", str(max_user_id - self.user.id + 1))
@@ -0,0 +1,104 @@
+import os.path
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+
+from mln.models.static import BlueprintRequirement, get_catalog, ItemInfo, MessageBody, MessageTemplate, ModuleInfo, ModuleOutcome, StartingStack
+from mln.models.static.module_handlers import ModuleGuestYield, ModuleMessage
+from mln.tests.setup_testcase import TestCase
+
+EDITORIAL = """<editorial>
+	<messages>
+		<category id="2" name="Category" Category_Background_Color="FFFFFF" Category_Button_Color="" Category_Text_Color="000000">
+			<body id="10" subject="Hello" text="Hello there">
+				<easyReplies><easyReply id="11" /></easyReplies>
+			</body>
+			<body id="11" subject="Thanks" text="Thanks!" />
+			<body id="101" subject="Module message" text="Here's a gift" />
+		</category>
+	</messages>
+	<items>
+		<item id="100" name="Item" type="item" />
+		<item id="102" name="Other Item" type="item" />
+		<item id="101" name="Module" type="module" isExecutable="True" hrefEditor="editors/Generic.swf">
+			<yield itemId="100" maxPerDay="10" perDay="5" voteAmount="1">
+				<guestYield><items itemID="100" qty="1" /><items itemID="102" qty="2" /></guestYield>
+				<friendYield><items itemID="100" qty="%(friend_qty)s" /></friendYield>
+			</yield>
+		</item>
+		<item id="103" name="Blueprint" type="blueprint">
+			<details>
+				<builds><item id="102" /></builds>
+				<requirements><item id="100" qty="%(requirement_qty)s" /></requirements>
+			</details>
+		</item>
+	</items>
+	<questions>
+		<question id="1" text="Question?" mandatory="True"><answer id="1" text="Answer" /></question>
+	</questions>
+	<colors><color id="1"><details color="FF0000" /></color></colors>
+	<skins><skin id="1" name="Skin" /></skins>
+	<startingStacks>%(starting_stacks)s</startingStacks>
+</editorial>"""
+
+def editorial(friend_qty=1, requirement_qty=3, starting_stacks='<stack itemID="100" qty="5" />'):
+	return EDITORIAL % {"friend_qty": friend_qty, "requirement_qty": requirement_qty, "starting_stacks": starting_stacks}
+
+class Import(TestCase):
+	def setUp(self):
+		super().setUp()
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "editorial.xml")
+
+	def tearDown(self):
+		self.directory.cleanup()
+
+	def _import(self, xml, *args):
+		with open(self.path, "w") as file:
+			file.write(xml)
+		out = StringIO()
+		call_command("import_mln_xml", self.path, *args, stdout=out)
+		return out.getvalue()
+
+	def test_import(self):
+		self._import(editorial())
+		self.assertEqual(get_catalog().get_item(101).name, "Module")
+		self.assertEqual(ModuleInfo.objects.get(item_id=101).click_outcome, ModuleOutcome.PROBABILITY)
+		self.assertEqual(ModuleGuestYield.objects.filter(module_item_id=101).count(), 2)
+		self.assertEqual(MessageBody.objects.get(id=10).easy_replies.get().id, 11)
+		message = ModuleMessage.objects.get(module_item_id=101)
+		self.assertEqual(list(message.message.attachments.values_list("item_id", "qty")), [(100, 1)])
+		self.assertEqual(BlueprintRequirement.objects.get(blueprint_item_id=103).qty, 3)
+
+	def test_import_again(self):
+		self._import(editorial())
+		self._import(editorial())
+		self.assertEqual(ModuleMessage.objects.count(), 1)
+		self.assertEqual(MessageTemplate.objects.count(), 1)
+
+	def test_diff_unchanged(self):
+		self._import(editorial())
+		out = self._import(editorial(), "--diff")
+		self.assertEqual(out, "Import successful.\n")
+
+	def test_diff(self):
+		self._import(editorial())
+		MessageBody.objects.filter(id=10).update(notes="Edited in the admin interface")
+		out = self._import(editorial(friend_qty=2, requirement_qty=4, starting_stacks='<stack itemID="102" qty="1" />').replace('name="Other Item"', 'name="Renamed Item"'), "--diff", "--batch-size", "1")
+		self.assertIn("ItemInfo: 0 created, 1 updated, 0 deleted", out)
+		self.assertIn("StartingStack: 1 created, 0 updated, 1 deleted", out)
+		self.assertEqual(ItemInfo.objects.get(id=102).name, "Renamed Item")
+		self.assertEqual(BlueprintRequirement.objects.get(blueprint_item_id=103).qty, 4)
+		self.assertEqual(list(StartingStack.objects.values_list("item_id", "qty")), [(102, 1)])
+		self.assertEqual(MessageBody.objects.get(id=10).notes, "Edited in the admin interface")
+		message = ModuleMessage.objects.get(module_item_id=101)
+		self.assertEqual(list(message.message.attachments.values_list("item_id", "qty")), [(100, 2)])
+		self.assertEqual(MessageTemplate.objects.count(), 1)
+		self.assertEqual(get_catalog().get_item(102).name, "Renamed Item")
+
+	def test_diff_removed(self):
+		self._import(editorial())
+		self._import(editorial().replace('<items itemID="102" qty="2" />', ""), "--diff")
+		self.assertEqual(list(ModuleGuestYield.objects.values_list("item_id", flat=True)), [100])
+
@@ -0,0 +1,14 @@
+from django.template import engines
+
+from mln.template_loaders import strip_whitespace
+from mln.tests.setup_testcase import TestCase
+
+class StripWhitespace(TestCase):
+	def test_strip(self):
+		source = '{% load mln_utils %}\n<items>\n\t{% for item in items %}\n\t\t<item id="{{ item }}" />\n\t{% endfor %}\n</items>\n'
+		expected = '{% load mln_utils %}<items>{% for item in items %}<item id="{{ item }}"/>{% endfor %}</items>'
+		self.assertEqual(strip_whitespace(source), expected)
+
+	def test_default_engine_unaffected(self):
+		source = "<p>\n\t{{ text }}\n</p>"
+		self.assertEqual(engines["django"].from_string(source).render({"text": "a"}), "<p>\n\ta\n</p>")
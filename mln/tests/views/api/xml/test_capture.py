@@ -0,0 +1,84 @@
+import logging
+import os.path
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings, TransactionTestCase
+from django.urls import reverse
+
+from mln.tests.models.test_profile import one_user
+from mln.tests.setup_testcase import TestCase
+from mln.views.api.xml import metrics
+from mln.views.api.xml.capture import close, read_capture
+from mln.views.api.xml.webservice import _encrypt, log
+
+log.setLevel(logging.CRITICAL) # disable error messages for expected exceptions
+
+def _post(client, request):
+	return client.post(reverse("webservice"), {"input": _encrypt(request.encode()).decode()})
+
+class Capture(TestCase):
+	SETUP = one_user,
+
+	def setUp(self):
+		super().setUp()
+		self.directory = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.directory.name, "capture.log")
+		self.client.force_login(self.user)
+
+	def tearDown(self):
+		close()
+		self.directory.cleanup()
+
+	def test_disabled(self):
+		_post(self.client, '<request type="MessageList" />')
+		self.assertFalse(os.path.exists(self.path))
+
+	def test_capture(self):
+		with override_settings(MLN_WEBSERVICE_CAPTURE_FILE=self.path):
+			_post(self.client, '<request type="MessageList" />')
+		calls = list(read_capture(self.path))
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(calls[0]["user_id"], self.user.id)
+		self.assertEqual(calls[0]["request"], '<request type="MessageList" />')
+		self.assertGreater(calls[0]["duration_ms"], 0)
+
+	def test_rotate(self):
+		with override_settings(MLN_WEBSERVICE_CAPTURE_FILE=self.path, MLN_WEBSERVICE_CAPTURE_MAX_BYTES=200, MLN_WEBSERVICE_CAPTURE_BACKUP_COUNT=2):
+			for _ in range(3):
+				_post(self.client, '<request type="MessageList" />')
+		self.assertTrue(os.path.exists(self.path+".1"))
+
+class Replay(TransactionTestCase):
+	def test_replay(self):
+		user = User.objects.create(username="user")
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "capture.log")
+			with override_settings(MLN_WEBSERVICE_CAPTURE_FILE=path):
+				self.client.force_login(user)
+				_post(self.client, '<request type="MessageList" />')
+				_post(self.client, '<request type="UserGetMyAvatar" />')
+				_post(self.client, '<request type="UserSaveMyAvatar"><result><userProfile avatar="png" /></result></request>')
+				_post(self.client, '<request type="UnhandledRequestType" />')
+			close()
+			user.profile.refresh_from_db()
+			avatar = user.profile.avatar
+			user.profile.avatar = "0#1,6,1,16,5,1,6,13,2,9,2,2,1,1"
+			user.profile.save()
+			metrics.reset()
+			out = StringIO()
+			call_command("replay_webservice", path, "--concurrency", "2", stdout=out)
+			# replayed calls aren't recorded in the metrics
+			self.assertEqual(metrics.get_snapshot()["request_types"], {})
+		out = out.getvalue()
+		self.assertIn("4 calls", out)
+		lines = {line.split()[0]: line.split() for line in out.splitlines()[2:]}
+		self.assertEqual(lines["MessageList"][2], "0.0%")
+		self.assertEqual(lines["UnhandledRequestType"][2], "100.0%")
+		self.assertEqual(lines["UserSaveMyAvatar"][2], "0.0%")
+		# the replay must not modify the original database
+		self.assertEqual(avatar, "png")
+		user.profile.refresh_from_db()
+		self.assertEqual(user.profile.avatar, "0#1,6,1,16,5,1,6,13,2,9,2,2,1,1")
@@ -1,9 +1,17 @@
+import re
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from mln.models.static import MLNError
 from mln.tests.models.test_profile import user_has_item
 from mln.tests.models.test_dynamic import attachment, body, message
 from mln.tests.services.test_message import easy_reply_body
 from mln.tests.setup_testcase import requires, setup, TestCase
 from mln.tests.services.test_friend import friends
 from mln.tests.views.api.xml.handler_testcase import req_resp
+from mln.views.api.xml.webservice import _webservice_unencrypted
 
 @setup
 @requires(attachment)
@@ -17,6 +25,47 @@ class Message(TestCase, metaclass=req_resp):
 	TESTS = "message_get", "message_list"
 	VOID_TESTS = "message_delete",
 
+class MessageList(TestCase):
+	SETUP = message_extra_data, easy_reply_body
+
+	def _send(self, with_attachment):
+		message = self.user.messages.create(sender=self.other_user, body_id=self.REPLY_BODY.id)
+		if with_attachment:
+			message.attachments.create(item_id=self.ITEM_ID, qty=1)
+		return message
+
+	def _list(self, request='<request type="MessageList" />'):
+		response = _webservice_unencrypted(self.user, request)
+		return [int(id) for id in re.findall(r'messageID="(\d+)"', response)]
+
+	def _count_queries(self):
+		with CaptureQueriesContext(connection) as queries:
+			self._list()
+		return len(queries)
+
+	def test_queries(self):
+		counts = [self._count_queries()]
+		for i in range(3):
+			self._send(with_attachment=i % 2 == 0)
+			counts.append(self._count_queries())
+		self.assertEqual(counts, [counts[0]] * 4)
+
+	def test_queries_template(self):
+		with override_settings(MLN_XML_WRITERS=()):
+			self.test_queries()
+
+	def test_paging(self):
+		ids = [self._send(with_attachment=False).id for _ in range(3)]
+		self.assertEqual(self._list(), ids[::-1] + [self.message.id])
+		self.assertEqual(self._list('<request type="MessageList" count="2" />'), ids[:0:-1])
+		self.assertEqual(self._list('<request type="MessageList" count="2" beforeMessageID="%i" />' % ids[1]), [ids[0], self.message.id])
+		self.assertEqual(self._list('<request type="MessageList" beforeMessageID="%i" />' % self.message.id), [])
+
+	def test_invalid_paging(self):
+		for attributes in ('count="-1"', 'count="two"', 'beforeMessageID="-1"'):
+			response = _webservice_unencrypted(self.user, '<request type="MessageList" %s />' % attributes)
+			self.assertIn('status="error" userMessages="%i"' % MLNError.OPERATION_FAILED, response)
+
 class MessageSend(TestCase, metaclass=req_resp):
 	SETUP = body, friends
 	DIR = "message"
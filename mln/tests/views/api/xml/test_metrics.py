@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+
+from mln.tests.models.test_profile import one_user
+from mln.tests.setup_testcase import setup, TestCase
+from mln.views.api.xml import metrics
+from mln.views.api.xml.webservice import _encrypt, _webservice_unencrypted, log
+
+log.setLevel(logging.CRITICAL) # disable error messages for expected exceptions
+
+@setup
+def reset_metrics(self):
+	metrics.reset()
+
+class Metrics(TestCase):
+	SETUP = reset_metrics, one_user
+
+	def test_webservice(self):
+		self.client.force_login(self.user)
+		self.client.post(reverse("webservice"), {"input": _encrypt(b'<request type="MessageList" />').decode()})
+		stats = metrics.get_snapshot()["request_types"]["MessageList"]
+		self.assertEqual(stats["requests"], 1)
+		self.assertEqual(stats["errors"], 0)
+		self.assertGreater(stats["queries"], 0)
+		for name in metrics.STAGES:
+			self.assertEqual(stats["stages"][name]["count"], 1)
+
+	def test_unencrypted(self):
+		_webservice_unencrypted(self.user, '<request type="UnhandledRequestType" />')
+		_webservice_unencrypted(self.user, '<request type="MessageList" />')
+		snapshot = metrics.get_snapshot()["request_types"]
+		self.assertEqual(snapshot["UnhandledRequestType"]["errors"], 1)
+		self.assertEqual(snapshot["MessageList"]["stages"]["handler"]["count"], 1)
+		self.assertEqual(snapshot["MessageList"]["stages"]["decrypt"]["count"], 0)
+
+	@override_settings(MLN_WEBSERVICE_METRICS=False)
+	def test_disabled(self):
+		_webservice_unencrypted(self.user, '<request type="MessageList" />')
+		self.assertEqual(metrics.get_snapshot()["request_types"], {})
+
+	def test_percentile(self):
+		histogram = {"count": 4, "total_ms": 0, "buckets": [0] * (len(metrics.BUCKETS) + 1)}
+		histogram["buckets"][0] = 2
+		histogram["buckets"][3] = 1
+		histogram["buckets"][-1] = 1
+		self.assertEqual(metrics.percentile(histogram, 50), metrics.BUCKETS[0])
+		self.assertEqual(metrics.percentile(histogram, 75), metrics.BUCKETS[3])
+		self.assertEqual(metrics.percentile(histogram, 99), float("inf"))
+
+	def test_merge(self):
+		_webservice_unencrypted(self.user, '<request type="MessageList" />')
+		snapshot = metrics.get_snapshot()
+		merged = metrics.merge(snapshot, snapshot)["request_types"]["MessageList"]
+		self.assertEqual(merged["requests"], 2)
+		self.assertEqual(sum(merged["stages"]["handler"]["buckets"]), 2)
+
+	def test_endpoint(self):
+		_webservice_unencrypted(self.user, '<request type="MessageList" />')
+		self.client.force_login(self.user)
+		self.assertEqual(self.client.get(reverse("webservice_stats")).status_code, 302) # redirect to admin login
+		self.user.is_staff = True
+		self.user.save()
+		response = self.client.get(reverse("webservice_stats"))
+		self.assertEqual(response.json()["request_types"]["MessageList"]["requests"], 1)
+
+	def test_command(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(MLN_WEBSERVICE_METRICS_DIR=directory):
+			_webservice_unencrypted(self.user, '<request type="MessageList" />')
+			metrics.flush()
+			out = StringIO()
+			call_command("webservice_stats", "--json", stdout=out)
+			self.assertEqual(json.loads(out.getvalue())["request_types"]["MessageList"]["requests"], 1)
+			out = StringIO()
+			call_command("webservice_stats", "--reset", stdout=out)
+			self.assertIn("MessageList", out.getvalue())
+			self.assertEqual(metrics.read_snapshots()["request_types"], {})
+
+	def test_stale_snapshots(self):
+		with tempfile.TemporaryDirectory() as directory, override_settings(MLN_WEBSERVICE_METRICS_DIR=directory):
+			_webservice_unencrypted(self.user, '<request type="MessageList" />')
+			snapshot = json.dumps(metrics.get_snapshot())
+			# a process that has exited
+			exited = subprocess.Popen([sys.executable, "-c", ""])
+			exited.wait()
+			# a process that's still running, but hasn't written its snapshot for a long time
+			old_path = os.path.join(directory, "%i.json" % os.getppid())
+			for path in (os.path.join(directory, "%i.json" % exited.pid), old_path):
+				with open(path, "w") as file:
+					file.write(snapshot)
+			old_time = time.time() - metrics.STALE_SNAPSHOT_AGE - 1
+			os.utime(old_path, (old_time, old_time))
+			self.assertEqual(metrics.read_snapshots()["request_types"]["MessageList"]["requests"], 1)
+			self.assertEqual(os.listdir(directory), [])
@@ -15,6 +15,7 @@ from mln.tests.services.test_misc import module
 from mln.tests.setup_testcase import cls_setup, requires, setup, TestCase
 from mln.tests.views.api.xml.test_module import background_item
 from mln.templatetags.mln_utils import SAVE_TEMPLATES, SETUP_TEMPLATES
+from mln.views.api.xml.writers import SAVE_WRITERS, SETUP_WRITERS
 
 def _test_settings(self, cls):
 	if cls in SAVE_TEMPLATES:
@@ -24,13 +25,16 @@ def _test_settings(self, cls):
 	path = os.path.normpath(os.path.join(__file__, "..", "res", "module", "settings", name+".xml"))
 	settings = et.parse(path)
 	module_settings._deserialize_cls(cls, self.module, settings, settings)
-	resp = loader.get_template("mln/api/xml/module/settings/%s.xml" % name).render({"module": self.module})
+	resp = loader.get_template("mln/api/xml/module/settings/%s.xml" % name, using="mln_xml").render({"module": self.module})
 	resp = "<settings>"+resp+"</settings>"
 
 	with open(path) as file:
 		expected = file.read()
 	self.assertEqual(resp, expected)
 
+	writer = SAVE_WRITERS[cls] if cls in SAVE_WRITERS else SETUP_WRITERS[cls]
+	self.assertEqual("<settings>"+"".join(writer(self.module))+"</settings>", expected)
+
 #"concert_arcade", "generic", "hop_arcade", "soundtrack", "sticker", "ugc", "friend_share", "group_performance", "trade", "trio_performance"
 
 def settings_meta(name, bases, attrs):
@@ -1,13 +1,22 @@
-from mln.models.static import ItemInfo, ItemType
-from mln.models.dynamic import AboutMe
-from mln.services.inventory import add_inv_item
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from mln.models.static import get_catalog, ItemInfo, ItemType, ModuleEditorType, ModuleInfo
+from mln.models.static.catalog import TROPHY_IDS
+from mln.models.dynamic import AboutMe, FriendshipStatus, User
+from mln.models.dynamic.module_settings import ModuleSaveSticker, ModuleSetupFriendShare
+from mln.services.inventory import add_inv_item, remove_inv_item
 from mln.tests.models.test_dynamic import statements
 from mln.tests.models.test_profile import has_skin, one_user, networker
-from mln.tests.models.test_module import has_harvestable_module, has_harvestable_module_stack
+from mln.tests.models.test_module import has_harvestable_module, has_harvestable_module_stack, setup_trade_module
 from mln.tests.models.test_static import color
-from mln.tests.services.test_friend import friends, pending_friends, pending_friends_other_way, two_friends
+from mln.tests.services.test_friend import friends, pending_friends, pending_friends_other_way, three_friends, two_friends
 from mln.tests.setup_testcase import cls_setup, requires, setup, TestCase
 from mln.tests.views.api.xml.handler_testcase import req_resp
+from mln.tests.views.api.xml.test_module_settings import sticker_item
+from mln.templatetags.mln_utils import get_trophies
+from mln.views.api.xml.webservice import _webservice_unencrypted
 
 @cls_setup
 def badge(self):
@@ -62,6 +71,209 @@ class PageGetNewExtraData(TestCase, metaclass=req_resp):
 	DIR = "page/page_get_new/extra_data"
 	TESTS = "public_view", "private_view"
 
+class PageGetNewWriter(TestCase):
+	"""Check that the writer produces the same page as the template for a page with modules and settings, from all points of view."""
+	SETUP = user_extra_data, friends, has_harvestable_module, setup_trade_module
+
+	def _test_writer(self, viewing_user, request):
+		expected = _webservice_unencrypted(viewing_user, request)
+		with override_settings(MLN_XML_WRITERS=()):
+			self.assertEqual(_webservice_unencrypted(viewing_user, request), expected)
+
+	def test_private_view(self):
+		self._test_writer(self.user, '<request type="PageGetNew" />')
+
+	def test_public_view_own(self):
+		self._test_writer(self.user, '<request type="PageGetNew" pageOwner="user" />')
+
+	def test_public_view_other(self):
+		self._test_writer(self.other_user, '<request type="PageGetNew" pageOwner="user" />')
+
+@cls_setup
+@requires(sticker_item)
+def settings_modules(cls):
+	cls.FRIEND_SHARE_MODULE_ID = ItemInfo.objects.create(name="Friend Share Module", type=ItemType.MODULE).id
+	ModuleInfo.objects.create(item_id=cls.FRIEND_SHARE_MODULE_ID, is_executable=True, editor_type=ModuleEditorType.FRIEND_SHARE)
+	cls.STICKER_MODULE_ID = ItemInfo.objects.create(name="Sticker Module", type=ItemType.MODULE).id
+	ModuleInfo.objects.create(item_id=cls.STICKER_MODULE_ID, is_executable=False, editor_type=ModuleEditorType.STICKER)
+
+class PageGetNewQueries(TestCase):
+	"""Check that the number of queries for a page doesn't depend on the number of friends, modules and inventory stacks."""
+	SETUP = user_extra_data, friends, has_harvestable_module, setup_trade_module, settings_modules
+
+	def _grow(self, i):
+		"""Add a friend, a friend share module set up with them, a sticker module with a sticker, and inventory stacks."""
+		friend = User.objects.create(username="friend_%i" % i)
+		friend.outgoing_friendships.create(to_user=self.user, status=FriendshipStatus.FRIEND)
+		add_inv_item(self.user, self.STICKER_ID)
+		add_inv_item(self.other_user, ItemInfo.objects.create(name="Item %i" % i, type=ItemType.ITEM).id)
+		friend_share = self.user.modules.create(item_id=self.FRIEND_SHARE_MODULE_ID, pos_x=i+1, pos_y=0)
+		ModuleSetupFriendShare.objects.create(module=friend_share, friend=friend)
+		sticker = self.user.modules.create(item_id=self.STICKER_MODULE_ID, pos_x=i+1, pos_y=1)
+		ModuleSaveSticker.objects.create(module=sticker, item_id=self.STICKER_ID, x=0, y=0, scale_x=100, scale_y=100, rotation=0, depth=i)
+
+	def _count_queries(self, viewing_user, request):
+		with CaptureQueriesContext(connection) as queries:
+			_webservice_unencrypted(viewing_user, request)
+		return len(queries)
+
+	def _test_queries(self, viewing_user, request):
+		counts = []
+		for i in range(2):
+			counts.append(self._count_queries(viewing_user, request))
+			self._grow(i)
+		counts.append(self._count_queries(viewing_user, request))
+		self.assertEqual(counts, [counts[0]] * 3)
+
+	def test_private_view(self):
+		self._test_queries(self.user, '<request type="PageGetNew" />')
+
+	def test_public_view_own(self):
+		self._test_queries(self.user, '<request type="PageGetNew" pageOwner="user" />')
+
+	def test_public_view_other(self):
+		self._test_queries(self.other_user, '<request type="PageGetNew" pageOwner="user" />')
+
+	def test_template(self):
+		with override_settings(MLN_XML_WRITERS=()):
+			self._test_queries(self.other_user, '<request type="PageGetNew" pageOwner="user" />')
+
+@cls_setup
+def trophies(cls):
+	for item_id in TROPHY_IDS:
+		ItemInfo.objects.create(id=item_id, name="Trophy %i" % item_id, type=ItemType.ITEM)
+
+@setup
+@requires(trophies, has_harvestable_module)
+def has_trophies(self):
+	# added in reverse display order
+	add_inv_item(self.user, TROPHY_IDS[3])
+	add_inv_item(self.user, TROPHY_IDS[1])
+
+class PageTrophies(TestCase):
+	SETUP = has_trophies, friends
+
+	def test_get_trophies(self):
+		get_catalog()
+		with self.assertNumQueries(1):
+			self.assertEqual([trophy.id for trophy in get_trophies(self.user)], [TROPHY_IDS[1], TROPHY_IDS[3]])
+
+	def test_public_view(self):
+		response = _webservice_unencrypted(self.other_user, '<request type="PageGetNew" pageOwner="user" />')
+		self.assertIn('<trophyItems><item itemID="%i"></item><item itemID="%i"></item></trophyItems>' % (TROPHY_IDS[1], TROPHY_IDS[3]), response)
+		with override_settings(MLN_XML_WRITERS=()):
+			self.assertEqual(_webservice_unencrypted(self.other_user, '<request type="PageGetNew" pageOwner="user" />'), response)
+
+@override_settings(MLN_PUBLIC_PAGE_CACHE_TIMEOUT=3600)
+class PublicPageCache(TestCase):
+	SETUP = user_extra_data, three_friends, has_harvestable_module, setup_trade_module, badge
+	REQUEST = '<request type="PageGetNew" pageOwner="user" />'
+
+	def _view(self, viewing_user=None):
+		return _webservice_unencrypted(viewing_user or self.other_user, self.REQUEST)
+
+	def _count_queries(self):
+		with CaptureQueriesContext(connection) as queries:
+			self._view()
+		return len(queries)
+
+	def _assert_fresh(self):
+		with override_settings(MLN_PUBLIC_PAGE_CACHE_TIMEOUT=0):
+			expected = self._view()
+		self.assertEqual(self._view(), expected)
+
+	def test_cached(self):
+		uncached = self._count_queries()
+		self.assertLess(self._count_queries(), uncached)
+		self._assert_fresh()
+
+	def test_template(self):
+		response = self._view()
+		with override_settings(MLN_XML_WRITERS=()):
+			self.assertEqual(self._view(), response)
+		# cached by the template, written by the writer
+		self.user.profile.rank = 1
+		self.user.profile.save()
+		with override_settings(MLN_XML_WRITERS=()):
+			response = self._view()
+		self.assertEqual(self._view(), response)
+
+	def test_viewer_not_cached(self):
+		self._view()
+		add_inv_item(self.other_user, self.BADGE_ID)
+		self.assertIn('<inventory><items><item id="%i" qty="1" type="badge"/>' % self.BADGE_ID, self._view())
+		self.assertIn('<friend friendUserName="user" status="Friend"/>', self._view())
+		self.assertNotIn('<friend friendUserName="user" status="Friend"/>', self._view(User.objects.create(username="stranger")))
+
+	def test_own_view_not_cached(self):
+		self._view()
+		self.assertIn("relationID", _webservice_unencrypted(self.user, '<request type="PageGetNew" />'))
+		self.assertIn('isSetup="True"', _webservice_unencrypted(self.user, self.REQUEST))
+
+	def test_save_layout(self):
+		self._view()
+		_webservice_unencrypted(self.user, '<request type="PageSaveLayout"><result><item itemID="%i" instanceID="%i"><details posx="2" posy="3"/></item></result></request>' % (self.HARVESTABLE_MODULE_ID, self.h_module.id))
+		self.assertIn('<details posx="2" posy="3"/>', self._view())
+		self._assert_fresh()
+
+	def test_module_teardown(self):
+		self._view()
+		self.t_module.teardown()
+		self._assert_fresh()
+
+	def test_clicks_keep_cache(self):
+		self._view()
+		self.h_module.add_to_harvest(1)
+		self.other_user.profile.update_available_votes()
+		self.assertEqual(self._count_queries(), self._count_queries())
+		cached = self._count_queries()
+		self.user.profile.save()
+		self.assertGreater(self._count_queries(), cached)
+
+	def test_profile(self):
+		self._view()
+		self.user.profile.avatar = "png"
+		self.user.profile.save()
+		self.assertIn('avatar="url#[npfp]user.png"', self._view())
+
+	def test_friend_profile(self):
+		self._view()
+		self.third_user.profile.rank = 3
+		self.third_user.profile.save()
+		self.assertIn('<friend friendUserName="third" avatar="0#1,6,1,16,5,1,6,13,2,9,2,2,1,1" rank="3"', self._view())
+
+	def test_own_profile_keeps_friends_cache(self):
+		def count_friend_page_queries():
+			with CaptureQueriesContext(connection) as queries:
+				_webservice_unencrypted(self.other_user, '<request type="PageGetNew" pageOwner="third" />')
+			return len(queries)
+		count_friend_page_queries()
+		cached = count_friend_page_queries()
+		# not shown in friend lists
+		self.user.profile.page_column_color_id = 2
+		self.user.profile.save()
+		self.assertEqual(count_friend_page_queries(), cached)
+		self.user.profile.rank = 2
+		self.user.profile.save()
+		self.assertGreater(count_friend_page_queries(), cached)
+
+	def test_statements(self):
+		self._view()
+		self.user.about_me.delete()
+		self.assertIn("<statements></statements>", self._view())
+
+	def test_friendship(self):
+		self._view()
+		self.user.outgoing_friendships.get(to_user=self.fourth_user).delete()
+		self.assertNotIn('friendUserName="fourth"', self._view())
+
+	def test_badge(self):
+		self._view()
+		remove_inv_item(self.user, self.BADGE_ID)
+		self.assertIn("<badges></badges>", self._view())
+		add_inv_item(self.user, self.BADGE_ID)
+		self.assertIn('<badges><badge id="%i"/></badges>' % self.BADGE_ID, self._view())
+
 class PageSaveLayout(TestCase, metaclass=req_resp):
 	SETUP = has_harvestable_module, has_harvestable_module_stack,
 	DIR = "page"
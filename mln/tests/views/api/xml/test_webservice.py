@@ -1,12 +1,16 @@
 import logging
 
+from django.test import override_settings
 from django.urls import reverse
 
 from mln.models.static import MLNError
 from mln.tests.models.test_profile import one_user
 from mln.tests.setup_testcase import TestCase
 from mln.tests.views.api.xml.handler_testcase import req_resp
-from mln.views.api.xml.webservice import _webservice_unencrypted, log, handlers
+from mln.templatetags.mln_utils import render_to_string_stripped
+from mln.views.api.xml.cipher import xor_loop, xor_tiled
+from mln.views.api.xml.webservice import _webservice_unencrypted, log, handlers, ENCRYPTION_KEY, ROCKET_MODULE_ENCRYPTION_KEY
+from mln.views.api.xml.writers import write_response
 
 log.setLevel(logging.CRITICAL) # disable error messages for expected exceptions
 
@@ -31,3 +35,24 @@ class WebserviceEncryption(TestCase):
 		self.client.force_login(self.user)
 		response = self.client.post(reverse("webservice"), {"input": data}).content
 		self.assertEqual(response, expected)
+
+	@override_settings(MLN_XOR_CODEC="loop")
+	def test_loop_codec(self):
+		self.test()
+
+class XorCodecs(TestCase):
+	def test_tiled_matches_loop(self):
+		data = bytes(range(256)) * 5
+		for key in (ENCRYPTION_KEY, ROCKET_MODULE_ENCRYPTION_KEY):
+			for length in (0, 1, len(key) - 1, len(key), len(key) + 1, len(data)):
+				self.assertEqual(xor_tiled(data[:length], key), xor_loop(data[:length], key))
+
+	def test_tiled_roundtrip(self):
+		data = b"<request type=\"MessageList\" />"
+		self.assertEqual(xor_tiled(xor_tiled(data, ENCRYPTION_KEY), ENCRYPTION_KEY), data)
+
+class Writers(TestCase):
+	def test_thousand_separator(self):
+		context = {"request_type": "InventoryModuleGet", "error_msg": None, "module_stacks": [(1234, 5678), (1, 2)]}
+		with override_settings(USE_THOUSAND_SEPARATOR=True):
+			self.assertEqual(write_response(context), render_to_string_stripped("mln/api/xml/misc/inventory_module_get.xml", context))
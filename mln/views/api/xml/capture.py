@@ -0,0 +1,58 @@
+"""
+Capture of webservice traffic, for replaying it offline with "manage.py replay_webservice".
+Capturing is off by default. Set the MLN_WEBSERVICE_CAPTURE_FILE setting to a file path to turn it on.
+Every call is written as one JSON line with the time the call started, the id of the user (None for anonymous users), the duration of the call in milliseconds and the decrypted request XML.
+The file is rotated once it reaches MLN_WEBSERVICE_CAPTURE_MAX_BYTES (default 10 MB), keeping MLN_WEBSERVICE_CAPTURE_BACKUP_COUNT (default 5) old files.
+"""
+import json
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+
+_lock = threading.Lock()
+_logger = logging.getLogger(__name__)
+_logger.propagate = False
+_logger.setLevel(logging.INFO)
+_handler_path = None
+
+def is_enabled():
+	return getattr(settings, "MLN_WEBSERVICE_CAPTURE_FILE", None) is not None
+
+def _get_logger():
+	"""Get the capture logger, (re)configuring its file handler if the capture file changed."""
+	global _handler_path
+	path = settings.MLN_WEBSERVICE_CAPTURE_FILE
+	if path != _handler_path:
+		close()
+		with _lock:
+			if _handler_path is None:
+				max_bytes = getattr(settings, "MLN_WEBSERVICE_CAPTURE_MAX_BYTES", 10 * 1024 * 1024)
+				backup_count = getattr(settings, "MLN_WEBSERVICE_CAPTURE_BACKUP_COUNT", 5)
+				handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+				handler.setFormatter(logging.Formatter("%(message)s"))
+				_logger.addHandler(handler)
+				_handler_path = path
+	return _logger
+
+def close():
+	"""Close the capture file. It will be reopened on the next capture."""
+	global _handler_path
+	with _lock:
+		for handler in _logger.handlers[:]:
+			_logger.removeHandler(handler)
+			handler.close()
+		_handler_path = None
+
+def capture(user, request, start_time, duration):
+	"""Write a webservice call to the capture file. start_time is a time.time() timestamp, duration is in seconds."""
+	user_id = user.id if user.is_authenticated else None
+	_get_logger().info(json.dumps({"time": start_time, "user_id": user_id, "duration_ms": duration * 1000, "request": request}))
+
+def read_capture(path):
+	"""Read the calls of a capture file, as dicts with the keys written by capture()."""
+	with open(path, encoding="utf-8") as file:
+		for line in file:
+			if line.strip():
+				yield json.loads(line)
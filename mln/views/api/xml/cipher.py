@@ -0,0 +1,40 @@
+"""
+XOR codecs for the webservice encryption.
+The flash client XORs the request with a repeating key, so both directions of every webservice call go through one of these functions.
+All codecs take (data, key) and return a bytearray with the same length as data.
+The active codec is selected by name with the MLN_XOR_CODEC setting, and defaults to the tiled codec.
+"""
+from django.conf import settings
+
+def xor_loop(data, key):
+	"""Reference implementation, XORing one byte at a time."""
+	res = bytearray(len(data))
+	for i in range(len(data)):
+		res[i] = data[i] ^ key[i % len(key)]
+	return res
+
+def _tile_key(key, length):
+	"""Repeat the key until it is exactly as long as the data."""
+	reps, rest = divmod(length, len(key))
+	return key * reps + key[:rest]
+
+def xor_tiled(data, key):
+	"""
+	XOR the whole buffer at once.
+	The key is tiled to the length of the data, and both are converted to arbitrary precision integers, so the XOR itself runs in C over machine words instead of in a Python loop over bytes.
+	"""
+	length = len(data)
+	if length == 0:
+		return bytearray()
+	data_int = int.from_bytes(data, "little")
+	key_int = int.from_bytes(_tile_key(key, length), "little")
+	return bytearray((data_int ^ key_int).to_bytes(length, "little"))
+
+"""Codec registry. Register a function taking (data, key) under the name used in the MLN_XOR_CODEC setting."""
+codecs = {
+	"loop": xor_loop,
+	"tiled": xor_tiled,
+}
+
+def get_codec():
+	return codecs[getattr(settings, "MLN_XOR_CODEC", "tiled")]
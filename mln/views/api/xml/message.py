@@ -1,5 +1,6 @@
 """Mail functionality handlers."""
-from ....services.message import create_attachment, create_message, delete_message, detach_attachments, easy_reply, open_message, send_message
+from ....models.static import MLNError
+from ....services.message import create_attachment, create_message, delete_message, detach_attachments, easy_reply, get_inbox, open_message, send_message
 
 def handle_message_delete(user, request):
 	message_id = int(request.get("messageID"))
@@ -26,9 +27,23 @@ def handle_message_get(user, request):
 	message = open_message(user, message_id)
 	return {"message": message}
 
+def _non_negative_int(request, name):
+	"""Return the non-negative integer attribute, or None if it's missing. Raise MLNError if it's not a non-negative integer."""
+	value = request.get(name)
+	if value is None:
+		return None
+	if not value.isdigit():
+		raise MLNError(MLNError.OPERATION_FAILED)
+	return int(value)
+
 def handle_message_list(user, request):
-	"""List all messages in the user's inbox."""
-	messages = user.messages.all().order_by("-id")
+	"""
+	List the messages in the user's inbox, newest first.
+	Without attributes, all messages are listed. Optionally, count limits the number of messages, and beforeMessageID continues after the last message of the previous page.
+	"""
+	before_id = _non_negative_int(request, "beforeMessageID")
+	count = _non_negative_int(request, "count")
+	messages = get_inbox(user, before_id=before_id, count=count)
 	return {"messages": messages}
 
 def handle_message_send(user, request):
@@ -0,0 +1,199 @@
+"""
+Instrumentation of the webservice.
+For every request type, the time spent in each stage of a webservice call is recorded in a histogram, together with the number of SQL queries made and the time spent executing them.
+Recording only adds a few counters per request, so it's on by default. Set the MLN_WEBSERVICE_METRICS setting to False to turn it off.
+
+Metrics are aggregated in memory per process. If the MLN_WEBSERVICE_METRICS_DIR setting is set, every process also writes a snapshot of its metrics to a file in that directory from time to time, so that metrics of all server processes can be read with "manage.py webservice_stats".
+Snapshots of processes that have exited, or that haven't been written for STALE_SNAPSHOT_AGE, are deleted when snapshots are read, so that restarted workers aren't counted twice.
+The admin-only webservice_stats endpoint returns the same data as JSON.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+"""Stages of a webservice call, in order."""
+STAGES = "decrypt", "parse", "handler", "render", "encrypt"
+"""Upper bounds of the histogram buckets in milliseconds. There's an additional bucket for everything slower than the last bound."""
+BUCKETS = 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000
+"""Minimum time between two snapshot writes of a process, in seconds."""
+FLUSH_INTERVAL = 10
+"""Snapshots that haven't been written for this long, in seconds, are considered to belong to processes that are gone."""
+STALE_SNAPSHOT_AGE = 24 * 60 * 60
+
+_lock = threading.Lock()
+_stats = {}
+_last_flush = time.monotonic()
+
+class RequestTimer:
+	"""Timings and SQL statistics of a single webservice call."""
+	def __init__(self):
+		self.request_type = None
+		self.is_error = False
+		self.stages = {}
+		self.queries = 0
+		self.db_time = 0
+
+	@contextmanager
+	def stage(self, name):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - start
+
+	def execute_wrapper(self, execute, sql, params, many, context):
+		"""Database execute wrapper (see connection.execute_wrapper) counting queries and DB time."""
+		start = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.queries += 1
+			self.db_time += time.perf_counter() - start
+
+	def record(self):
+		"""Add this call to the metrics of its request type."""
+		if self.request_type is None or not getattr(settings, "MLN_WEBSERVICE_METRICS", True):
+			return
+		with _lock:
+			stats = _stats.get(self.request_type)
+			if stats is None:
+				stats = _stats[self.request_type] = _new_stats()
+			stats["requests"] += 1
+			stats["errors"] += self.is_error
+			stats["queries"] += self.queries
+			stats["db_time_ms"] += self.db_time * 1000
+			for name, seconds in self.stages.items():
+				histogram = stats["stages"][name]
+				ms = seconds * 1000
+				histogram["count"] += 1
+				histogram["total_ms"] += ms
+				histogram["buckets"][bisect_left(BUCKETS, ms)] += 1
+		_maybe_flush()
+
+def _new_stats():
+	return {
+		"requests": 0,
+		"errors": 0,
+		"queries": 0,
+		"db_time_ms": 0.0,
+		"stages": {name: {"count": 0, "total_ms": 0.0, "buckets": [0] * (len(BUCKETS) + 1)} for name in STAGES},
+	}
+
+def _merge_stats(into, stats):
+	for key in ("requests", "errors", "queries", "db_time_ms"):
+		into[key] += stats[key]
+	for name, histogram in stats["stages"].items():
+		into_histogram = into["stages"][name]
+		into_histogram["count"] += histogram["count"]
+		into_histogram["total_ms"] += histogram["total_ms"]
+		into_histogram["buckets"] = [a + b for a, b in zip(into_histogram["buckets"], histogram["buckets"])]
+
+def merge(*snapshots):
+	"""Merge snapshots (as returned by get_snapshot) into one."""
+	request_types = {}
+	for snapshot in snapshots:
+		for request_type, stats in snapshot["request_types"].items():
+			if request_type not in request_types:
+				request_types[request_type] = _new_stats()
+			_merge_stats(request_types[request_type], stats)
+	return {"buckets_ms": list(BUCKETS), "request_types": request_types}
+
+def get_snapshot():
+	"""Get the metrics of this process."""
+	with _lock:
+		return merge({"request_types": _stats})
+
+def reset():
+	"""Clear the metrics of this process."""
+	with _lock:
+		_stats.clear()
+
+def percentile(histogram, q):
+	"""
+	Estimate the q-th percentile (0 < q <= 100) of a histogram in milliseconds, as the upper bound of the bucket it falls into.
+	Returns None if the histogram is empty, and infinity if the percentile falls into the last bucket.
+	"""
+	if histogram["count"] == 0:
+		return None
+	rank = histogram["count"] * q / 100
+	seen = 0
+	for bound, count in zip(BUCKETS, histogram["buckets"]):
+		seen += count
+		if seen >= rank:
+			return bound
+	return float("inf")
+
+# Snapshot files, so that the metrics of all server processes can be read from one place
+
+def _snapshot_path(directory, pid):
+	return os.path.join(directory, "%i.json" % pid)
+
+def flush():
+	"""Write the snapshot of this process to the MLN_WEBSERVICE_METRICS_DIR directory."""
+	global _last_flush
+	directory = getattr(settings, "MLN_WEBSERVICE_METRICS_DIR", None)
+	if directory is None:
+		return
+	_last_flush = time.monotonic()
+	os.makedirs(directory, exist_ok=True)
+	path = _snapshot_path(directory, os.getpid())
+	# write to a temporary file first so that readers never see a partial snapshot
+	with open(path+".tmp", "w") as file:
+		json.dump(get_snapshot(), file)
+	os.replace(path+".tmp", path)
+
+def _maybe_flush():
+	if time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+		flush()
+
+def _process_exists(pid):
+	if os.name != "posix":
+		return True  # os.kill would terminate the process on Windows, rely on the snapshot age there
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:
+		pass  # exists, but belongs to another user
+	return True
+
+def _is_stale(path, pid):
+	return not _process_exists(pid) or time.time() - os.path.getmtime(path) > STALE_SNAPSHOT_AGE
+
+def read_snapshots():
+	"""
+	Read and merge the snapshots of all processes. The snapshot of this process is taken from memory instead of its (possibly outdated) file.
+	Stale snapshots are deleted instead (see _is_stale).
+	"""
+	snapshots = [get_snapshot()]
+	directory = getattr(settings, "MLN_WEBSERVICE_METRICS_DIR", None)
+	if directory is not None and os.path.isdir(directory):
+		own_path = _snapshot_path(directory, os.getpid())
+		for name in os.listdir(directory):
+			path = os.path.join(directory, name)
+			stem, extension = os.path.splitext(name)
+			if extension != ".json" or not stem.isdigit() or path == own_path:
+				continue
+			try:
+				if _is_stale(path, int(stem)):
+					os.remove(path)
+					continue
+				with open(path) as file:
+					snapshots.append(json.load(file))
+			except FileNotFoundError:
+				pass  # deleted by another process in the meantime
+	return merge(*snapshots)
+
+def delete_snapshots():
+	"""Delete the snapshot files of all processes, and clear the metrics of this process."""
+	reset()
+	directory = getattr(settings, "MLN_WEBSERVICE_METRICS_DIR", None)
+	if directory is not None and os.path.isdir(directory):
+		for name in os.listdir(directory):
+			if name.endswith(".json"):
+				os.remove(os.path.join(directory, name))
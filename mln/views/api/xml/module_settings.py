@@ -2,6 +2,7 @@
 from ....models.dynamic.module_settings import ModuleSaveGeneric, ModuleSaveNetworkerPic, ModuleSaveNetworkerText, ModuleSaveRocketGame, ModuleSaveSoundtrack, ModuleSaveSticker, ModuleSaveUGC, ModuleSetupFriendShare, ModuleSetupGroupPerformance, ModuleSetupTrade, ModuleSetupTrioPerformance, RocketGameTheme
 from ....models.dynamic.module_settings_arcade import DestructoidBlockSkin, DestructoidCharacterSkin, HopArcadeElement, ModuleSaveConcertArcade, ModuleSaveDeliveryArcade, ModuleSaveDestructoidArcade, ModuleSaveHopArcade
 from ....services.module_settings import create_or_update, get_or_create_module
+from ....services.page import bump_page_versions
 
 def _deserialize_concert_arcade(save, setup):
 	attrs = {}
@@ -227,4 +228,5 @@ def handle_module_save_settings(user, request):
 	setup = request.find("result/setup")
 	for cls in module.get_settings_classes():
 		_deserialize_cls(cls, module, save, setup)
+	bump_page_versions(user.id)
 	return {"module": module}
@@ -1,20 +1,52 @@
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 
 from ....models.dynamic import get_or_none, Friendship, FriendshipStatus
+from ....models.dynamic.module import calc_yields
+from ....models.dynamic.module_settings import ModuleSaveSticker
 from ....models.static import ItemType
-from ....services.page import page_save_layout
+from ....services.page import get_public_page, page_save_layout
+from ....templatetags.mln_utils import get_trophies, get_valid_modules, render_to_string_stripped
+from .writers import use_writer, write_page
 
-def handle_page_get_new(viewing_user, request):
-	page_owner_name = request.get("pageOwner")
-	is_private_view = page_owner_name is None
-	if is_private_view:
-		page_owner = viewing_user
-	else:
-		page_owner = User.objects.get(username=page_owner_name)
+PAGE_GET_NEW_TEMPLATE = "mln/api/xml/page/page_get_new.xml"
 
-	viewing_own = not is_private_view and page_owner == viewing_user
+"""
+Module relations read by the module settings writers and templates.
+The one-to-one settings are joined in, the many-valued ones are prefetched, so that loading a page's modules takes a fixed number of queries.
+"""
+MODULE_SELECT_RELATED = (
+	"save_concert_arcade",
+	"save_delivery_arcade",
+	"save_destructoid_arcade",
+	"save_generic",
+	"save_hop_arcade",
+	"save_networker_pic",
+	"save_networker_text",
+	"save_rocket_game",
+	"save_soundtrack",
+	"save_ugc",
+	"setup_friend_share__friend",
+	"setup_group_performance",
+	"setup_trade__give_item",
+	"setup_trade__request_item",
+	"setup_trio_performance",
+)
+
+def load_page_modules(page_owner):
+	"""Load the modules on a page, with all settings needed to write them."""
+	modules = get_valid_modules(page_owner).select_related(*MODULE_SELECT_RELATED).prefetch_related(
+		Prefetch("save_sticker", queryset=ModuleSaveSticker.objects.select_related("item")),
+		"tiles",
+	)
+	modules = list(modules)
+	# is_clickable checks the owner's profile, which is the same for all modules
+	for module in modules:
+		module.owner = page_owner
+	return modules
 
-	# needed to display friend list (both private and public)
+def _load_friends(page_owner, is_private_view, viewing_own):
+	"""Load the friend list of a page, as (friendship, friend, status) tuples."""
 	friends = []
 	if page_owner.profile.is_networker:
 		incoming = page_owner.incoming_friendships.filter(from_user__profile__is_networker=True)
@@ -22,6 +54,9 @@ def handle_page_get_new(viewing_user, request):
 	else:
 		incoming = page_owner.incoming_friendships.all()
 		outgoing = page_owner.outgoing_friendships.all()
+	# the friend list shows the friends' profiles, fetch them along with the friendships
+	incoming = incoming.select_related("from_user__profile")
+	outgoing = outgoing.select_related("to_user__profile")
 
 	for friendlist, is_from in ((outgoing, True), (incoming, False)):
 		for friendship in friendlist:
@@ -42,6 +77,46 @@ def handle_page_get_new(viewing_user, request):
 				status = FriendshipStatus(friendship.status).name.title()
 			friends.append((friendship, friend, status))
 
+	# For public views, exclude friends who are both networkers and marked as secret.
+	# Secret networkers can still see their own complete friend list.
+	if not is_private_view and not viewing_own:
+		friends = [
+			(friendship, friend, status)
+			for (friendship, friend, status) in friends
+			if not (friend.profile.is_networker and friend.profile.is_secret)
+		]
+	return friends
+
+def _load_page(context, viewing_own):
+	"""Load the data of the part of the page about the page owner into the context."""
+	page_owner = context["page_owner"]
+	is_private_view = context["is_private_view"]
+	context["friends"] = _load_friends(page_owner, is_private_view, viewing_own)
+	context["modules"] = load_page_modules(page_owner)
+	if viewing_own:
+		# the owner sees the yields of their modules, all calculated for the same point in time
+		context["yields"] = calc_yields(context["modules"])
+	if not is_private_view:
+		context["badges"] = page_owner.inventory.filter(item__type=ItemType.BADGE)
+		context["trophies"] = get_trophies(page_owner)
+
+def _render_public_page(context):
+	context = dict(context)
+	_load_page(context, False)
+	if use_writer("PageGetNew", PAGE_GET_NEW_TEMPLATE):
+		return write_page(context)
+	return render_to_string_stripped("mln/api/xml/page/page.xml", context)
+
+def handle_page_get_new(viewing_user, request):
+	page_owner_name = request.get("pageOwner")
+	is_private_view = page_owner_name is None
+	if is_private_view:
+		page_owner = viewing_user
+	else:
+		page_owner = User.objects.select_related("profile").get(username=page_owner_name)
+
+	viewing_own = not is_private_view and page_owner == viewing_user
+
 	friendship_status = None
 	if viewing_user.is_authenticated:
 		viewing_user.profile.update_available_votes()
@@ -59,15 +134,6 @@ def handle_page_get_new(viewing_user, request):
 					else:
 						friendship_status = "Pending In"
 
-	# For public views, exclude friends who are both networkers and marked as secret.
-	# Secret networkers can still see their own complete friend list.
-	if not is_private_view and not viewing_own:
-		friends = [
-			(friendship, friend, status)
-			for (friendship, friend, status) in friends
-			if not (friend.profile.is_networker and friend.profile.is_secret)
-		]
-
 	context = {
 		"page_owner": page_owner,
 		"viewing_user": viewing_user,
@@ -75,14 +141,18 @@ def handle_page_get_new(viewing_user, request):
 		# Code cannot safely check "not is_private_view" because it may be None elsewhere
 		# Code can safely check "is_public_view" anywhere because it'll only exist here
 		"is_public_view": not is_private_view,
-		"calc_yield": viewing_own,
-		"friends": friends,
-		"friendship_status": friendship_status
+		"friendship_status": friendship_status,
 	}
 
-	if not is_private_view:
-		context["badges"] = page_owner.inventory.filter(item__type=ItemType.BADGE)
+	if viewing_user.is_authenticated:
+		# needed to display inventory (private) and for trade modules (public)
+		context["inventory"] = viewing_user.inventory.select_related("item")
 
+	if is_private_view or viewing_own:
+		_load_page(context, viewing_own)
+	else:
+		# other people's public views of the page only differ in the viewer part, the rest is cached
+		context["public_page"] = get_public_page(page_owner.id, lambda: _render_public_page(context))
 	return context
 
 def handle_page_save_layout(user, request):
@@ -99,7 +169,7 @@ def handle_page_save_layout(user, request):
 		pos_y = int(details.get("posy"))
 		modules.append((instance_id, item_id, pos_x, pos_y))
 	page_save_layout(user, modules)
-	return {"user": user}
+	return {"user": user, "modules": load_page_modules(user)}
 
 def handle_page_save_options(user, request):
 	settings = request.find("result/settings/color")
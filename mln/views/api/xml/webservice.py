@@ -7,20 +7,25 @@ This module is responsible for decrypting requests, dispatching the requests to
 """
 import base64
 import logging
+import time
 import xml.etree.ElementTree as et
 
-from django.conf import settings
-from django.http import HttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connection
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from ....models.static import MLNError
 from ....templatetags.mln_utils import render_to_string_stripped
+from . import capture, metrics
+from .cipher import get_codec
 from .friend import handle_friend_process_blocking, handle_friend_process_invitation, handle_friend_remove_member, handle_friend_send_invitation
-from .page import handle_page_get_new, handle_page_save_layout, handle_page_save_options
+from .page import handle_page_get_new, handle_page_save_layout, handle_page_save_options, PAGE_GET_NEW_TEMPLATE
 from .misc import handle_blueprint_use, handle_inventory_module_get, handle_user_get_my_avatar, handle_user_save_my_avatar, handle_user_save_my_statements
 from .message import handle_message_delete, handle_message_detach, handle_message_easy_reply, handle_message_easy_reply_with_attachments, handle_message_get, handle_message_list, handle_message_send, handle_message_send_with_attachment
 from .module import handle_get_module_bgs, handle_module_click, handle_module_collect_winnings, handle_module_details, handle_module_harvest, handle_module_setup, handle_module_teardown
 from .module_settings import handle_module_save_settings
+from .writers import use_writer, write_response
 
 log = logging.getLogger(__name__)
 
@@ -40,7 +45,7 @@ handlers = {
 	"FriendSendInvitation": handle_friend_send_invitation,
 	"getModuleBgs": (handle_get_module_bgs, "mln/api/xml/module/get_module_bgs.xml"),
 	"InventoryModuleGet": (handle_inventory_module_get, "mln/api/xml/misc/inventory_module_get.xml"),
-	"PageGetNew": (handle_page_get_new, "mln/api/xml/page/page_get_new.xml"),
+	"PageGetNew": (handle_page_get_new, PAGE_GET_NEW_TEMPLATE),
 	"PageSaveLayout": (handle_page_save_layout, "mln/api/xml/page/page_save_layout.xml"),
 	"PageSaveOptions": handle_page_save_options,
 	"MessageDelete": handle_message_delete,
@@ -66,12 +71,25 @@ handlers = {
 
 @csrf_exempt
 def webservice(request):
-	data = _decrypt(request.POST["input"])
-	out = _webservice_unencrypted(request.user, data)
-	out = out.encode()
-	out = _encrypt(out)
+	start_time = time.time()
+	start = time.perf_counter()
+	timer = metrics.RequestTimer()
+	with timer.stage("decrypt"):
+		data = _decrypt(request.POST["input"])
+	out = _webservice_unencrypted(request.user, data, timer)
+	with timer.stage("encrypt"):
+		out = out.encode()
+		out = _encrypt(out)
+	timer.record()
+	if capture.is_enabled():
+		capture.capture(request.user, data.decode(), start_time, time.perf_counter() - start)
 	return HttpResponse(out)
 
+@staff_member_required
+def webservice_stats(request):
+	"""Metrics of all webservice request types, see metrics.py."""
+	return JsonResponse(metrics.read_snapshots())
+
 @csrf_exempt
 def award_giver(request):
 	raw = request.POST["id"]
@@ -88,11 +106,23 @@ def award_giver(request):
 		case _:
 			return HttpResponse(status=400)
 
-def _webservice_unencrypted(user, data):
+def _webservice_unencrypted(user, data, timer=None):
+	"""
+	Handle a decrypted request and return the response.
+	If a timer is passed, the parse, handler and render stages are timed with it and the caller is responsible for recording it, otherwise the call is recorded on its own.
+	"""
+	if timer is None:
+		timer = metrics.RequestTimer()
+		out = _webservice_unencrypted(user, data, timer)
+		timer.record()
+		return out
+
 	log.debug(data)
-	xml_request = et.fromstring(data)
-	assert xml_request.tag == "request"
-	request_type = xml_request.get("type")
+	with timer.stage("parse"):
+		xml_request = et.fromstring(data)
+		assert xml_request.tag == "request"
+		request_type = xml_request.get("type")
+	timer.request_type = request_type
 
 	log.info("Request type %s", request_type)
 
@@ -100,26 +130,33 @@ def _webservice_unencrypted(user, data):
 	extra_context = None
 	error_msg = None
 
-	try:
-		if request_type not in handlers:
-			raise RuntimeError("Request type is unhandled!")
-		handler = handlers[request_type]
-		if isinstance(handler, tuple):
-			handler, template = handler
-		extra_context = handler(user, xml_request)
-	except MLNError as e:
-		error_msg = e.id
-	except Exception as e:
-		log.exception("Error in handler for %s", request_type)
-		error_msg = MLNError.OPERATION_FAILED
-
-	context = {"request_type": request_type, "error_msg": error_msg}
-	if template is not None:
-		if extra_context is not None:
-			context.update(extra_context)
-	else:
-		template = "mln/api/xml/base.xml"
-	out = render_to_string_stripped(template, context)
+	with connection.execute_wrapper(timer.execute_wrapper):
+		with timer.stage("handler"):
+			try:
+				if request_type not in handlers:
+					raise RuntimeError("Request type is unhandled!")
+				handler = handlers[request_type]
+				if isinstance(handler, tuple):
+					handler, template = handler
+				extra_context = handler(user, xml_request)
+			except MLNError as e:
+				error_msg = e.id
+			except Exception as e:
+				log.exception("Error in handler for %s", request_type)
+				error_msg = MLNError.OPERATION_FAILED
+		timer.is_error = error_msg is not None
+
+		with timer.stage("render"):
+			context = {"request_type": request_type, "error_msg": error_msg}
+			if template is not None:
+				if extra_context is not None:
+					context.update(extra_context)
+			else:
+				template = "mln/api/xml/base.xml"
+			if use_writer(request_type, template):
+				out = write_response(context)
+			else:
+				out = render_to_string_stripped(template, context)
 
 	log.debug(out)
 	return out
@@ -128,10 +165,7 @@ ENCRYPTION_KEY = b"0e0 t00e0-0 i etiaonmld"
 ROCKET_MODULE_ENCRYPTION_KEY = b"13bv9cyruhnflksjhtf+p1q"
 
 def _xor(data, key=ENCRYPTION_KEY):
-	res = bytearray(len(data))
-	for i in range(len(data)):
-		res[i] = data[i] ^ key[i % len(key)]
-	return res
+	return get_codec()(data, key)
 
 def _decrypt(data, key=ENCRYPTION_KEY):
 	return _xor(base64.b64decode(data), key=key)
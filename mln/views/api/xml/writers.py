@@ -0,0 +1,378 @@
+"""
+Code-based response writers, a faster alternative to rendering the response templates.
+Each writer mirrors one of the templates in mln/api/xml and produces byte-identical output (after the whitespace stripping of the "mln_xml" engine).
+Writers are generators of string fragments, taking the same context the template would be rendered with.
+The templates stay the reference implementation: if you change a template, change its writer as well. The req/resp tests check both.
+"""
+from django.conf import settings
+from django.utils.formats import localize
+from django.utils.html import conditional_escape
+
+from ....models.dynamic.module_settings import ModuleSaveGeneric, ModuleSaveNetworkerPic, ModuleSaveNetworkerText, ModuleSaveRocketGame, ModuleSaveSoundtrack, ModuleSaveSticker, ModuleSaveUGC, ModuleSetupFriendShare, ModuleSetupGroupPerformance, ModuleSetupTrade, ModuleSetupTrioPerformance
+from ....models.dynamic.module_settings_arcade import ModuleSaveConcertArcade, ModuleSaveDeliveryArcade, ModuleSaveDestructoidArcade, ModuleSaveHopArcade
+from ....templatetags.mln_utils import get_avatar, get_concert_arcade_arrows, get_delivery_checkpoints, get_delivery_tile_name, get_destructoid_arcade_grid, get_destructoid_arcade_skins, get_hop_arcade_grid, get_save_soundtrack, is_background, replyable
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="no" ?>'
+
+def _value(value):
+	"""Format a value the same way the template engine formats {{ value }}."""
+	# ids and quantities make up most values, and localizing them only groups thousands, so skip the formats lookup if that's off
+	if type(value) is int and not settings.USE_THOUSAND_SEPARATOR:
+		return str(value)
+	return conditional_escape(localize(value))
+
+def _bool(value):
+	return "true" if value else "false"
+
+# Module settings, see mln/api/xml/module/settings
+
+def _write_concert_arcade(module):
+	save = getattr(module, "save_concert_arcade", None)
+	if save is None:
+		return
+	yield '<gameSetting ownerPlayed="%s" skins="m_bg_%s,m_arrowSet_%s">' % (_bool(save.owner_played), _value(save.background_skin), _value(save.arrowset_skin))
+	yield from _write_soundtrack(module)
+	for line in get_concert_arcade_arrows(module):
+		yield "<concertLines>"
+		for arrow in line:
+			yield '<arrow type="%s"/>' % _value(arrow)
+		yield "</concertLines>"
+	yield "</gameSetting>"
+
+def _write_delivery_arcade(module):
+	save = getattr(module, "save_delivery_arcade", None)
+	if save is None:
+		return
+	yield '<gameSetting ownerPlayed="%s" timer="%s">' % (_bool(save.owner_played), _value(save.timer))
+	for tile in module.tiles.all():
+		yield '<tile t="%s" x="%s" y="%s"/>' % (_value(get_delivery_tile_name(tile)), _value(tile.x), _value(tile.y))
+	for id, x, y in get_delivery_checkpoints(save):
+		yield '<cp t="%s" x="%s" y="%s"/>' % (_value(id), _value(x), _value(y))
+	yield "</gameSetting>"
+
+def _write_destructoid_arcade(module):
+	save = getattr(module, "save_destructoid_arcade", None)
+	if save is None:
+		return
+	yield '<gameSetting ownerPlayed="%s" energyUsed="%s" skins="%s">' % (_bool(save.owner_played), _value(save.energy_used), _value(get_destructoid_arcade_skins(module)))
+	for column in get_destructoid_arcade_grid(module):
+		yield "<column>"
+		for row in column:
+			yield '<row density="%s"/>' % _value(row)
+		yield "</column>"
+	yield "</gameSetting>"
+
+def _write_hop_arcade(module):
+	save = getattr(module, "save_hop_arcade", None)
+	if save is None:
+		return
+	yield '<gameSetting ownerPlayed="%s">' % _bool(save.owner_played)
+	for column in get_hop_arcade_grid(module):
+		yield "<column>"
+		for row in column:
+			yield '<row frame="%s"/>' % _value(row)
+		yield "</column>"
+	yield "</gameSetting>"
+
+def _write_networker_pic(module):
+	save = getattr(module, "save_networker_pic", None)
+	if save is not None:
+		yield '<Movieclip id="%s" _x="360" _y="95" _xscale="100" _yscale="100" _rotation="0" depth="0"/>' % _value(save.picture_id)
+
+def _write_networker_text(module):
+	save = getattr(module, "save_networker_text", None)
+	if save is not None:
+		yield "<text>%s</text>" % _value(save.text)
+
+def _write_rocket_game(module):
+	save = getattr(module, "save_rocket_game", None)
+	if save is not None:
+		yield "<theme>%s</theme>" % _value(save.get_theme_display())
+
+def _write_soundtrack(module):
+	for track in get_save_soundtrack(module):
+		yield "<track>"
+		for id, pan in track:
+			yield '<Sound id="%s" pan="%s"/>' % (_value(id), _value(pan))
+		yield "</track>"
+
+def _write_sticker(module):
+	for sticker in module.save_sticker.all():
+		yield "<Movieclip "
+		if is_background(sticker):
+			yield ' b_bg="True" '
+		yield ' id="%s" _x="%s" _y="%s" _xscale="%s" _yscale="%s" _rotation="%s" depth="%s"/>' % (_value(sticker.item_id), _value(sticker.x), _value(sticker.y), _value(sticker.scale_x), _value(sticker.scale_y), _value(sticker.rotation), _value(sticker.depth))
+
+def _write_ugc(module):
+	save = getattr(module, "save_ugc", None)
+	if save is not None:
+		yield '<Movieclip id="%s"/>' % _value(save.ref)
+
+def _write_friend_share(module):
+	setup = getattr(module, "setup_friend_share", None)
+	if setup is not None:
+		yield '<friend friendUsername="%s" friendID="%s"/>' % (_value(setup.friend.username), _value(setup.friend_id))
+
+def _write_group_performance(module):
+	setup = getattr(module, "setup_group_performance", None)
+	if setup is not None:
+		for friend_id in (setup.friend_0_id, setup.friend_1_id, setup.friend_2_id):
+			yield '<friend friendID="%s"/>' % _value(friend_id)
+
+def _write_trade(module):
+	setup = getattr(module, "setup_trade", None)
+	if setup is not None:
+		yield '<item type="Give" itemID="%s" qty="%s" itemType="%s"/>' % (_value(setup.give_item_id), _value(setup.give_qty), _value(setup.give_item.type.name.lower()))
+		yield '<item type="Request" itemID="%s" qty="%s" itemType="%s"/>' % (_value(setup.request_item_id), _value(setup.request_qty), _value(setup.request_item.type.name.lower()))
+
+def _write_trio_performance(module):
+	setup = getattr(module, "setup_trio_performance", None)
+	if setup is not None:
+		for friend_id in (setup.friend_0_id, setup.friend_1_id):
+			yield '<friend friendID="%s"/>' % _value(friend_id)
+
+"""Settings writers, equivalent to SAVE_TEMPLATES and SETUP_TEMPLATES in mln_utils."""
+SAVE_WRITERS = {
+	ModuleSaveConcertArcade: _write_concert_arcade,
+	ModuleSaveDeliveryArcade: _write_delivery_arcade,
+	ModuleSaveDestructoidArcade: _write_destructoid_arcade,
+	ModuleSaveHopArcade: _write_hop_arcade,
+	ModuleSaveNetworkerPic: _write_networker_pic,
+	ModuleSaveNetworkerText: _write_networker_text,
+	ModuleSaveSoundtrack: _write_soundtrack,
+	ModuleSaveSticker: _write_sticker,
+	ModuleSaveRocketGame: _write_rocket_game,
+	ModuleSaveUGC: _write_ugc,
+}
+SETUP_WRITERS = {
+	ModuleSetupFriendShare: _write_friend_share,
+	ModuleSetupGroupPerformance: _write_group_performance,
+	ModuleSetupTrade: _write_trade,
+	ModuleSetupTrioPerformance: _write_trio_performance,
+}
+
+def _write_module_settings(module):
+	# same as get_generic_settings, but only looking up the settings classes once
+	classes = module.get_settings_classes()
+	yield "<save "
+	if ModuleSaveGeneric in classes:
+		save = getattr(module, "save_generic", None)
+		if save is not None:
+			if save.skin_id is not None:
+				yield ' skin="%s" ' % _value(save.skin_id)
+			if save.color_id is not None:
+				yield ' color="%s" ' % _value(save.color_id)
+	yield ">"
+	for cls in classes:
+		if cls in SAVE_WRITERS:
+			yield from SAVE_WRITERS[cls](module)
+	yield "</save><setup>"
+	for cls in classes:
+		if cls in SETUP_WRITERS:
+			yield from SETUP_WRITERS[cls](module)
+	yield "</setup>"
+
+# Pages, see mln/api/xml/page
+
+def _write_page_modules(modules, page_owner, viewing_user, is_public_view, yields, trophies):
+	for module in modules:
+		yield '<item type="module" itemID="%s" instanceID="%s" ' % (_value(module.item_id), _value(module.id))
+		# This is a little tricky because not all clickable modules actually need setup.
+		# We want the owner to not take it down but viewers to be able to click.
+		if page_owner == viewing_user and module.is_setup:
+			yield ' isSetup="True" '
+		elif page_owner != viewing_user and module.is_clickable():
+			yield ' isSetup="True" '
+		yield ">"
+		if is_public_view:
+			yield "<trophyItems>"
+			for trophy in trophies:
+				yield '<item itemID="%s"></item>' % _value(trophy.id)
+			yield "</trophyItems>"
+		yield '<details posx="%s" posy="%s"/>' % (_value(module.pos_x), _value(module.pos_y))
+		if yields is not None:
+			yield_item_id, yield_item_qty = yields[module.id][:2]
+			if yield_item_qty > 0:
+				yield '<items><item itemID="%s" qty="%s"/></items>' % (_value(yield_item_id), _value(yield_item_qty))
+		yield from _write_module_settings(module)
+		yield "</item>"
+
+def _write_page(context):
+	page_owner = context["page_owner"]
+	viewing_user = context["viewing_user"]
+	is_private_view = context["is_private_view"]
+	profile = page_owner.profile
+	yield "<items>"
+	yield from _write_page_modules(context["modules"], page_owner, viewing_user, context["is_public_view"], context.get("yields"), context.get("trophies"))
+	yield "</items>"
+	# needed to save settings about the page (both private and public)
+	yield "<settings><color "
+	if profile.page_skin_id is not None:
+		yield ' skinID="%s" ' % _value(profile.page_skin_id)
+	if profile.page_color_id is not None:
+		yield ' colorID="%s" ' % _value(profile.page_color_id)
+	if profile.page_column_color_id is not None:
+		yield ' columnColorID="%s" ' % _value(profile.page_column_color_id)
+	yield "/></settings>"
+	# needed to display username, avatar and rank on pages
+	yield '<userProfile userName="%s" gameRank="%s" avatar="%s">' % (_value(page_owner.username), _value(profile.rank), _value(get_avatar(profile)))
+	yield "<statements>"
+	about_me = getattr(page_owner, "about_me", None)
+	if about_me is not None:
+		for i in range(6):
+			yield '<statement question="%s" answer="%s"/>' % (_value(getattr(about_me, "question_%i_id" % i)), _value(getattr(about_me, "answer_%i_id" % i)))
+	yield "</statements></userProfile>"
+	# needed to display friend list (both private and public)
+	yield "<friends>"
+	for friendship, friend, status in context["friends"]:
+		yield '<friend friendUserName="%s" avatar="%s" rank="%s" status="%s" ' % (_value(friend.username), _value(get_avatar(friend.profile)), _value(friend.profile.rank), _value(status))
+		yield ' friendID="%s" ' % _value(friend.id)
+		if is_private_view:
+			yield ' relationID="%s" ' % _value(friendship.id)
+		yield "/>"
+	yield "</friends>"
+	if is_private_view:
+		yield '<personalStats><page votes="42" daysSinceSignUp="42"/></personalStats>'
+	else:
+		yield "<badges>"
+		for badge in context["badges"]:
+			yield '<badge id="%s"/>' % _value(badge.item_id)
+		yield "</badges>"
+
+def write_page(context):
+	"""Write the part of the PageGetNew response about the page owner, equivalent to rendering page/page.xml."""
+	return "".join(_write_page(context))
+
+def _write_page_get_new(context):
+	page_owner = context["page_owner"]
+	viewing_user = context["viewing_user"]
+	is_private_view = context["is_private_view"]
+	public_page = context.get("public_page")
+	if public_page is not None:
+		yield public_page
+	else:
+		yield from _write_page(context)
+	if viewing_user.is_authenticated:
+		yield "<user>"
+		if not is_private_view:
+			viewing_profile = viewing_user.profile
+			yield '<userProfile userName="%s" gameRank="%s" votesAvailable="%s"/>' % (_value(viewing_user.username), _value(viewing_profile.rank), _value(viewing_profile.available_votes))
+			yield "<friends>"
+			friendship_status = context["friendship_status"]
+			if friendship_status is not None:
+				yield '<friend friendUserName="%s" status="%s"/>' % (_value(page_owner.username), _value(friendship_status))
+			yield "</friends>"
+		# needed to display inventory (private) and for trade modules (public)
+		yield "<inventory><items>"
+		for stack in context["inventory"]:
+			yield '<item id="%s" qty="%s" type="%s"/>' % (_value(stack.item_id), _value(stack.qty), _value(stack.item.type.name.lower()))
+		yield "</items></inventory></user>"
+
+def _write_page_save_layout(context):
+	yield from _write_page_modules(context["modules"], context["user"], context.get("viewing_user"), context.get("is_public_view"), context.get("yields"), context.get("trophies"))
+
+# Messages, see mln/api/xml/message
+
+def _write_message_get(context):
+	message = context["message"]
+	yield '<message senderMemberID="%s" senderMemberAvatar="%s" bodyID="%s"><attachments>' % (_value(message.sender.id), _value(get_avatar(message.sender.profile)), _value(message.body_id))
+	for attachment in message.attachments.all():
+		yield '<attachment itemID="%s" qty="%s"/>' % (_value(attachment.item_id), _value(attachment.qty))
+	yield "</attachments></message>"
+
+def _write_message_list(context):
+	yield "<messages>"
+	for message in context["messages"]:
+		yield '<message messageID="%s" username="%s" bodyID="%s" read="%s" hasAttachment="%s" replyAble="%s" ' % (_value(message.id), _value(message.sender.username), _value(message.body_id), _value(message.is_read), _value(message.has_attachments), _value(replyable(message)))
+		if message.reply_body_id is not None:
+			yield ' replyBodyID="%s" ' % _value(message.reply_body_id)
+		yield "/>"
+	yield "</messages>"
+
+# Misc, see mln/api/xml/misc
+
+def _write_inventory_module_get(context):
+	yield "<items>"
+	for item_id, qty in context["module_stacks"]:
+		yield '<item itemID="%s" qty="%s"/>' % (_value(item_id), _value(qty))
+	yield "</items>"
+
+def _write_user_get_my_avatar(context):
+	yield '<userProfile avatar="%s"/>' % _value(get_avatar(context["user"].profile))
+
+# Modules, see mln/api/xml/module
+
+def _write_get_module_bgs(context):
+	for id in context["backgrounds"]:
+		yield '<item id="%s"/>' % _value(id)
+
+def _write_module_click(context):
+	yield '<votes remaining="%s"/>' % _value(context["available_votes"])
+	yield '<moduleState isSetup="%s"/>' % _value(context["module"].is_clickable())
+	result = context["result"]
+	if result:
+		yield '<competitionResult guestWon="True"/><inventory><added itemid="%s" qty="%s"/></inventory>' % (_value(result.item_id), _value(result.qty))
+	else:
+		yield '<competitionResult guestWon="False"/>'
+
+def _write_module_collect_winnings(context):
+	if context["won"]:
+		prize = context["prize"]
+		yield '<inventory><added itemid="%s" qty="%s"/></inventory>' % (_value(prize.item_id), _value(prize.qty))
+
+def _write_module_details(context):
+	module = context["module"]
+	yield '<item itemID="%s" instanceID="%s"><settings>' % (_value(module.item_id), _value(module.id))
+	yield from _write_module_settings(module)
+	yield "</settings></item>"
+
+def _write_module_save_settings(context):
+	yield '<moduleInstance instanceID="%s"/>' % _value(context["module"].id)
+
+"""
+Writer registry, request type -> writer of the response content.
+Request types without an entry here only get the base response, like with the base.xml template.
+"""
+writers = {
+	"getModuleBgs": _write_get_module_bgs,
+	"InventoryModuleGet": _write_inventory_module_get,
+	"PageGetNew": _write_page_get_new,
+	"PageSaveLayout": _write_page_save_layout,
+	"MessageGet": _write_message_get,
+	"MessageList": _write_message_list,
+	"ModuleCollectWinnings": _write_module_collect_winnings,
+	"ModuleDetails": _write_module_details,
+	"ModuleExecute": _write_module_click,
+	"ModuleSaveSettings": _write_module_save_settings,
+	"ModuleVote": _write_module_click,
+	"UserGetMyAvatar": _write_user_get_my_avatar,
+}
+
+def _write_response(context):
+	yield XML_HEADER
+	yield '<response type="%s" ' % _value(context["request_type"])
+	error_msg = context["error_msg"]
+	if error_msg is not None:
+		yield ' status="error" userMessages="%s">' % _value(error_msg)
+	else:
+		yield "><result>"
+		writer = writers.get(context["request_type"])
+		if writer is not None:
+			yield from writer(context)
+		yield "</result>"
+	yield "</response>"
+
+def write_response(context):
+	"""Write the response for the request type in the context, equivalent to rendering the request type's template."""
+	return "".join(_write_response(context))
+
+def use_writer(request_type, template):
+	"""
+	Check whether the response should be written by a writer instead of rendered from the template.
+	Request types with a writer and request types only responding with the base response can be written.
+	The MLN_XML_WRITERS setting is a collection of request types to use writers for, by default all request types that can be written are.
+	"""
+	if request_type not in writers and template != "mln/api/xml/base.xml":
+		return False
+	enabled = getattr(settings, "MLN_XML_WRITERS", None)
+	return enabled is None or request_type in enabled
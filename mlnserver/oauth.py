@@ -8,7 +8,7 @@ from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 
-from mln.models.dynamic import OAuthClient, OAuthCode, OAuthToken, get_or_none
+from mln.models.dynamic import OAuthClient, OAuthCode, OAuthToken, get_or_none, hash_access_token
 from mln.apis.utils import oauth_only, post_json, check_json
 
 AUTH_CODE_EXPIRY = timedelta(minutes=10)
@@ -47,7 +47,7 @@ def get_token(data):
 
   access_token_raw = generate_secure_token()
   user = auth_code.user
-  OAuthToken.objects.create(access_token=access_token_raw, user=user, client=client, auth_code=auth_code)
+  OAuthToken.objects.create(access_token_hash=hash_access_token(access_token_raw), user=user, client=client, auth_code=auth_code)
   body = {
     "access_token": access_token_raw,
     "username": user.username,
@@ -86,6 +86,23 @@ TEMPLATES = [
 			],
 		},
 	},
+	{
+		# XML responses for the flash client, with whitespace stripped when templates are loaded.
+		"NAME": "mln_xml",
+		"BACKEND": "django.template.backends.django.DjangoTemplates",
+		"DIRS": [],
+		"OPTIONS": {
+			"context_processors": [
+				"django.template.context_processors.debug",
+				"django.template.context_processors.request",
+				"django.contrib.auth.context_processors.auth",
+				"django.contrib.messages.context_processors.messages",
+			],
+			"loaders": [
+				("django.template.loaders.cached.Loader", ["mln.template_loaders.Loader"]),
+			],
+		},
+	},
 ]
 
 WSGI_APPLICATION = "mlnserver.wsgi.application"
@@ -104,6 +121,9 @@ DATABASES = {
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
+# Keeps the tests from touching the stamp files below (see mln/tests/runner.py)
+TEST_RUNNER = "mln.tests.runner.TestRunner"
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 
@@ -147,3 +167,31 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
 # Media upload directory for UGC.
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+# Directory the server processes write their webservice metrics to, read by "manage.py webservice_stats", e.g. os.path.join(BASE_DIR, "webservice_metrics").
+# None keeps the metrics of each process in memory only, the webservice_stats endpoint then shows the metrics of the process that serves it.
+MLN_WEBSERVICE_METRICS_DIR = None
+
+# File touched when static data changes, so that all server processes reload their static catalog (see mln/models/static/catalog.py).
+MLN_STATIC_CATALOG_STAMP = os.path.join(BASE_DIR, "static_catalog.stamp")
+
+# Seconds public pages stay cached at most, 0 disables the cache (see mln/services/page.py).
+# Pages are cached in the default cache, and changes only invalidate the pages cached in the cache of the process that made them.
+# Only enable the cache (e.g. with 3600) when running a single server process, or with CACHES configured to a cache shared by all processes, like memcached or redis.
+MLN_PUBLIC_PAGE_CACHE_TIMEOUT = 0
+
+# Webhook requests are queued and sent by "manage.py run_webhook_workers" (see mln/services/webhooks.py).
+# Seconds to wait for a webhook response, the number of attempts before a delivery is given up, and the seconds before the first retry, doubling with each attempt.
+MLN_WEBHOOK_TIMEOUT = 5
+MLN_WEBHOOK_MAX_ATTEMPTS = 5
+MLN_WEBHOOK_RETRY_DELAY = 10
+# Maximum number of events sent in one request to webhooks that opted in to batching.
+MLN_WEBHOOK_BATCH_SIZE = 50
+# File touched when webhooks change, so that all server processes reload their webhook subscription index (see mln/services/webhooks.py).
+MLN_WEBHOOK_INDEX_STAMP = os.path.join(BASE_DIR, "webhook_index.stamp")
+
+# Seconds validated OAuth access tokens stay in the default cache (see mln/apis/utils.py). Revoked tokens are rejected immediately by all server processes.
+MLN_OAUTH_TOKEN_CACHE_TIMEOUT = 300
+# File touched when access tokens are revoked, if each server process has a cache of its own (not with CACHES configured to a shared cache, like memcached or redis).
+# It's checked on every authenticated request, and a revocation drops all tokens cached by all processes.
+MLN_OAUTH_TOKEN_STAMP = os.path.join(BASE_DIR, "oauth_token.stamp")
@@ -10,14 +10,14 @@ def search_all_data(request):
 	Get all gallery images by the requesting user.
 	Requested in the private view for the collections tab and by the module editor to choose an image.
 	"""
-	return render(request, "ugc/search_all_data.xml")
+	return render(request, "ugc/search_all_data.xml", using="mln_xml")
 
 def search_all_data_gallery_item(request):
 	"""
 	Get data of a specific gallery image.
 	Requested by gallery modules to display data.
 	"""
-	return render(request, "ugc/search_all_data_gallery_item.xml", {"image": GalleryImage.objects.get(id=int(request.GET["modelid"]))})
+	return render(request, "ugc/search_all_data_gallery_item.xml", {"image": GalleryImage.objects.get(id=int(request.GET["modelid"]))}, using="mln_xml")
 
 @login_required
 def search_factory_item_list(request):
@@ -25,14 +25,14 @@ def search_factory_item_list(request):
 	Get all factory models by the requesting user.
 	Requested in the private view for the collections tab and by the module editor to choose a model.
 	"""
-	return render(request, "ugc/search_factory_item_list.xml")
+	return render(request, "ugc/search_factory_item_list.xml", using="mln_xml")
 
 def search_factory_item(request):
 	"""
 	Get data of a specific factory model.
 	Requested by factory modules to display data.
 	"""
-	return render(request, "ugc/search_factory_item.xml", {"model": FactoryModel.objects.get(id=int(request.GET["modelid"]))})
+	return render(request, "ugc/search_factory_item.xml", {"model": FactoryModel.objects.get(id=int(request.GET["modelid"]))}, using="mln_xml")
 
 
 @login_required